@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+Created on %(date)s
+
+@author: Treacher
+
+Contains: vectorised backtest of the strategy in strategy.py
+"""
+
+# %%% 0. Notes
+
+'''
+Rather than feeding trade_signal a growing slice of the history one bar at a
+time, the strategy rules are evaluated for every bar at once (see
+strategy.positionSeries) and the returns, equity curve and list of trades are
+worked out from the resulting positions.
+
+Timing convention (same as the bar by bar loop in main.py): the signal from
+the close of bar i-1 sets the position held over bar i, so the position earns
+the close to close return of bar i. There is no look ahead.
+'''
+
+
+# %% 1. Import libraries
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import os
+import numpy as np
+import pandas as pd
+
+import profiling
+import strategy
+import technicalIndicators as ti
+
+
+# %% 2. Single ticker backtest
+
+BacktestResult = namedtuple('BacktestResult', ['trades', 'equity', 'tradeList'])
+
+
+@profiling.timed('backtest.backtest')
+def backtest(dfWithIndicators, adxThreshold=25, holdPositions=True):
+    """
+    Parameters
+    ----------
+    dfWithIndicators : Dataframe
+        ohlcv data with the 'ADX', 'macd' and 'signal' columns added
+    adxThreshold : float
+        ADX level above which the trend is considered significant
+    holdPositions : bool
+        If False, every bar is evaluated as though there is no open position,
+        which reproduces the original quick test loop in main.py
+
+    Returns
+    -------
+    BacktestResult : namedtuple
+        trades : Series
+            Position held over each bar (1 long, 0 flat, -1 short)
+        equity : Series
+            Growth of 1 unit of capital invested in the strategy
+        tradeList : Dataframe
+            One row per trade with entry/exit dates and prices, direction and
+            return. A position still open on the last bar is closed there
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np
+    """
+
+    positions = strategy.positionSeries(dfWithIndicators['ADX'],
+                                        dfWithIndicators['macd'],
+                                        dfWithIndicators['signal'],
+                                        adxThreshold, holdPositions)
+
+    close = dfWithIndicators['close'].to_numpy(dtype=float)
+    held, returns = strategyReturns(positions, close)
+    growth = np.cumprod(1 + returns)
+
+    index = dfWithIndicators.index
+    trades = pd.Series(held, index=index, name='position')
+    equity = pd.Series(growth, index=index, name='equity')
+
+    return BacktestResult(trades, equity, tradeList(held, close, growth, index))
+
+
+def strategyReturns(positions, close):
+    """
+    Parameters
+    ----------
+    positions : numpy array
+        Position decided on the close of each bar (1 long, 0 flat, -1 short),
+        one per bar or (time x combination)
+    close : numpy array
+        Close price of each bar
+
+    Returns
+    -------
+    held : numpy array
+        Position held over each bar - the one decided on the close of the bar
+        before (flat on the first bar), so a signal is never traded on the
+        bar it came from
+    returns : numpy array
+        Strategy return of each bar, held times the close to close return (0
+        where there isn't one)
+
+    Package requirements
+    -------
+    numpy as np
+    """
+
+    held = np.zeros(np.shape(positions), dtype=np.int8)
+    held[1:] = positions[:-1]
+    barReturns = np.zeros(len(close))
+    barReturns[1:] = close[1:]/close[:-1] - 1
+    barReturns = np.nan_to_num(barReturns)
+
+    return held, held*(barReturns[:, None] if held.ndim > 1 else barReturns)
+
+
+def tradeList(held, close, growth, index):
+    """
+    Parameters
+    ----------
+    held : numpy array
+        Position held over each bar
+    close : numpy array
+        Close prices
+    growth : numpy array
+        Equity curve from the held positions
+    index : Index
+        Dates of the bars
+
+    Returns
+    -------
+    tradeList : Dataframe
+        One row per run of bars holding the same (non zero) position. Entry is
+        at the close of the bar before the run, exit at the close of its last
+        bar
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np
+    """
+
+    # Runs start wherever the position changes and end just before the next
+    changes = np.flatnonzero(np.diff(held, prepend=0))
+    starts = changes[held[changes] != 0]
+    ends = np.append(changes[1:], len(held))[held[changes] != 0] - 1
+    entries = starts - 1
+
+    return pd.DataFrame({'entryDate': index[entries],
+                         'exitDate': index[ends],
+                         'direction': np.where(held[starts] == 1, 'long', 'short'),
+                         'entryPrice': close[entries],
+                         'exitPrice': close[ends],
+                         'return': growth[ends]/growth[entries] - 1})
+
+
+# %% 3. Whole universe
+
+
+@profiling.timed('backtest.backtestUniverse')
+def backtestUniverse(data, adxThreshold=25, holdPositions=True):
+    """
+    Parameters
+    ----------
+    data : dict
+        Ticker -> dataframe with the 'ADX', 'macd' and 'signal' columns
+    adxThreshold : float
+        ADX level above which the trend is considered significant
+    holdPositions : bool
+        See backtest
+
+    Returns
+    -------
+    results : dict
+        Ticker -> BacktestResult
+    """
+
+    return {ticker: backtest(df, adxThreshold, holdPositions)
+            for ticker, df in data.items()}
+
+
+# %% 4. Panel (portfolio) backtest
+
+
+'''
+Backtest the whole ticker universe as one portfolio.
+
+The tickers are split into shards that are sent to a pool of worker processes.
+Each worker computes the indicators and positions for its shard and sends back
+the strategy returns. Only the high, low and close arrays go to the workers (not
+the full dataframes), which keeps the pickling overhead small. The results are
+then lined up on a common (time x ticker) grid and combined into equally
+weighted portfolio P&L.
+
+Note: on Windows (spawn start method) the process pool re-imports the calling
+script, so only use workers > 1 from code behind an if __name__ == '__main__'
+guard. workers=1 runs everything in the current process.
+'''
+
+PanelResult = namedtuple('PanelResult', ['positions', 'returns', 'portfolio'])
+
+
+@profiling.timed('backtest.panelBacktest')
+def panelBacktest(data, fastEMA=12, slowEMA=26, signalEMA=9, adxPeriod=14,
+                  adxThreshold=25, holdPositions=True, workers=None,
+                  shardsPerWorker=4):
+    """
+    Parameters
+    ----------
+    data : dict or sharedData.SharedOHLCV
+        Ticker -> ohlcv dataframe (the indicators are computed here). With a
+        SharedOHLCV the workers read the data from shared memory instead of
+        being sent a copy
+    fastEMA, slowEMA, signalEMA : int
+        MACD periods
+    adxPeriod : int
+        ADX smoothing period
+    adxThreshold : float
+        ADX level above which the trend is considered significant
+    holdPositions : bool
+        See backtest
+    workers : int
+        Number of worker processes, defaults to the number of cpus. 1 runs in
+        the current process
+    shardsPerWorker : int
+        Tickers are split into workers*shardsPerWorker shards so that uneven
+        shards don't leave workers idle
+
+    Returns
+    -------
+    PanelResult : namedtuple
+        positions : Dataframe
+            Position held over each bar (time x ticker). Carried over bars a
+            ticker is missing, flat before its first bar and after its last
+        returns : Dataframe
+            Strategy return of each ticker on each bar (time x ticker), nan
+            where the ticker has no bar
+        portfolio : Dataframe
+            'return' - equally weighted mean over the tickers with a bar
+            'equity' - growth of 1 unit of capital
+            'exposure' - number of open positions
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np\n
+    from concurrent.futures import ProcessPoolExecutor
+    """
+
+    params = (fastEMA, slowEMA, signalEMA, adxPeriod, adxThreshold, holdPositions)
+    workers = workers or os.cpu_count() or 1
+    tickers = list(data.keys())
+
+    # Only send the columns the strategy needs. A sharedData.SharedOHLCV store
+    # is sent as is - the workers read the columns from its shared memory
+    shared = hasattr(data, 'ohlcArrays')
+    payloads = []
+    for shard in np.array_split(np.array(tickers, dtype=object),
+                                min(len(tickers), workers*shardsPerWorker) or 1):
+        payloads.append([(ticker, data if shared else _ohlcArrays(data[ticker]))
+                         for ticker in shard])
+
+    if workers == 1:
+        shardResults = [_backtestShard(payload, params) for payload in payloads]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            shardResults = profiling.poolMap(pool, _backtestShard, payloads,
+                                             [params]*len(payloads))
+
+    # Line everything up on the union of all the bar times
+    positions = {}
+    returns = {}
+    for shardResult in shardResults:
+        for ticker, index, held, strategyReturns in shardResult:
+            positions[ticker] = pd.Series(held, index=index)
+            returns[ticker] = pd.Series(strategyReturns, index=index)
+    # A position is still held over a bar the ticker is missing (it's only
+    # flat before the ticker's first bar and after its last)
+    positions = pd.DataFrame(positions, columns=tickers).ffill(limit_area='inside') \
+        .fillna(0).astype(np.int8)
+    returns = pd.DataFrame(returns, columns=tickers)
+
+    portfolio = pd.DataFrame(index=returns.index)
+    portfolio['return'] = returns.mean(axis=1).fillna(0)
+    portfolio['equity'] = (1 + portfolio['return']).cumprod()
+    portfolio['exposure'] = (positions != 0).sum(axis=1)
+
+    return PanelResult(positions, returns, portfolio)
+
+
+def _ohlcArrays(ohlcv):
+    """
+    (index, high, low, close) of an ohlcv dataframe as numpy arrays
+    """
+
+    df = ohlcv[[c for c in ohlcv.columns if c.lower() in ('high', 'low', 'close')]]
+    df.columns = map(str.lower, df.columns)
+
+    return (df.index.to_numpy(), df['high'].to_numpy(dtype=float),
+            df['low'].to_numpy(dtype=float), df['close'].to_numpy(dtype=float))
+
+
+def _backtestShard(payload, params):
+    """
+    Worker function: indicators, positions and strategy returns for a shard of
+    tickers. Returns a list of (ticker, index, held positions, returns)
+    """
+
+    fastEMA, slowEMA, signalEMA, adxPeriod, adxThreshold, holdPositions = params
+    results = []
+    for ticker, arrays in payload:
+        index, high, low, close = arrays.ohlcArrays(ticker) \
+            if hasattr(arrays, 'ohlcArrays') else arrays
+        df = pd.DataFrame({'high': high, 'low': low, 'close': close})
+        df[['signal', 'macd']] = ti.MACD(df, fastEMA, slowEMA, signalEMA)
+        df['ADX'] = ti.ADX(df, adxPeriod)
+
+        positions = strategy.positionSeries(df['ADX'], df['macd'], df['signal'],
+                                            adxThreshold, holdPositions)
+        results.append((ticker, index, *strategyReturns(positions, close)))
+
+    return results
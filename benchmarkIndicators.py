@@ -0,0 +1,493 @@
+# -*- coding: utf-8 -*-
+"""
+Created on %(date)s
+
+@author: Treacher
+
+Benchmarks for the functions in technicalIndicators.py
+"""
+
+# %%% 0. Notes
+
+'''
+Times each indicator (ATR, MACD, Stochastic, ADX, vectorSlope, scalarSlope) on
+synthetic ohlcv data of 1k, 100k and 10M rows, plus the whole main.py pipeline
+(load from the ohlcv cache -> indicators -> signals -> backtest) on a universe
+of synthetic tickers.
+
+For each benchmark the best wall time over a few repeats is recorded, and the
+peak memory allocated during one extra run (traced separately with tracemalloc
+since tracing slows things down). Results are saved as json, and compared
+against a stored baseline run to catch anything that has got slower or uses
+more memory than it did:
+
+    python benchmarkIndicators.py --save-baseline       # record the baseline
+    python benchmarkIndicators.py                       # fails if regressed
+    python benchmarkIndicators.py --sizes 1000 100000   # skip the 10M rows
+    python benchmarkIndicators.py --loop-adx 1000000    # vs the original loop
+    python benchmarkIndicators.py --backend numba       # compiled kernels
+
+The exit code is 1 if anything regressed by more than the threshold, so it
+can be run as a check before committing changes to the indicators.
+'''
+
+
+# %% 1. Import libraries
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+import technicalIndicators as ti
+
+
+# %% 2. Synthetic data
+
+
+def syntheticOHLCV(nRows, seed=0):
+    """
+    Parameters
+    ----------
+    nRows : int
+        Number of bars to generate
+    seed : int
+        Seed for the random number generator so runs are repeatable
+
+    Returns
+    -------
+    ohlcv : Dataframe
+        Random walk open, high, low, close and volume data on a minute index
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np
+    """
+
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(0, 0.1, nRows))
+    high = close + rng.uniform(0, 0.2, nRows)
+    low = close - rng.uniform(0, 0.2, nRows)
+    ohlcv = pd.DataFrame({'open': close + rng.normal(0, 0.05, nRows),
+                          'high': high,
+                          'low': low,
+                          'close': close,
+                          'volume': rng.integers(100, 10000, nRows).astype(float)},
+                         index=pd.date_range('2020-01-01', periods=nRows, freq='min'))
+
+    return ohlcv
+
+
+# %% 3. Reference implementations
+
+'''
+The original loop based ADX, kept here only so the vectorised version in
+technicalIndicators.py can be timed and checked against it
+'''
+
+
+def loopADX(ohlcv, n=14):
+    df = ohlcv.copy()
+    df['TR'] = ti.ATR(df, 14, True)['TR']
+    df['DMplus'] = np.where((df['high']-df['high'].shift(1)) > (df['low'].shift(1)-df['low']), df['high']-df['high'].shift(1), 0)
+    df['DMplus'] = np.where(df['DMplus'] < 0, 0, df['DMplus'])
+    df['DMminus'] = np.where((df['low'].shift(1)-df['low']) > (df['high']-df['high'].shift(1)), df['low'].shift(1)-df['low'], 0)
+    df['DMminus'] = np.where(df['DMminus'] < 0, 0, df['DMminus'])
+
+    TRn = []
+    DMplusN = []
+    DMminusN = []
+    TR = df['TR'].tolist()
+    DMplus = df['DMplus'].tolist()
+    DMminus = df['DMminus'].tolist()
+    for i in range(len(df)):
+        if i < n:
+            TRn.append(np.nan)
+            DMplusN.append(np.nan)
+            DMminusN.append(np.nan)
+        elif i == n:
+            TRn.append(df['TR'].rolling(n).sum().tolist()[n])
+            DMplusN.append(df['DMplus'].rolling(n).sum().tolist()[n])
+            DMminusN.append(df['DMminus'].rolling(n).sum().tolist()[n])
+        elif i > n:
+            TRn.append(TRn[i-1] - (TRn[i-1]/n) + TR[i])
+            DMplusN.append(DMplusN[i-1] - (DMplusN[i-1]/n) + DMplus[i])
+            DMminusN.append(DMminusN[i-1] - (DMminusN[i-1]/n) + DMminus[i])
+
+    df['TRn'] = np.array(TRn)
+    df['DMplusN'] = np.array(DMplusN)
+    df['DMminusN'] = np.array(DMminusN)
+    df['DIplusN'] = 100*(df['DMplusN'] / df['TRn'])
+    df['DIminusN'] = 100*(df['DMminusN'] / df['TRn'])
+    df['DIdiff'] = abs(df['DIplusN'] - df['DIminusN'])
+    df['DIsum'] = df['DIplusN'] + df['DIminusN']
+    df['DX'] = 100*(df['DIdiff'] / df['DIsum'])
+
+    ADX = []
+    DX = df['DX'].tolist()
+    for j in range(len(df)):
+        if j < 2*n-1:
+            ADX.append(np.nan)
+        elif j == 2*n-1:
+            ADX.append(df['DX'][j-n+1:j+1].mean())
+        elif j > 2*n-1:
+            ADX.append(((n-1)*ADX[j-1] + DX[j])/n)
+    df['ADX'] = np.array(ADX)
+
+    return df['ADX']
+
+
+# %% 4. Timing helpers
+
+
+def timeit(function, *args, repeats=3, **kwargs):
+    """
+    Returns the best wall time (s) over a number of repeats and the result
+    """
+
+    best = np.inf
+    for _ in range(repeats):
+        tic = time.perf_counter()
+        result = function(*args, **kwargs)
+        best = min(best, time.perf_counter() - tic)
+
+    return best, result
+
+
+def benchmarkADX(nRows=1_000_000, n=14):
+    """
+    Time the vectorised ADX against the loop reference and check they agree
+    """
+
+    ohlcv = syntheticOHLCV(nRows)
+    loopTime, expected = timeit(loopADX, ohlcv, n, repeats=1)
+    fastTime, actual = timeit(ti.ADX, ohlcv, n)
+    maxError = np.nanmax(np.abs(expected.to_numpy() - actual.to_numpy()))
+
+    print('ADX on {:,d} rows'.format(nRows))
+    print('    loop       : {:8.3f} s'.format(loopTime))
+    print('    vectorised : {:8.3f} s'.format(fastTime))
+    print('    speedup    : {:8.1f} x'.format(loopTime / fastTime))
+    print('    max |diff| : {:8.2e}'.format(maxError))
+
+
+# %% 5. Indicator suite
+
+SIZES = [1_000, 100_000, 10_000_000]
+
+# name -> function of the ohlcv frame, called the way main.py calls them
+INDICATORS = {'ATR': lambda ohlcv: ti.ATR(ohlcv, 14),
+              'MACD': lambda ohlcv: ti.MACD(ohlcv, 12, 26, 9),
+              'Stochastic': lambda ohlcv: ti.Stochastic(ohlcv, 14),
+              'ADX': lambda ohlcv: ti.ADX(ohlcv, 14),
+              'vectorSlope': lambda ohlcv: ti.vectorSlope(ohlcv['close'], 40),
+              'scalarSlope': lambda ohlcv: ti.scalarSlope(ohlcv['close'])}
+
+
+def measure(function, *args, repeats=3, **kwargs):
+    """
+    Returns
+    -------
+    seconds : float
+        Best wall time over the repeats
+    peakBytes : int
+        Peak memory allocated (above what was already allocated) during one
+        further run, traced with tracemalloc
+    """
+
+    seconds, _ = timeit(function, *args, repeats=repeats, **kwargs)
+
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        result = function(*args, **kwargs)
+        peakBytes = tracemalloc.get_traced_memory()[1] - before
+    finally:
+        tracemalloc.stop()
+    del result
+
+    return seconds, peakBytes
+
+
+def benchmarkIndicators(sizes=SIZES, names=None, repeats=3, verbose=True):
+    """
+    Parameters
+    ----------
+    sizes : list of int
+        Numbers of rows of synthetic ohlcv data to run each indicator on
+    names : list of str
+        Indicators to run (keys of INDICATORS), all of them if None
+    repeats : int
+        Number of timed runs, the best is kept
+
+    Returns
+    -------
+    records : list of dict
+        One per (indicator, size) with 'name', 'rows', 'seconds', 'peakBytes'
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np\n
+    tracemalloc
+    """
+
+    records = []
+    for nRows in sizes:
+        ohlcv = syntheticOHLCV(nRows)
+        for name in names or INDICATORS:
+            seconds, peakBytes = measure(INDICATORS[name], ohlcv, repeats=repeats)
+            records.append({'name': name, 'rows': nRows, 'seconds': seconds,
+                            'peakBytes': peakBytes})
+            if verbose:
+                _printRecord(records[-1])
+        del ohlcv
+
+    return records
+
+
+# %% 6. End to end pipeline
+
+'''
+The same steps as main.py, run on bars read from an OHLCVCache so nothing goes
+over the network. The cache is filled first (untimed) with the made up bars of
+fakeAlpacaServer.py, then each stage is timed on its own and as a whole.
+'''
+
+DOW_TICKERS = ['AXP', 'AAPL', 'BA', 'CAT', 'CVX', 'CSCO', 'DIS', 'DOW', 'XOM',
+               'HD', 'IBM', 'INTC', 'JNJ', 'KO', 'MCD', 'MMM', 'MRK', 'MSFT',
+               'NKE', 'PFE', 'PG', 'TRV', 'UTX', 'UNH', 'VZ', 'V', 'WMT', 'WBA']
+
+
+class _SyntheticClient:
+    """
+    Stands in for AggsClient, answering get_aggs with fakeAlpacaServer's bars
+    without going through http
+    """
+
+    def get_aggs(self, symbol, multiplier, timespan, _from, to):
+        from fakeAlpacaServer import syntheticBars
+        from dataLoader import barsToDataframe
+
+        return barsToDataframe(syntheticBars(symbol, multiplier, timespan, _from, to))
+
+
+def benchmarkPipeline(cacheDir=None, tickers=DOW_TICKERS, startDate='2000-01-01',
+                      endDate='2019-12-31', repeats=3, verbose=True):
+    """
+    Parameters
+    ----------
+    cacheDir : str
+        OHLCVCache folder to use, a temporary one if None. Missing bars are
+        filled in from fakeAlpacaServer.syntheticBars before timing
+    tickers : list of str
+        Universe to run the pipeline over
+    startDate, endDate : str
+        Date range of daily bars as 'YYYY-MM-DD'
+    repeats : int
+        Number of timed runs, the best is kept
+
+    Returns
+    -------
+    records : list of dict
+        One per stage ('pipeline.load', 'pipeline.indicators',
+        'pipeline.signal', 'pipeline.backtest') and one for the whole thing
+        ('pipeline.total'), with 'rows' the total number of bars
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np\n
+    tracemalloc
+    """
+
+    import backtest as bt
+    import dataLoader as dl
+    import strategy
+    from ohlcvCache import OHLCVCache
+
+    temporary = tempfile.TemporaryDirectory() if cacheDir is None else None
+    cache = OHLCVCache(temporary.name if temporary else cacheDir)
+    try:
+        dl.fetchOHLCV(tickers, startDate, endDate, _SyntheticClient(), 1, 'day',
+                      requestsPerMinute=None, cache=cache, verbose=False)
+
+        def load():
+            # The cache covers the whole range, so the client is never used
+            data, _ = dl.fetchOHLCV(tickers, startDate, endDate, None, 1, 'day',
+                                    cache=cache, verbose=False)
+            return data
+
+        def indicators(data):
+            for ticker in data:
+                data[ticker][['signal', 'macd']] = ti.MACD(data[ticker], 12, 26, 9)
+                data[ticker]['ADX'] = ti.ADX(data[ticker], 14)
+            return data
+
+        def signal(data):
+            return {ticker: strategy.positionSeries(df['ADX'], df['macd'], df['signal'], 25)
+                    for ticker, df in data.items()}
+
+        def backtest(data):
+            return bt.backtestUniverse(data, adxThreshold=25, holdPositions=True)
+
+        def total():
+            data = indicators(load())
+            signal(data)
+            return backtest(data)
+
+        data = indicators(load())
+        nRows = sum(len(df) for df in data.values())
+        stages = [('load', load, ()), ('indicators', indicators, (load(),)),
+                  ('signal', signal, (data,)), ('backtest', backtest, (data,)),
+                  ('total', total, ())]
+
+        records = []
+        for stage, function, args in stages:
+            seconds, peakBytes = measure(function, *args, repeats=repeats)
+            records.append({'name': 'pipeline.' + stage, 'rows': nRows,
+                            'seconds': seconds, 'peakBytes': peakBytes})
+            if verbose:
+                _printRecord(records[-1])
+    finally:
+        if temporary is not None:
+            temporary.cleanup()
+
+    return records
+
+
+# %% 7. Results and regressions
+
+
+def runSuite(sizes=SIZES, names=None, repeats=3, pipeline=True, cacheDir=None,
+             verbose=True):
+    """
+    Run the indicator benchmarks (and the pipeline) and return the results
+    as a dict ready to be saved with saveResults
+    """
+
+    records = benchmarkIndicators(sizes, names, repeats, verbose)
+    if pipeline:
+        records += benchmarkPipeline(cacheDir, repeats=repeats, verbose=verbose)
+
+    return {'created': datetime.datetime.now().isoformat(timespec='seconds'),
+            'machine': {'platform': platform.platform(),
+                        'processor': platform.processor(),
+                        'cpus': os.cpu_count(),
+                        'python': platform.python_version(),
+                        'numpy': np.__version__,
+                        'pandas': pd.__version__},
+            'results': records}
+
+
+def saveResults(results, path):
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=2)
+
+
+def loadResults(path):
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def compareResults(results, baseline, timeThreshold=0.25, memoryThreshold=0.25,
+                   minSeconds=0.005, minBytes=2**20):
+    """
+    Parameters
+    ----------
+    results, baseline : dict
+        Output of runSuite (or loadResults) for the new and reference runs
+    timeThreshold, memoryThreshold : float
+        Fractional increase over the baseline that counts as a regression,
+        e.g. 0.25 for 25 % slower
+    minSeconds, minBytes : float
+        Increases smaller than this are ignored, so timer noise on the very
+        fast benchmarks doesn't count
+
+    Returns
+    -------
+    regressions : list of str
+        Description of each benchmark that regressed (empty if none did).
+        Benchmarks missing from the baseline are skipped
+    """
+
+    reference = {(r['name'], r['rows']): r for r in baseline['results']}
+    regressions = []
+    for record in results['results']:
+        old = reference.get((record['name'], record['rows']))
+        if old is None:
+            continue
+        label = '{} ({:,d} rows)'.format(record['name'], record['rows'])
+        if record['seconds'] > old['seconds']*(1 + timeThreshold) and \
+                record['seconds'] - old['seconds'] > minSeconds:
+            regressions.append('{}: {:.4f} s vs {:.4f} s baseline'.format(
+                label, record['seconds'], old['seconds']))
+        if record['peakBytes'] > old['peakBytes']*(1 + memoryThreshold) and \
+                record['peakBytes'] - old['peakBytes'] > minBytes:
+            regressions.append('{}: {:.1f} MB vs {:.1f} MB baseline'.format(
+                label, record['peakBytes']/2**20, old['peakBytes']/2**20))
+
+    return regressions
+
+
+def _printRecord(record):
+    print('{:22s} {:>12,d} rows {:10.4f} s {:10.1f} MB'.format(
+        record['name'], record['rows'], record['seconds'], record['peakBytes']/2**20))
+
+
+# %% 8. Run
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the technical indicators')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--indicators', nargs='+', choices=list(INDICATORS), default=None)
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--backend', choices=['numpy', 'numba', 'auto'], default='numpy',
+                        help='technicalIndicators backend to benchmark (see setBackend)')
+    parser.add_argument('--no-pipeline', action='store_true')
+    parser.add_argument('--cache-dir', default=None,
+                        help='ohlcv cache for the pipeline benchmark (temporary if not given)')
+    parser.add_argument('--output', default='benchmarkResults.json')
+    parser.add_argument('--baseline', default='benchmarkBaseline.json')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store this run as the baseline instead of comparing to it')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='fractional slow down counted as a regression')
+    parser.add_argument('--memory-threshold', type=float, default=0.25)
+    parser.add_argument('--loop-adx', type=int, default=None, metavar='ROWS',
+                        help='only time the vectorised ADX against the original loop')
+    args = parser.parse_args()
+
+    if args.loop_adx:
+        benchmarkADX(args.loop_adx)
+        sys.exit(0)
+
+    ti.setBackend(args.backend)
+    ti.warmup()
+    results = runSuite(args.sizes, args.indicators, args.repeats,
+                       not args.no_pipeline, args.cache_dir)
+    results['machine']['backend'] = ti.BACKEND
+    saveResults(results, args.output)
+
+    if args.save_baseline:
+        saveResults(results, args.baseline)
+        print('Saved baseline to {}'.format(args.baseline))
+    elif os.path.exists(args.baseline):
+        regressions = compareResults(results, loadResults(args.baseline),
+                                     args.threshold, args.memory_threshold)
+        for regression in regressions:
+            print('REGRESSION ' + regression)
+        if regressions:
+            sys.exit(1)
+        print('No regressions against {}'.format(args.baseline))
+    else:
+        print('No baseline at {} - run with --save-baseline to make one'.format(args.baseline))
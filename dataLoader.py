@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""
+Created on %(date)s
+
+@author: Treacher
+
+Contains: concurrent ohlcv loader for the Alpaca market data api
+"""
+
+# %%% 0. Notes
+
+'''
+Pulls the ohlcv bars for many tickers at once instead of one request at a time.
+
+Basic idea:
+    1) A pool of threads each fetch one ticker, sharing one http session (and
+       so one pool of keep-alive connections)
+    2) Every request first takes a slot from a shared rate limiter so the whole
+       pool stays within the requests per minute budget of the api
+    3) Failed requests are retried with exponential backoff if the error is
+       worth retrying (timeouts, 429 rate limited, 5xx server errors)
+    4) Tickers that still fail are reported along with the reason
+Only errors from the request itself count as failures (FetchError, network
+errors, requests' and alpaca_trade_api's errors) - anything else is a bug and
+is raised straight away rather than retried.
+
+With an ohlcvCache.OHLCVCache only the dates not already cached are fetched
+(usually just the latest bars), and everything is read back from the cache.
+
+AggsClient talks to the aggregates endpoint directly, so pointing dataUrl at
+fakeAlpacaServer.py lets it run without Alpaca. Anything with a get_aggs method
+(e.g. alpaca_trade_api.REST) can be used in its place.
+'''
+
+
+# %% 1. Import libraries
+
+from concurrent.futures import ThreadPoolExecutor
+import random
+import sys
+import threading
+import time
+import pandas as pd
+
+import profiling
+
+
+# %% 2. Errors and rate limiting
+
+
+class FetchError(Exception):
+    """
+    Error pulling data for a ticker. status is the http status code (None if
+    the request never got a response) and retryAfter the number of seconds
+    the server asked us to wait, if any
+    """
+
+    def __init__(self, message, status=None, retryAfter=None):
+        super().__init__(message)
+        self.status = status
+        self.retryAfter = retryAfter
+
+    @property
+    def retryable(self):
+        return self.status is None or self.status == 429 or self.status >= 500
+
+
+class RateLimiter:
+    """
+    Thread safe limiter spacing requests evenly to stay within a budget of
+    requestsPerMinute. Each call to acquire() books the next free slot and
+    sleeps until it comes round
+    """
+
+    def __init__(self, requestsPerMinute=200):
+        self.interval = 60/requestsPerMinute if requestsPerMinute else 0
+        self.nextSlot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.nextSlot)
+            self.nextSlot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def pause(self, seconds):
+        """
+        Push every future slot back, e.g. when the server says to slow down
+        """
+
+        with self.lock:
+            self.nextSlot = max(self.nextSlot, time.monotonic() + seconds)
+
+
+# %% 3. Http client for the aggregates endpoint
+
+
+class AggsClient:
+    """
+    Minimal client for the Alpaca (polygon style) aggregates endpoint
+
+    apiKey, secretKey : str
+        Alpaca keys, sent as headers
+    dataUrl : str
+        Base url of the data api, e.g. 'http://127.0.0.1:8765' for the fake
+    poolSize : int
+        Number of keep-alive connections to hold open, should be at least the
+        number of threads using the client
+    timeout : float
+        Seconds to wait for a response
+
+    Package requirements
+    -------
+    requests\n
+    pandas as pd
+    """
+
+    def __init__(self, apiKey='', secretKey='', dataUrl='https://data.alpaca.markets',
+                 poolSize=8, timeout=10):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.dataUrl = dataUrl.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({'APCA-API-KEY-ID': apiKey,
+                                     'APCA-API-SECRET-KEY': secretKey})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=poolSize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @profiling.timed('data.get_aggs')
+    def get_aggs(self, symbol, multiplier, timespan, _from, to):
+        import requests
+
+        url = '{}/v1/aggs/ticker/{}/range/{}/{}/{}/{}'.format(
+            self.dataUrl, symbol, multiplier, timespan, _from, to)
+        try:
+            response = self.session.get(url, timeout=self.timeout)
+        except requests.RequestException as error:
+            raise FetchError('{}: {}'.format(type(error).__name__, error))
+
+        if response.status_code != 200:
+            retryAfter = response.headers.get('Retry-After')
+            raise FetchError('http {} {}'.format(response.status_code,
+                                                 response.text[:200].strip()),
+                             response.status_code,
+                             float(retryAfter) if retryAfter else None)
+
+        return barsToDataframe(response.json().get('results') or [])
+
+    def close(self):
+        self.session.close()
+
+
+def barsToDataframe(results):
+    """
+    Parameters
+    ----------
+    results : list of dict
+        Bars as returned by the aggregates endpoint, with keys o, h, l, c, v
+        and t (epoch milliseconds)
+
+    Returns
+    -------
+    ohlcv : Dataframe
+        Same layout as alpaca_trade_api's Aggs.df - open, high, low, close and
+        volume columns on a New York time 'timestamp' index
+
+    Package requirements
+    -------
+    pandas as pd
+    """
+
+    df = pd.DataFrame(results, columns=['t', 'o', 'h', 'l', 'c', 'v'])
+    df.columns = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms', utc=True) \
+        .dt.tz_convert('America/New_York')
+
+    return df.set_index('timestamp').astype(float)
+
+
+# %% 4. Concurrent fetch
+
+
+def requestErrors():
+    """
+    Exceptions that mean a request failed (worth reporting, and retrying if
+    temporary) rather than a bug: FetchError, network errors, and the errors
+    of requests and alpaca_trade_api if they're in use (already imported)
+    """
+
+    errors = [FetchError, ConnectionError, TimeoutError]
+    for module, name in [('requests', 'RequestException'),
+                         ('alpaca_trade_api.rest', 'APIError')]:
+        if module in sys.modules:
+            errors.append(getattr(sys.modules[module], name))
+
+    return tuple(errors)
+
+
+@profiling.timed('data.fetchOHLCV')
+def fetchOHLCV(tickers, startDate, endDate, client, multiplier=1, timespan='day',
+               maxWorkers=8, requestsPerMinute=200, retries=3, backoff=1.0,
+               cache=None, verbose=True):
+    """
+    Parameters
+    ----------
+    tickers : list of str
+        Tickers to pull
+    startDate, endDate : str
+        Date range as 'YYYY-MM-DD'
+    client : AggsClient or alpaca_trade_api.REST
+        Anything with a get_aggs(symbol, multiplier, timespan, _from, to)
+        method returning either a dataframe or an object with a .df. Not used
+        at all if the cache already covers the date range
+    multiplier, timespan : int, str
+        Bar size, e.g. 1, 'day' or 5, 'minute'
+    maxWorkers : int
+        Number of concurrent requests
+    requestsPerMinute : float
+        Budget shared by all the workers (None or 0 for no limit)
+    retries : int
+        Number of extra attempts for errors worth retrying
+    backoff : float
+        Seconds to wait before the first retry, doubling each time after
+    cache : ohlcvCache.OHLCVCache
+        If given, only the dates the cache doesn't cover yet are fetched and
+        the data is read back from the cache
+    verbose : bool
+        Print a line per ticker as it finishes
+
+    Returns
+    -------
+    data : dict
+        Ticker -> ohlcv dataframe, in the same order as tickers
+    failures : dict
+        Ticker -> reason it couldn't be pulled. With a cache, a ticker can be
+        in both when only part of the range could be fetched - data then
+        holds whatever is cached
+
+    Package requirements
+    -------
+    pandas as pd\n
+    from concurrent.futures import ThreadPoolExecutor
+    """
+
+    limiter = RateLimiter(requestsPerMinute)
+    timeframe = '{}{}'.format(multiplier, timespan)
+    fetchErrors = requestErrors()
+
+    def fetchRange(task):
+        ticker, fromDate, toDate = task
+        for attempt in range(retries + 1):
+            limiter.acquire()
+            try:
+                result = client.get_aggs(ticker, multiplier, timespan, fromDate, toDate)
+                df = getattr(result, 'df', result)
+                return task, df if df is not None else pd.DataFrame(), None
+            except fetchErrors as error:
+                status = getattr(error, 'status', getattr(error, 'status_code', None))
+                if status is None and getattr(error, 'response', None) is not None:
+                    status = error.response.status_code  # requests.HTTPError
+                retryable = getattr(error, 'retryable', status is None or status == 429
+                                    or status >= 500)
+                reason = str(error) or type(error).__name__
+                if not retryable or attempt == retries:
+                    return task, None, reason
+
+                # Back off (with a bit of jitter so the threads don't all retry
+                # together), waiting longer if the server asked us to
+                wait = backoff*2**attempt*(1 + 0.25*random.random())
+                retryAfter = getattr(error, 'retryAfter', None)
+                if retryAfter:
+                    wait = max(wait, retryAfter)
+                if status == 429:
+                    limiter.pause(wait)
+                time.sleep(wait)
+
+    # Work out what actually needs fetching
+    if cache is None:
+        tasks = [(ticker, startDate, endDate) for ticker in tickers]
+    else:
+        tasks = [(ticker, fromDate, toDate) for ticker in tickers
+                 for fromDate, toDate in cache.missingRanges(ticker, timeframe,
+                                                             startDate, endDate)]
+
+    fetched = {}
+    failures = {}
+    if tasks:
+        with ThreadPoolExecutor(max_workers=maxWorkers) as pool:
+            for task, df, reason in pool.map(fetchRange, tasks):
+                ticker = task[0]
+                if df is None:
+                    failures[ticker] = reason
+                    continue
+                if cache is not None:
+                    cache.update(ticker, timeframe, df, task[1], task[2])
+                fetched[ticker] = df
+
+    data = {}
+    for ticker in tickers:
+        df = fetched.get(ticker) if cache is None else \
+            cache.read(ticker, timeframe, startDate, endDate)
+        if df is not None and len(df):
+            data[ticker] = df
+        elif ticker not in failures:
+            failures[ticker] = 'no data returned'
+
+        if verbose and ticker in data:
+            print('Pulling ohlcv data for {:s}'.format(ticker))
+        if verbose and ticker in failures:
+            print('Error encountered pulling ohlcv data for {:s}: {:s}'
+                  .format(ticker, failures[ticker]))
+
+    return data, failures
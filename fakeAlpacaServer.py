@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+Created on %(date)s
+
+@author: Treacher
+
+Contains: local stand-in for the Alpaca market data api
+"""
+
+# %%% 0. Notes
+
+'''
+Small http server answering the aggregates endpoint
+    /v1/aggs/ticker/<symbol>/range/<multiplier>/<timespan>/<from>/<to>
+with made up (but repeatable) bars, so the data loader can be run
+and tested without an Alpaca account or network access.
+
+It can also misbehave on purpose:
+    failRate : fraction of requests answered with a 500 error
+    requestsPerMinute : requests over this budget get a 429 with Retry-After
+    latency : seconds to wait before answering each request
+    unknownTickers : tickers answered with a 404
+
+Run it from the command line with
+    python fakeAlpacaServer.py --port 8765
+or in the background from python with startServer().
+'''
+
+
+# %% 1. Import libraries
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+import numpy as np
+import pandas as pd
+
+
+# %% 2. Synthetic bars
+
+TIMESPANS = {'minute': 'min', 'hour': 'h', 'day': 'D'}
+
+
+def _hashUniform(keys, seed):
+    """
+    Repeatable pseudo random numbers in [0, 1), one per integer key (splitmix64)
+    """
+
+    with np.errstate(over='ignore'):
+        z = keys.astype(np.uint64) + np.uint64(seed) + np.uint64(0x9E3779B97F4A7C15)
+        z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        z = z ^ (z >> np.uint64(31))
+
+    return (z >> np.uint64(11)).astype(float) / 2.0**53
+
+
+def syntheticBars(symbol, multiplier, timespan, startDate, endDate):
+    """
+    Parameters
+    ----------
+    symbol : str
+        Ticker, which seeds the prices so each ticker always gets the same bars
+    multiplier, timespan : int, str
+        Bar size, e.g. 1, 'day'
+    startDate, endDate : str
+        Date range as 'YYYY-MM-DD' (inclusive)
+
+    Returns
+    -------
+    results : list of dict
+        Weekday bars in the aggregates endpoint format (o, h, l, c, v, t in ms)
+
+    Prices are a function of the bar time only (a few slow ticker specific
+    cycles plus hashed noise), so overlapping requests always agree and any
+    date range is cheap to make
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np
+    """
+
+    freq = '{}{}'.format(multiplier, TIMESPANS[timespan])
+    start = pd.Timestamp(startDate, tz='America/New_York')
+    end = pd.Timestamp(endDate, tz='America/New_York') + pd.Timedelta(days=1)
+    grid = pd.date_range(start, end, freq=freq, inclusive='left')
+    grid = grid[grid.dayofweek < 5]
+
+    seed = zlib.crc32(symbol.encode())
+    sinceEpoch = grid.tz_convert('UTC').tz_localize(None) - pd.Timestamp('1970-01-01')
+    minutes = np.asarray(sinceEpoch // pd.Timedelta('1min'))
+    days = minutes / 1440
+    phases = 2*np.pi*_hashUniform(np.arange(3), seed)
+    trend = (0.3*np.sin(2*np.pi*days/365 + phases[0]) +
+             0.1*np.sin(2*np.pi*days/60 + phases[1]) +
+             0.03*np.sin(2*np.pi*days/9 + phases[2]))
+    noise = _hashUniform(minutes, seed) - 0.5
+
+    close = (20 + 80*_hashUniform(np.array([7]), seed)) * np.exp(trend + 0.01*noise)
+    high = close*(1 + 0.01*_hashUniform(minutes, seed + 1))
+    low = close*(1 - 0.01*_hashUniform(minutes, seed + 2))
+    openPrice = low + (high - low)*_hashUniform(minutes, seed + 3)
+    volume = 1e5 + 9e5*_hashUniform(minutes, seed + 4)
+    times = np.asarray(sinceEpoch // pd.Timedelta('1ms'))
+
+    return [{'o': round(o, 4), 'h': round(h, 4), 'l': round(l, 4),
+             'c': round(c, 4), 'v': int(v), 't': int(t)}
+            for o, h, l, c, v, t in zip(openPrice.tolist(), high.tolist(), low.tolist(),
+                                        close.tolist(), volume.tolist(), times.tolist())]
+
+
+# %% 3. Server
+
+
+class FakeAlpacaServer(ThreadingHTTPServer):
+    """
+    Threaded http server holding the misbehaviour settings and a count of the
+    requests it has seen
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, failRate=0.0, requestsPerMinute=None, latency=0.0,
+                 unknownTickers=(), seed=0):
+        super().__init__(address, FakeAlpacaHandler)
+        self.failRate = failRate
+        self.requestsPerMinute = requestsPerMinute
+        self.latency = latency
+        self.unknownTickers = set(unknownTickers)
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requestTimes = []
+        self.requestCount = 0
+
+    @property
+    def url(self):
+        return 'http://{}:{}'.format(*self.server_address[:2])
+
+    def overBudget(self):
+        """
+        Record a request and say whether it breaks the requests per minute
+        budget (over a sliding 60 s window)
+        """
+
+        with self.lock:
+            self.requestCount += 1
+            now = time.monotonic()
+            self.requestTimes = [t for t in self.requestTimes if now - t < 60]
+            if self.requestsPerMinute and len(self.requestTimes) >= self.requestsPerMinute:
+                return 60 - (now - self.requestTimes[0])
+            self.requestTimes.append(now)
+            return 0
+
+
+class FakeAlpacaHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'  # keep-alive, like the real api
+
+    def do_GET(self):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+
+        parts = self.path.strip('/').split('/')
+        if len(parts) != 9 or parts[:3] != ['v1', 'aggs', 'ticker'] or parts[4] != 'range':
+            return self.reply(404, {'message': 'endpoint not found'})
+        symbol, multiplier, timespan, startDate, endDate = parts[3], parts[5], parts[6], parts[7], parts[8]
+
+        wait = server.overBudget()
+        if wait:
+            return self.reply(429, {'message': 'rate limit exceeded'},
+                              {'Retry-After': '{:.2f}'.format(wait)})
+        with server.lock:
+            fail = server.random.random() < server.failRate
+        if fail:
+            return self.reply(500, {'message': 'internal server error'})
+        if symbol in server.unknownTickers or timespan not in TIMESPANS:
+            return self.reply(404, {'message': 'unknown ticker {}'.format(symbol)})
+
+        results = syntheticBars(symbol, int(multiplier), timespan, startDate, endDate)
+        self.reply(200, {'ticker': symbol, 'status': 'success', 'adjusted': True,
+                         'queryCount': len(results), 'resultsCount': len(results),
+                         'results': results})
+
+    def reply(self, status, body, headers={}):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass  # Keep quiet
+
+
+def startServer(port=0, **settings):
+    """
+    Start the fake server on a background thread
+
+    port : int
+        Port to listen on, 0 picks a free one
+    settings :
+        failRate, requestsPerMinute, latency, unknownTickers, seed
+
+    Returns
+    -------
+    server : FakeAlpacaServer
+        server.url is the base url to give AggsClient, server.shutdown() stops
+        it
+    """
+
+    server = FakeAlpacaServer(('127.0.0.1', port), **settings)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+# %% 4. Run from the command line
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--fail-rate', type=float, default=0.0)
+    parser.add_argument('--requests-per-minute', type=int, default=None)
+    parser.add_argument('--latency', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FakeAlpacaServer(('127.0.0.1', args.port), args.fail_rate,
+                              args.requests_per_minute, args.latency)
+    print('Fake Alpaca data api on {}'.format(server.url))
+    server.serve_forever()
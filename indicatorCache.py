@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+Created on %(date)s
+
+@author: Treacher
+
+Contains: memoised versions of the functions in technicalIndicators.py
+"""
+
+# %%% 0. Notes
+
+'''
+Remembers the results of the technical indicator functions so asking for the
+same indicator on the same data again (for plotting, the strategy, parameter
+sweeps...) doesn't recompute it.
+
+Results are keyed on
+    1) the function
+    2) its parameters (defaults filled in, so ADX(df) and ADX(df, n=14) match)
+    3) a fingerprint (hash) of the input data - its ohlcv columns and index
+Only the ohlcv columns go into the fingerprint, so adding indicator columns to
+a dataframe (data[ticker]['ADX'] = ...) doesn't stop later calls on it hitting
+the cache. The indicators that return the whole input frame plus their new
+columns (ATR, Stochastic) are run on just the ohlcv columns and only the new
+columns are kept - on a hit they're joined back onto the frame passed in, so
+its other columns are never stale copies from an earlier call.
+
+The cache is least recently used (LRU) with a limit on the total memory of
+the stored results. Results are copied on the way out so changing them can't
+corrupt the cache.
+
+Usage:
+    import indicatorCache as ic
+    df['ADX'] = ic.ADX(df, 14)
+    ic.cache.stats()  # hits, misses, evictions, memory used
+'''
+
+
+# %% 1. Import libraries
+
+from collections import namedtuple, OrderedDict
+import functools
+import hashlib
+import inspect
+import threading
+import numpy as np
+import pandas as pd
+
+import technicalIndicators as ti
+
+
+# %% 2. Fingerprinting
+
+OHLCV_COLUMNS = ('open', 'high', 'low', 'close', 'adj close', 'volume')
+
+
+def fingerprint(data):
+    """
+    Parameters
+    ----------
+    data : Dataframe, Series or numpy array
+        Input to an indicator function
+
+    Returns
+    -------
+    digest : str
+        Hash of the values, index and column names. For dataframes only the
+        ohlcv columns are used (all of them if it has none)
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np
+    """
+
+    digest = hashlib.blake2b(digest_size=16)
+    if isinstance(data, pd.DataFrame):
+        data = ohlcvColumns(data)
+        digest.update(repr(list(data.columns)).encode())
+    if isinstance(data, (pd.DataFrame, pd.Series)):
+        digest.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+    else:
+        array = np.ascontiguousarray(data)
+        digest.update(repr((array.dtype.str, array.shape)).encode())
+        digest.update(array.tobytes())
+
+    return digest.hexdigest()
+
+
+def ohlcvColumns(data):
+    """
+    The ohlcv columns of a dataframe (all of them if it has none)
+    """
+
+    columns = [c for c in data.columns if str(c).lower() in OHLCV_COLUMNS]
+
+    return data[columns] if columns and len(columns) < len(data.columns) else data
+
+
+# The new columns of an indicator returning its input frame plus new columns,
+# and whether it lowercased the input's column names
+AddedColumns = namedtuple('AddedColumns', ['columns', 'lowercase'])
+
+
+def _addedColumns(result, data):
+    """
+    AddedColumns if result is data (possibly with lowercased column names) plus
+    new columns, otherwise None
+    """
+
+    if not isinstance(result, pd.DataFrame) or not result.index.equals(data.index):
+        return None
+    n = len(data.columns)
+    leading = list(result.columns[:n])
+    for lowercase, names in [(False, list(data.columns)),
+                             (True, [str(c).lower() for c in data.columns])]:
+        if leading == names:
+            return AddedColumns(result.iloc[:, n:].copy(), lowercase)
+
+    return None
+
+
+def _join(data, added):
+    """
+    Rebuild an indicator's output on data from its AddedColumns
+    """
+
+    df = data.copy()
+    if added.lowercase:
+        df.columns = map(str.lower, df.columns)
+    for column in added.columns.columns:
+        df[column] = added.columns[column].to_numpy(copy=True)
+
+    return df
+
+
+def resultBytes(result):
+    """
+    Approximate memory used by an indicator result
+    """
+
+    if isinstance(result, pd.DataFrame):
+        return int(result.memory_usage(index=True, deep=False).sum())
+    if isinstance(result, pd.Series):
+        return int(result.memory_usage(index=True, deep=False))
+    if isinstance(result, np.ndarray):
+        return result.nbytes
+    if isinstance(result, AddedColumns):
+        return resultBytes(result.columns)
+    if isinstance(result, tuple):
+        return sum(resultBytes(r) for r in result)
+
+    return 64
+
+
+def _copy(result):
+    if isinstance(result, (pd.DataFrame, pd.Series, np.ndarray)):
+        return result.copy()
+    if isinstance(result, tuple):
+        return tuple(_copy(r) for r in result)
+
+    return result
+
+
+# %% 3. Cache
+
+
+class IndicatorCache:
+    """
+    maxBytes : int
+        Limit on the memory of the stored results, the least recently used
+        are dropped to stay under it
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np
+    """
+
+    def __init__(self, maxBytes=256*2**20):
+        self.maxBytes = maxBytes
+        self.entries = OrderedDict()  # key -> (result, bytes)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, function, data, *args, **kwargs):
+        """
+        function(data, *args, **kwargs), served from the cache if possible
+        """
+
+        # Fill in the defaults so equivalent calls give the same key
+        bound = inspect.signature(function).bind(data, *args, **kwargs)
+        bound.apply_defaults()
+        parameters = tuple(list(bound.arguments.items())[1:])
+        key = (function.__module__, function.__qualname__, parameters, fingerprint(data))
+
+        with self.lock:
+            stored = self.entries.get(key)
+            if stored is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if stored is not None:
+            stored = stored[0]
+            return _join(data, stored) if isinstance(stored, AddedColumns) \
+                else _copy(stored)
+
+        # Only the fingerprinted columns of a frame are passed in, so a result
+        # echoing the input back can be told apart from what was computed
+        frame = isinstance(data, pd.DataFrame)
+        inputs = ohlcvColumns(data) if frame else data
+        result = function(inputs, *args, **kwargs)
+        added = _addedColumns(result, inputs) if frame else None
+        if added is not None:
+            result = _join(data, added)
+        stored = added if added is not None else _copy(result)
+        size = resultBytes(stored)
+        with self.lock:
+            if size <= self.maxBytes and key not in self.entries:
+                self.entries[key] = (stored, size)
+                self.bytes += size
+                while self.bytes > self.maxBytes:
+                    _, (_, evicted) = self.entries.popitem(last=False)
+                    self.bytes -= evicted
+                    self.evictions += 1
+
+        return result
+
+    def wrap(self, function):
+        """
+        Memoised version of an indicator function with the same signature
+        """
+
+        @functools.wraps(function)
+        def cached(data, *args, **kwargs):
+            return self(function, data, *args, **kwargs)
+
+        return cached
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'entries': len(self.entries),
+                    'bytes': self.bytes, 'maxBytes': self.maxBytes}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+
+# %% 4. Memoised indicators
+
+cache = IndicatorCache()
+
+ATR = cache.wrap(ti.ATR)
+MACD = cache.wrap(ti.MACD)
+Stochastic = cache.wrap(ti.Stochastic)
+ADX = cache.wrap(ti.ADX)
+vectorSlope = cache.wrap(ti.vectorSlope)
+scalarSlope = cache.wrap(ti.scalarSlope)
@@ -0,0 +1,346 @@
+# -*- coding: utf-8 -*-
+"""
+Created on %(date)s
+
+@author: Treacher
+
+Contains: lazy indicator graph that works out shared intermediate results
+(true range, EMAs, directional movement...) once for all the indicators asked
+for
+"""
+
+# %%% 0. Notes
+
+'''
+The indicators overlap: ATR and ADX both start from the true range, ADX(10)
+and ADX(20) share the directional movement, and every MACD takes EMAs of
+close that other MACDs (fast / slow span pairs) also use. Computing each
+indicator on its own repeats all of that.
+
+Here an indicator is declared rather than computed - ADX(14) returns a Node,
+a description of the calculation made of smaller steps (nodes) from the
+array functions in technicalIndicators.py:
+    ATR(n) = rollingMean(trueRange, n)
+    MACD = ema(close, fast) - ema(close, slow), signal = ema(macd, signal)
+    ADX(n) = directionalIndex(wilderSum(trueRange, n), wilderSum(DM+, n),
+                              wilderSum(DM-, n))
+    Stochastic(n) = from close, rollingMin(low, n) and rollingMax(high, n)
+Nodes compare equal when they do the same step with the same parameters on
+the same inputs, so a step that several indicators need is one node in the
+graph. IndicatorGraph collects the indicators wanted (by any number of
+strategies or parameter sets) and evaluate runs each distinct step once, in
+dependency order, on a dataset.
+
+Intermediate results are dropped as soon as the last step that needs them has
+run, and steps that work in place (directionalIndex) are handed their inputs
+rather than copies when nothing else needs them, so memory use stays close to
+that of the indicators themselves.
+
+The data can be an ohlcv dataframe or (time x ticker) arrays (a
+technicalIndicators.Panel or a dict of 2D arrays), the array functions work on
+both. As in the technicalIndicators batch functions, when some tickers are
+missing bars (a ragged panel) each ticker's bars are moved together before the
+steps run and the outputs are put back on the panel's rows afterwards, so a
+gap doesn't turn a ticker's EMAs or Wilder sums into nan. The rows with a bar
+are the panel's present array (or a 'present' entry of a dict), otherwise the
+rows where any of the input columns is a number.
+
+Usage:
+    graph = IndicatorGraph()
+    graph['ADX'] = ADX(14)
+    graph['ATR'] = ATR(14)
+    graph['signal'], graph['macd'] = MACD(12, 26, 9)
+    indicators = graph.evaluate(df)
+'''
+
+
+# %% 1. Import libraries
+
+from collections import Counter, namedtuple
+import numpy as np
+import pandas as pd
+
+import technicalIndicators as ti
+
+
+# %% 2. Nodes
+
+Node = namedtuple('Node', ['operation', 'inputs', 'params'])
+
+
+def column(name):
+    return Node('column', (), (name.lower(),))
+
+
+def trueRange():
+    return Node('trueRange', (column('high'), column('low'), column('close')), ())
+
+
+def directionalMovement():
+    """
+    (DM+, DM-) nodes
+    """
+
+    both = Node('directionalMovement', (column('high'), column('low')), ())
+
+    return Node('item', (both,), (0,)), Node('item', (both,), (1,))
+
+
+def ema(values, span, minPeriods=0):
+    return Node('ema', (values,), (span, minPeriods))
+
+
+def rollingMean(values, n):
+    return Node('rollingMean', (values,), (n,))
+
+
+def rollingMax(values, n):
+    return Node('rollingMax', (values,), (n,))
+
+
+def rollingMin(values, n):
+    return Node('rollingMin', (values,), (n,))
+
+
+def wilderSum(values, n):
+    return Node('wilderSum', (values,), (n,))
+
+
+def subtract(a, b):
+    return Node('subtract', (a, b), ())
+
+
+# %% 3. Indicators
+
+
+def ATR(simpleMovingAverage=14):
+    """
+    Node for technicalIndicators.ATR (the 'ATR' column)
+    """
+
+    return rollingMean(trueRange(), simpleMovingAverage)
+
+
+def MACD(fastEMA=12, slowEMA=26, signalEMA=9):
+    """
+    (signal, macd) nodes for technicalIndicators.MACD, in the order of its
+    columns
+    """
+
+    close = column('close')
+    macd = subtract(ema(close, fastEMA, fastEMA), ema(close, slowEMA, slowEMA))
+
+    return ema(macd, signalEMA, signalEMA), macd
+
+
+def ADX(n=14):
+    """
+    Node for technicalIndicators.ADX
+    """
+
+    DMplus, DMminus = directionalMovement()
+
+    return Node('directionalIndex', (wilderSum(trueRange(), n), wilderSum(DMplus, n),
+                                     wilderSum(DMminus, n)), (n,))
+
+
+def Stochastic(n=14):
+    """
+    Node for technicalIndicators.Stochastic (the 'stochastic' column)
+    """
+
+    return Node('stochastic', (column('close'), rollingMin(column('low'), n),
+                               rollingMax(column('high'), n)), ())
+
+
+def _stochastic(close, lowest, highest):
+    k = np.subtract(close, lowest)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        k /= highest - lowest
+    k *= 100
+
+    return k
+
+
+# Operation -> (function of the input arrays and parameters, works in place)
+OPERATIONS = {'trueRange': (ti.trueRange, False),
+              'directionalMovement': (ti.directionalMovement, False),
+              'item': (lambda values, k: values[k], False),
+              'ema': (ti.ema, False),
+              'rollingMean': (ti.rollingMean, False),
+              'rollingMax': (ti.rollingMax, False),
+              'rollingMin': (ti.rollingMin, False),
+              'wilderSum': (ti.wilderSum, False),
+              'subtract': (np.subtract, False),
+              'directionalIndex': (ti.directionalIndex, True),
+              'stochastic': (_stochastic, False)}
+
+
+# %% 4. Graph
+
+
+class IndicatorGraph:
+    """
+    outputs : dict
+        Optional name -> Node of the indicators wanted (more can be added with
+        graph[name] = node)
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np
+    """
+
+    def __init__(self, outputs=None):
+        self.outputs = dict(outputs or {})
+
+    def __setitem__(self, name, node):
+        self.outputs[name] = node
+
+    def __getitem__(self, name):
+        return self.outputs[name]
+
+    def add(self, name, node):
+        self.outputs[name] = node
+
+        return node
+
+    def nodes(self, names=None):
+        """
+        The distinct nodes needed for the outputs (all of them by default), in
+        an order where every node comes after its inputs
+        """
+
+        order = []
+        seen = set()
+        for name in (self.outputs if names is None else names):
+            stack = [(self.outputs[name], False)]
+            while stack:
+                node, inputsDone = stack.pop()
+                if inputsDone:
+                    order.append(node)
+                elif node not in seen:
+                    seen.add(node)
+                    stack.append((node, True))
+                    stack.extend((input, False) for input in reversed(node.inputs)
+                                 if input not in seen)
+
+        return order
+
+    def stats(self, names=None):
+        """
+        Number of steps evaluate runs ('nodes') against the number computing
+        each output on its own would take ('withoutSharing')
+        """
+
+        def size(node):
+            return 1 + sum(size(input) for input in node.inputs)
+
+        names = list(self.outputs if names is None else names)
+        return {'outputs': len(names), 'nodes': len(self.nodes(names)),
+                'withoutSharing': sum(size(self.outputs[name]) for name in names)}
+
+    def evaluate(self, data, names=None):
+        """
+        Parameters
+        ----------
+        data : Dataframe, technicalIndicators.Panel or dict
+            ohlcv dataframe, or (time x ticker) arrays of high, low and close
+            (and optionally present, see the notes)
+        names : list
+            Outputs to compute, defaults to all of them
+
+        Returns
+        -------
+        results : Dataframe or dict
+            A column per output for a dataframe, otherwise a dict of name ->
+            numpy array
+
+        Package requirements
+        -------
+        pandas as pd\n
+        numpy as np
+        """
+
+        names = list(self.outputs if names is None else names)
+        order = self.nodes(names)
+        wanted = {self.outputs[name] for name in names}
+        remaining = Counter(input for node in order for input in node.inputs)
+        values = {node: _column(data, node.params[0]) for node in order
+                  if node.operation == 'column'}
+
+        # Ragged (time x ticker) arrays: compact each ticker's bars
+        present = None
+        if not isinstance(data, pd.DataFrame) and values \
+                and next(iter(values.values())).ndim == 2:
+            present = _present(data, values.values())
+            if present.all():
+                present = None
+            else:
+                columns = list(values)
+                positions, compacted = ti._compacted(present, [values[node]
+                                                               for node in columns])
+                values = dict(zip(columns, compacted))
+
+        for node in order:
+            if node.operation == 'column':
+                continue
+
+            function, inPlace = OPERATIONS[node.operation]
+            for input in node.inputs:
+                remaining[input] -= 1
+            arrays = [values[input] for input in node.inputs]
+            if inPlace:
+                # Only hand over inputs nothing else needs, copy the rest
+                arrays = [array if remaining[input] == 0 and input not in wanted
+                          and input.operation != 'column' and node.inputs.count(input) == 1
+                          else array.copy() for input, array in zip(node.inputs, arrays)]
+            values[node] = function(*arrays, *node.params)
+
+            # Free whatever isn't needed any more
+            for input in node.inputs:
+                if remaining[input] == 0 and input not in wanted:
+                    values.pop(input, None)
+
+        if isinstance(data, pd.DataFrame):
+            return pd.DataFrame({name: values[self.outputs[name]] for name in names},
+                                index=data.index)
+        if present is not None:
+            return {name: ti._scattered(positions, present, values[self.outputs[name]])
+                    for name in names}
+
+        return {name: values[self.outputs[name]] for name in names}
+
+
+def _column(data, name):
+    """
+    float64 array of a column (any case) of a dataframe, Panel or dict
+    """
+
+    if isinstance(data, pd.DataFrame):
+        columns = {c.lower(): c for c in data.columns}
+        return data[columns[name]].to_numpy(dtype=np.float64)
+    if isinstance(data, dict):
+        columns = {c.lower(): c for c in data}
+        return np.asarray(data[columns[name]], dtype=np.float64)
+
+    return np.asarray(getattr(data, name), dtype=np.float64)
+
+
+def _present(data, columns):
+    """
+    (time x ticker) bool array of where each ticker has a bar: the present
+    array of a Panel or dict if it has one, otherwise wherever any of the
+    columns is a number
+    """
+
+    present = data.get('present') if isinstance(data, dict) \
+        else getattr(data, 'present', None)
+    if present is not None:
+        return np.asarray(present, dtype=bool)
+
+    present = np.zeros(next(iter(columns)).shape, dtype=bool)
+    for values in columns:
+        present |= ~np.isnan(values)
+
+    return present
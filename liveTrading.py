@@ -0,0 +1,492 @@
+# -*- coding: utf-8 -*-
+"""
+Created on %(date)s
+
+@author: Treacher
+
+Contains: event driven live trading loop for the ADX + MACD strategy
+"""
+
+# %%% 0. Notes
+
+'''
+Runs the strategy live, one bar at a time:
+    1) Wait for the next bar boundary (BarClock, an asyncio timer aligned to
+       e.g. whole minutes or days) and pull the bars that just finished, or
+       take them from any other feed (e.g. a replay of cached bars)
+    2) Update each ticker's indicators incrementally with the streaming
+       classes in technicalIndicators.py (MACDState, ADXState) - constant cost
+       per bar however long the history
+    3) Evaluate the strategy's signal (strategy.evaluateSignal, the latest
+       values only version of trade_signal) for every ticker against its
+       current position
+    4) Submit the orders needed to get from the current to the new position.
+       A position only changes once its order has gone through - failed
+       orders are kept in failedOrders and the ticker is evaluated against
+       its old position again on the next bar
+
+Each bar is timed from when its bars arrive to when the last order has been
+submitted, and checked against a latency budget (overruns are counted and
+reported, see LiveTrader.latencyStats). With profiling.py enabled the stages
+of each bar are timed as well: 'live.feed' (waiting for and fetching the
+bars), 'live.indicators', 'live.signal', 'live.orders' and the whole
+'live.bar'.
+
+The feed and broker are duck typed so the same loop runs against Alpaca or
+locally:
+    feed : anything with an async generator stream(tickers) yielding
+        (timestamp, {ticker: (open, high, low, close, volume)}) per bar.
+        PollingFeed polls get_aggs (dataLoader.AggsClient, alpaca REST) on the
+        bar clock, ReplayFeed replays dataframes of bars
+    broker : anything with submit_order(symbol, qty, side, type,
+        time_in_force) like alpaca_trade_api.REST. PaperBroker fills market
+        orders in process at the feed's last close
+
+Usage:
+    trader = LiveTrader(tickers, ReplayFeed(data), PaperBroker(), history)
+    asyncio.run(trader.run())
+'''
+
+
+# %% 1. Import libraries
+
+import asyncio
+import inspect
+import time
+import numpy as np
+import pandas as pd
+
+import dataLoader as dl
+import profiling
+import technicalIndicators as ti
+from strategy import IndicatorSnapshot, evaluateSignal
+
+
+# %% 2. Bar clock
+
+
+class BarClock:
+    """
+    Asyncio timer firing just after each bar boundary
+
+    barSeconds : float
+        Length of a bar, e.g. 60 for minute bars
+    delay : float
+        Seconds to wait after the boundary so the bar that just closed has
+        been published by the data api
+    clock : function
+        Returns the current epoch time in seconds (time.time), replaceable for
+        testing
+    sleep : coroutine function
+        Used to wait (asyncio.sleep), replaceable for testing
+
+    Boundaries are multiples of barSeconds since the epoch (UTC), so minute
+    and hour bars line up with the clock on the wall
+    """
+
+    def __init__(self, barSeconds=60, delay=1.0, clock=time.time, sleep=asyncio.sleep):
+        self.barSeconds = barSeconds
+        self.delay = delay
+        self.clock = clock
+        self.sleep = sleep
+
+    def nextBoundary(self, now=None):
+        now = self.clock() if now is None else now
+
+        return (np.floor((now - self.delay)/self.barSeconds) + 1)*self.barSeconds
+
+    async def wait(self):
+        """
+        Sleep until delay seconds after the next boundary and return the
+        boundary (epoch seconds)
+        """
+
+        boundary = self.nextBoundary()
+        await self.sleep(max(0.0, boundary + self.delay - self.clock()))
+
+        return boundary
+
+
+# %% 3. Feeds
+
+BAR_SECONDS = {'minute': 60, 'hour': 3600, 'day': 86400}
+
+# Daily bars are labelled with the exchange's local midnight and finish at
+# its close
+EXCHANGE_TZ = 'America/New_York'
+MARKET_CLOSE = pd.Timedelta(hours=16)
+
+
+class PollingFeed:
+    """
+    Polls the aggregates endpoint for new bars once per bar
+
+    client : dataLoader.AggsClient or alpaca_trade_api.REST
+        Anything with get_aggs(symbol, multiplier, timespan, _from, to)
+    multiplier, timespan : int, str
+        Bar size, e.g. 1, 'minute'
+    delay : float
+        Seconds after each bar boundary to poll (see BarClock)
+    clock : BarClock
+        Timer to poll on, made from the bar size if not given
+
+    Only bars that have finished and haven't been yielded before are passed
+    on. Intraday bars finish at start + bar length, daily bars at the market
+    close (MARKET_CLOSE, exchange time) of their last day - they're labelled
+    with the exchange's local midnight, which isn't a boundary of the UTC bar
+    clock. The tickers are polled concurrently on
+    threads, so a slow response for one doesn't hold up the others. A failed
+    request (see dataLoader.requestErrors) is noted in errors and the ticker
+    tried again at the next poll, anything else is raised
+    """
+
+    def __init__(self, client, multiplier=1, timespan='minute', delay=2.0, clock=None):
+        self.client = client
+        self.multiplier = multiplier
+        self.timespan = timespan
+        self.barLength = pd.Timedelta(seconds=multiplier*BAR_SECONDS[timespan])
+        self.clock = clock or BarClock(self.barLength.total_seconds(), delay)
+        self.lastSeen = {}
+        self.errors = {}
+        self.requestErrors = dl.requestErrors()
+
+    @profiling.timed('live.poll')
+    def poll(self, ticker, now):
+        start = (now - pd.Timedelta(days=5)).strftime('%Y-%m-%d')
+        end = now.strftime('%Y-%m-%d')
+        try:
+            result = self.client.get_aggs(ticker, self.multiplier, self.timespan, start, end)
+        except self.requestErrors as error:
+            self.errors[ticker] = str(error) or type(error).__name__
+            return None
+        df = getattr(result, 'df', result)
+        if df is None or len(df) == 0:
+            return None
+
+        df.columns = map(str.lower, df.columns)
+        finished = self.barEnds(df.index) <= now
+        last = self.lastSeen.get(ticker)
+        new = df[finished if last is None else finished & (df.index > last)]
+        if len(new):
+            self.lastSeen[ticker] = new.index[-1]
+
+        return new
+
+    def barEnds(self, index):
+        """
+        When the bars starting at index finish (UTC)
+        """
+
+        index = pd.DatetimeIndex(index)
+        if index.tz is None:
+            index = index.tz_localize('UTC')
+        if self.timespan != 'day':
+            return index + self.barLength
+
+        days = index.tz_convert(EXCHANGE_TZ).normalize()
+        return days + pd.Timedelta(days=self.multiplier - 1) + MARKET_CLOSE
+
+    async def stream(self, tickers):
+        while True:
+            boundary = await self.clock.wait()
+            now = pd.Timestamp(boundary + self.clock.delay, unit='s', tz='UTC')
+            frames = await asyncio.gather(*[asyncio.to_thread(self.poll, ticker, now)
+                                            for ticker in tickers])
+
+            # Usually one new bar per ticker, but catch up in time order if
+            # any were missed (e.g. a slow poll)
+            bars = {}
+            for ticker, df in zip(tickers, frames):
+                if df is None:
+                    continue
+                for row in df[['open', 'high', 'low', 'close', 'volume']].itertuples():
+                    bars.setdefault(row[0], {})[ticker] = row[1:]
+            for timestamp in sorted(bars):
+                yield timestamp, bars[timestamp]
+
+
+class ReplayFeed:
+    """
+    Replays dataframes of bars as though they were arriving live
+
+    data : dict
+        Ticker -> ohlcv dataframe
+    speed : float
+        Bars are spaced by their real spacing divided by speed (e.g. 60 plays
+        a minute bar every second). None replays as fast as possible
+
+    lastPrices holds the latest close of each ticker, which PaperBroker uses
+    to fill orders
+    """
+
+    def __init__(self, data, speed=None):
+        self.data = data
+        self.speed = speed
+        self.lastPrices = {}
+
+    async def stream(self, tickers):
+        frames = {}
+        for ticker in tickers:
+            df = self.data[ticker]
+            df = df[[c for c in df.columns if c.lower() in
+                     ('open', 'high', 'low', 'close', 'volume')]]
+            df.columns = map(str.lower, df.columns)
+            frames[ticker] = df[['open', 'high', 'low', 'close', 'volume']]
+
+        # Group the bars of every ticker by time
+        bars = {}
+        for ticker, df in frames.items():
+            for row in zip(df.index, *(df[c].tolist() for c in df.columns)):
+                bars.setdefault(row[0], {})[ticker] = row[1:]
+
+        previous = None
+        for timestamp in sorted(bars):
+            if self.speed and previous is not None:
+                await asyncio.sleep((timestamp - previous).total_seconds()/self.speed)
+            else:
+                await asyncio.sleep(0)  # Let anything else waiting run
+            previous = timestamp
+            for ticker, bar in bars[timestamp].items():
+                self.lastPrices[ticker] = bar[3]
+            yield timestamp, bars[timestamp]
+
+
+# %% 4. Broker
+
+
+class PaperBroker:
+    """
+    In process broker filling market orders straight away at the last close
+    of a ReplayFeed (or at 0 if there isn't one)
+
+    feed : ReplayFeed
+        Source of the fill prices
+
+    orders holds every order submitted and positions the net quantity held
+    per ticker (negative for short)
+    """
+
+    blocking = False  # Cheap enough to call on the event loop
+
+    def __init__(self, feed=None):
+        self.feed = feed
+        self.orders = []
+        self.positions = {}
+
+    def submit_order(self, symbol, qty, side, type='market', time_in_force='day', **kwargs):
+        qty = float(qty)
+        price = self.feed.lastPrices.get(symbol, 0.0) if self.feed is not None else 0.0
+        order = {'symbol': symbol, 'qty': qty, 'side': side, 'type': type,
+                 'time_in_force': time_in_force, 'filled_avg_price': price,
+                 'status': 'filled'}
+        order.update(kwargs)
+        self.orders.append(order)
+        self.positions[symbol] = self.positions.get(symbol, 0) + \
+            (qty if side == 'buy' else -qty)
+
+        return order
+
+
+# %% 5. Live trader
+
+# trade_signal's name for each position, and the position each signal leads to
+POSITION_NAMES = {1: 'long', 0: '', -1: 'Short'}
+SIGNAL_TARGETS = {'Buy': 1, 'Sell': -1, 'Close_Sell': -1, 'Close': 0}
+
+
+class LiveTrader:
+    """
+    tickers : list of str
+        Tickers to trade
+    feed, broker :
+        See the notes at the top, e.g. PollingFeed(AggsClient(...)) and
+        alpaca_trade_api.REST, or ReplayFeed and PaperBroker
+    history : dict
+        Ticker -> ohlcv dataframe used to warm up the indicators, so signals
+        are available from the first live bar
+    qty : int
+        Number of shares per position
+    adxThreshold : float
+        ADX level above which the trend is considered significant
+    fastEMA, slowEMA, signalEMA, adxPeriod : int
+        Indicator periods, as MACD and ADX
+    latencyBudget : float
+        Seconds allowed between the bars arriving and the orders being
+        submitted, longer bars are counted as overruns
+    verbose : bool
+        Print the orders and any latency overruns
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np\n
+    asyncio
+    """
+
+    def __init__(self, tickers, feed, broker, history=None, qty=1, adxThreshold=25,
+                 fastEMA=12, slowEMA=26, signalEMA=9, adxPeriod=14,
+                 latencyBudget=1.0, verbose=True):
+        self.tickers = list(tickers)
+        self.feed = feed
+        self.broker = broker
+        self.qty = qty
+        self.adxThreshold = adxThreshold
+        self.latencyBudget = latencyBudget
+        self.verbose = verbose
+
+        history = history or {}
+        self.macd = {}
+        self.adx = {}
+        self.lastTimes = {}
+        for ticker in self.tickers:
+            if ticker in history and len(history[ticker]):
+                self.lastTimes[ticker] = history[ticker].index[-1]
+                self.macd[ticker] = ti.MACDState.fromHistory(history[ticker], fastEMA,
+                                                             slowEMA, signalEMA)
+                self.adx[ticker] = ti.ADXState.fromHistory(history[ticker], adxPeriod)
+            else:
+                self.macd[ticker] = ti.MACDState(fastEMA, slowEMA, signalEMA)
+                self.adx[ticker] = ti.ADXState(adxPeriod)
+        self.positions = {ticker: 0 for ticker in self.tickers}
+
+        self.failedOrders = []  # (timestamp, ticker, qty, side, reason)
+        self.latencies = []
+        self.overruns = 0
+        self.barsProcessed = 0
+
+    def onBars(self, timestamp, bars):
+        """
+        Update the indicators with one bar per ticker and work out the orders
+
+        timestamp : Timestamp
+            Time of the bars
+        bars : dict
+            Ticker -> (open, high, low, close, volume)
+
+        Returns
+        -------
+        orders : list of (ticker, qty, side)
+            The positions aren't changed here - run updates each one once its
+            order has been submitted
+        """
+
+        latest = {}
+        with profiling.stage('live.indicators'):
+            for ticker, (_, high, low, close, _) in bars.items():
+                # Skip bars already seen, e.g. in the history used for warm up
+                if ticker not in self.positions or (ticker in self.lastTimes and
+                                                    timestamp <= self.lastTimes[ticker]):
+                    continue
+                self.lastTimes[ticker] = timestamp
+                signal, macd = self.macd[ticker].update(close)
+                adx = self.adx[ticker].update(high, low, close)
+                latest[ticker] = IndicatorSnapshot(adx, macd, signal)
+
+        orders = []
+        with profiling.stage('live.signal'):
+            for ticker, snapshot in latest.items():
+                position = self.positions[ticker]
+                action = evaluateSignal(snapshot, POSITION_NAMES[position], self.adxThreshold)
+                target = SIGNAL_TARGETS.get(action, position)
+                if target != position:
+                    change = (target - position)*self.qty
+                    orders.append((ticker, abs(change), 'buy' if change > 0 else 'sell'))
+
+        return orders
+
+    @profiling.timed('live.orders')
+    async def submitOrders(self, orders):
+        """
+        Submit the orders, returning each one's result or the exception it
+        raised (one order failing doesn't stop the others)
+        """
+
+        submit = self.broker.submit_order
+
+        def order(ticker, qty, side):
+            return submit(symbol=ticker, qty=qty, side=side, type='market',
+                          time_in_force='day')
+
+        if inspect.iscoroutinefunction(submit):
+            return await asyncio.gather(*[order(*o) for o in orders], return_exceptions=True)
+        if getattr(self.broker, 'blocking', True):
+            # Http brokers block, so send the orders concurrently on threads
+            return await asyncio.gather(*[asyncio.to_thread(order, *o) for o in orders],
+                                        return_exceptions=True)
+
+        results = []
+        for o in orders:
+            try:
+                results.append(order(*o))
+            except Exception as error:
+                results.append(error)
+
+        return results
+
+    def _recordOrders(self, timestamp, orders, results):
+        """
+        Move the positions of the orders that went through, note the ones that
+        failed (the signal is evaluated against the unchanged position again
+        on the next bar). Returns the orders that went through
+        """
+
+        submitted = []
+        for (ticker, qty, side), result in zip(orders, results):
+            if isinstance(result, BaseException):
+                self.failedOrders.append((timestamp, ticker, qty, side,
+                                          str(result) or type(result).__name__))
+                profiling.count('live.failedOrders')
+                if self.verbose:
+                    print('{}: {} {} {} failed: {}'.format(timestamp, side, qty, ticker,
+                                                          self.failedOrders[-1][-1]))
+                continue
+            self.positions[ticker] += round(qty/self.qty)*(1 if side == 'buy' else -1)
+            submitted.append((ticker, qty, side))
+
+        return submitted
+
+    async def run(self, maxBars=None):
+        """
+        Trade until the feed runs out of bars (or maxBars have been processed)
+        """
+
+        toc = None
+        async for timestamp, bars in self.feed.stream(self.tickers):
+            tic = time.perf_counter()
+            if toc is not None:
+                profiling.record('live.feed', tic - toc)  # Waiting for / fetching the bars
+            orders = self.onBars(timestamp, bars)
+            if orders:
+                orders = self._recordOrders(timestamp, orders, await self.submitOrders(orders))
+                profiling.count('live.orders', len(orders))
+            latency = time.perf_counter() - tic
+
+            self.latencies.append(latency)
+            self.barsProcessed += 1
+            profiling.record('live.bar', latency)
+            if latency > self.latencyBudget:
+                self.overruns += 1
+                profiling.count('live.overruns')
+                if self.verbose:
+                    print('{}: bar took {:.3f} s, over the {:.3f} s budget'
+                          .format(timestamp, latency, self.latencyBudget))
+            if self.verbose:
+                for ticker, qty, side in orders:
+                    print('{}: {} {} {}'.format(timestamp, side, qty, ticker))
+            if maxBars is not None and self.barsProcessed >= maxBars:
+                break
+            toc = time.perf_counter()
+
+    def latencyStats(self):
+        """
+        Per bar latency (s): mean, 50th / 99th percentile and max, plus the
+        number of bars processed and over the budget
+        """
+
+        latencies = np.array(self.latencies) if self.latencies else np.full(1, np.nan)
+
+        return {'bars': self.barsProcessed, 'overruns': self.overruns,
+                'budget': self.latencyBudget, 'mean': float(latencies.mean()),
+                'p50': float(np.percentile(latencies, 50)),
+                'p99': float(np.percentile(latencies, 99)),
+                'max': float(latencies.max())}
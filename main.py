@@ -7,186 +7,507 @@ Created on %(date)s
 
 # %%% 0. Notes
 
-# Script using the Alpaca trading api papertrading (demo account) to do some
-# algorithmic trading on stocks
-
-# https://pypi.org/project/alpaca-trade-api/
+'''
+Command line entry point for algorithmic trading on stocks with the Alpaca
+trading api papertrading (demo account)
+
+https://pypi.org/project/alpaca-trade-api/
+
+Commands:
+    fetch : pull the ohlcv bars of the tickers into the local cache (only the
+        dates not already cached are fetched)
+    backtest : backtest the strategy on the cached bars, per ticker and as an
+        equally weighted portfolio traded in shares
+    optimize : rank strategy parameters on the cached bars, optionally with a
+        walk forward (out of sample) test
+    live : trade bar by bar through Alpaca, or --simulate over the cached bars
+        with simulatedMarket.SimulatedMarket
+
+Settings (later ones win):
+    1) DEFAULT_CONFIG below
+    2) A json file of any of its keys: --config, else $TRADING_CONFIG, else
+       tradingConfig.json in the working directory if there is one
+    3) Environment variables: APCA_API_KEY_ID, APCA_API_SECRET_KEY,
+       APCA_API_BASE_URL and APCA_API_DATA_URL (the same ones
+       alpaca_trade_api reads), TRADING_TICKERS (comma separated) and
+       TRADING_CACHE_DIR
+    4) Command line options
+The api keys can also be kept in files in keyDir (alpaca_apiKey.txt and
+alpaca_secretKey.txt), which is how this script used to read them.
+
+Only the standard library is imported at start up. Each command imports what
+it needs when it runs: alpaca_trade_api only for live trading with Alpaca and
+matplotlib only for --plot (saving to a file works without a display), so
+backtest and optimize run headless off the cache without either installed.
+
+Usage:
+    python main.py fetch --start 2020-01-01 --end 2020-05-28
+    python main.py backtest --plot AAPL --plot-file aapl.png
+    python main.py optimize --grid adxThreshold=20,25,30 --walk-forward 60 20
+    python main.py live --simulate
+    python main.py --tickers AAPL,MSFT --profile backtest
+'''
 
 
 # %% 1. Import libraries
 
-import alpaca_trade_api as tradeapi
-import copy  # For copying dictionaries
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
-plt.rcParams['font.size'] = 15
-
-# Move to correct directory for importing technical indicators
-import sys
+import argparse
+import json
 import os
-os.chdir('C:\\Users\\Dan\\Documents\\GitHub\\algorithmicTrading')
-
-# Import technical indicators
-import technicalIndicators as ti
-
-# %% 2. Define constants
-
-# Keys to make the connection to the endpoint
-key_dir = 'C:\\Users\\Dan\\Documents\\Python Scripts\\apiKeys\\'
-apiKey = open(key_dir + 'alpaca_apiKey.txt', 'r').read()
-secretKey = open(key_dir + 'alpaca_secretKey.txt', 'r').read()
-endPoint = 'https://paper-api.alpaca.markets'  # Specify this for demo account
-
-# Define companies of interest
-tickers = ['AXP', 'AAPL', 'BA', 'CAT', 'CVX', 'CSCO', 'DIS', 'DOW', 'XOM',
-           'HD', 'IBM', 'INTC', 'JNJ', 'KO', 'MCD', 'MMM', 'MRK', 'MSFT',
-           'NKE', 'PFE', 'PG', 'TRV', 'UTX', 'UNH', 'VZ', 'V', 'WMT', 'WBA']
-
-# Define dates between which we extract the stock data
-startDate = '2020-01-01'
-endDate = '2020-05-28'
-
+import sys
 
-# %% 3. Connect to api and pull data for the defined tickers
+# Everything else is imported by the commands that use it
+
+
+# %% 2. Settings
+
+DOW_TICKERS = ['AXP', 'AAPL', 'BA', 'CAT', 'CVX', 'CSCO', 'DIS', 'DOW', 'XOM',
+               'HD', 'IBM', 'INTC', 'JNJ', 'KO', 'MCD', 'MMM', 'MRK', 'MSFT',
+               'NKE', 'PFE', 'PG', 'TRV', 'UTX', 'UNH', 'VZ', 'V', 'WMT', 'WBA']
+
+DEFAULT_CONFIG = {'tickers': DOW_TICKERS,
+                  'startDate': '2020-01-01',
+                  'endDate': '2020-05-28',
+                  'timeframe': '1day',
+                  'cacheDir': 'ohlcvCache',
+                  'apiKey': '',
+                  'secretKey': '',
+                  'keyDir': None,
+                  'endPoint': 'https://paper-api.alpaca.markets',  # Demo account
+                  'dataUrl': 'https://data.alpaca.markets',
+                  'maxWorkers': 8,
+                  'requestsPerMinute': 200,
+                  'fastEMA': 12,
+                  'slowEMA': 26,
+                  'signalEMA': 9,
+                  'adxPeriod': 14,
+                  'adxThreshold': 25,
+                  'holdPositions': True,
+                  'qty': 10,
+                  'cash': 100000,
+                  'periodsPerYear': 252,
+                  'workers': 1,
+                  'backend': 'numpy'}
+
+ENVIRONMENT = {'APCA_API_KEY_ID': 'apiKey', 'APCA_API_SECRET_KEY': 'secretKey',
+               'APCA_API_BASE_URL': 'endPoint', 'APCA_API_DATA_URL': 'dataUrl',
+               'TRADING_TICKERS': 'tickers', 'TRADING_CACHE_DIR': 'cacheDir'}
+
+
+def loadConfig(path=None, environ=os.environ):
+    """
+    Parameters
+    ----------
+    path : str
+        json config file, defaults to $TRADING_CONFIG or tradingConfig.json
+        (if it exists)
+    environ : dict
+        Environment variables
+
+    Returns
+    -------
+    config : dict
+        DEFAULT_CONFIG updated from the file and then the environment
+    """
+
+    config = dict(DEFAULT_CONFIG)
+    path = path or environ.get('TRADING_CONFIG') or \
+        ('tradingConfig.json' if os.path.exists('tradingConfig.json') else None)
+    if path:
+        with open(path, 'r') as file:
+            settings = json.load(file)
+        unknown = set(settings) - set(DEFAULT_CONFIG)
+        if unknown:
+            raise ValueError('Unknown settings in {}: {}'.format(path, ', '.join(sorted(unknown))))
+        config.update(settings)
+
+    for variable, key in ENVIRONMENT.items():
+        if environ.get(variable):
+            config[key] = environ[variable]
+    if isinstance(config['tickers'], str):
+        config['tickers'] = _tickerList(config['tickers'])
+
+    # Keys kept in files, as the old script did
+    if config['keyDir']:
+        for key, name in [('apiKey', 'alpaca_apiKey.txt'), ('secretKey', 'alpaca_secretKey.txt')]:
+            keyFile = os.path.join(config['keyDir'], name)
+            if not config[key] and os.path.exists(keyFile):
+                with open(keyFile, 'r') as file:
+                    config[key] = file.read().strip()
+
+    return config
+
+
+def _tickerList(tickers):
+    return [ticker.strip().upper() for ticker in tickers.split(',') if ticker.strip()]
+
+
+def _barSize(timeframe):
+    """
+    (multiplier, timespan) of a cache timeframe, e.g. '15minute' -> (15, 'minute')
+    """
+
+    timespan = timeframe.lstrip('0123456789')
+
+    return int(timeframe[:len(timeframe) - len(timespan)] or 1), timespan
+
+
+def _requireKeys(config):
+    if not (config['apiKey'] and config['secretKey']):
+        sys.exit('No api keys: set APCA_API_KEY_ID and APCA_API_SECRET_KEY, or apiKey / '
+                 'secretKey or keyDir in the config file')
+
+
+def _cachedData(config):
+    """
+    (cache, ticker -> ohlcv dataframe) of the cached bars of the tickers
+    between the dates, reporting any that aren't cached
+    """
+
+    from ohlcvCache import OHLCVCache
+
+    cache = OHLCVCache(config['cacheDir'])
+    data = {}
+    for ticker in config['tickers']:
+        df = cache.read(ticker, config['timeframe'], config['startDate'], config['endDate'])
+        if df is not None and len(df):
+            data[ticker] = df
+    missing = [ticker for ticker in config['tickers'] if ticker not in data]
+    if missing:
+        print('Not cached (run fetch first): {}'.format(', '.join(missing)))
+    if not data:
+        sys.exit('No cached {} bars in {} between {} and {}'.format(
+            config['timeframe'], config['cacheDir'], config['startDate'], config['endDate']))
+
+    return cache, data
+
+
+# %% 3. Commands
+
+
+def fetch(config, args):
+    """
+    Pull the bars of the tickers into the cache
+    """
 
-api = tradeapi.REST(apiKey, secretKey, endPoint, api_version='v2')
-account = api.get_account()
-# api.list_positions()
+    import dataLoader as dl
+    from ohlcvCache import OHLCVCache
 
-# Define the dictionary that will hold all the data for all the companies
-data = {}
-for ticker in tickers:
+    _requireKeys(config)
+    multiplier, timespan = _barSize(config['timeframe'])
+    client = dl.AggsClient(config['apiKey'], config['secretKey'], config['dataUrl'])
     try:
-        # Pull the stock details for that ticker
-        data[ticker] = api.get_aggs(ticker, 1, 'day', startDate, endDate).df
-        # Calculate their daily return
-        data[ticker]['daily return'] = data[ticker]['close'].pct_change()
-        print('Pulling ohlcv data for {:s}'.format(ticker))
-    except:
-        # If nothing is found, throw error and continue
-        print('Error encountered pulling ohlcv data for {:s}'.format(ticker))
-
-
-# %% 4. Plot the indicators that are the basis for the strategy
-
-df = data['AAPL'].copy()
-df['ADX'] = ti.ADX(df, n=14)  # Placeholder for one of the ticker dataframes
-df[['signal', 'macd']] = ti.MACD(df, 12, 26, 9)
-
-# Plot close price against ADX line
-fig1, ax1 = plt.subplots()
-ax1.plot(df['close'], linestyle='--', color='blue', label='close')
-ax2 = ax1.twinx()
-ax2.plot(df['ADX'], color='red', label='ADX')
-ax1.set_xlabel('Date'), ax1.set_ylabel('Close price ($)'), ax2.set_ylabel('ADX')
-fig1.legend(loc='upper left', bbox_to_anchor=(0,1), bbox_transform=ax1.transAxes)
-plt.show()
-
-# Plot close price against macd and signal lines
-fig2, ax3 = plt.subplots()
-ax3.plot(df['close'], linestyle='--', color='blue', label='close')
-ax4 = ax3.twinx()
-ax4.plot(df['macd'], color='red', label='macd')
-ax4.plot(df['signal'], color='black', label='signal')
-ax3.set_xlabel('Date'), ax3.set_ylabel('Close price ($)'), ax4.set_ylabel('macd and signal')
-fig2.legend(loc='upper left', bbox_to_anchor=(0,1), bbox_transform=ax3.transAxes)
-plt.show()
-
-# First date when ADX > 25
-#df.loc[df['ADX']>25].index[0]
-
-
-# %% 5. Loop through the data and append the technical indicator columns
-
-tickers = list(data.keys())  # Any tickers that didn't load shouldn't survive
-for ticker in tickers:
-    data[ticker][['signal', 'macd']] = ti.MACD(data[ticker], 12, 26, 9)
-    data[ticker]['ADX'] = ti.ADX(data[ticker], 14)
-    print('Adding technical indicators for {:s}'.format(ticker))
-
-
-# %% 6. Define the trading strategy
-
-
-def trade_signal(dfWithIndicators, longOrShort):
-
-    "function to generate signal"
-    signal = ''  # If there's no clear signal, return blank (no trade)
-    df = copy.deepcopy(dfWithIndicators)
-    
-    # With no existing position for the current asset
-    if longOrShort == '':
-        if (df['ADX'][-1] > 25) and (df['macd'][-1] > df['signal'][-1]):
-            signal = 'Buy'
-        elif (df['ADX'][-1] > 25) and (df['macd'][-1] < df['signal'][-1]):
-            signal = 'Sell'
-
-    # If you have an existing long position
-    elif longOrShort == 'long':
-        # macd has fallen below the signal and the trend is still significant
-        if (df['ADX'][-1] > 25) and (df['macd'][-1] < df['signal'][-1]):
-            signal = 'Close_Sell'
-        # Exit conditions (lacking trend while macd falls below signal)
-        elif df['macd'][-1] < df['signal'][-1]:
-            signal = 'Close'
-
-    # If you have an existing short position
-    elif longOrShort == 'Short':
-        if (df['ADX'][-1] > 25) and (df['macd'][-1] > df['signal'][-1]):
-            signal = 'Buy'
-        # Exit the short position if the macd rises above signal
-        elif df['macd'][-1] > df['signal'][-1]:
-            signal = 'Close'
-
-    return signal
-
-
-# %% 7. Quick test of strategy function
-
-# Need to feed the function values of the strategy as though it were live
-# api.list_positions()  # To pull positions through the alpaca api
-longOrShort = ''
-positionTaken = []
-positionDates = []
-k = 0
-data['AAPL']['position'] = 0
-trades = data['AAPL']['position'].copy()
-
-# Offset start because there will be a bunch of nan values there
-for i in range(34, len(data['AAPL'])):
-    # Each time this executes it's like the data from a new day has been added
-    historicalData = data['AAPL'].iloc[33:i].copy()
-    signal = trade_signal(historicalData, longOrShort)
-    print(historicalData.index[-1], signal)
-    
-    # With no position and a buy signal, enter a position
-    if signal == 'Buy':
-        trades.iloc[i] = 1
-        #positionDates.append(historicalData.index[k]) 
-
-    if signal == '':
-        trades.iloc[i] = 0
-        #positionDates.append(historicalData.index[k]) 
-
-    if signal == 'Sell':
-        trades.iloc[i] = -1
-        #positionDates.append(historicalData.index[k])
-    
-    k += 1
-    
-    # If you're in a position
-    #if positionTaken == 1:
-    #    if signal == 'Buy':
-    #        money.append((1 + historicalData['daily return'][i-34]).cumprod())
-    #    if signal == 'Sell':
-    #        money.append((1 - historicalData['daily return'][i-34]).cumprod())
-
-# %%
-
-trades.plot()
-# Check how you're calculating ADX - if it just measures the strength of a trend
-# then why does it have a minima when the price trend direction changes?
+        data, failures = dl.fetchOHLCV(config['tickers'], config['startDate'],
+                                       config['endDate'], client, multiplier, timespan,
+                                       maxWorkers=config['maxWorkers'],
+                                       requestsPerMinute=config['requestsPerMinute'],
+                                       cache=OHLCVCache(config['cacheDir']))
+    finally:
+        client.close()
+
+    print('{} of {} tickers cached in {}'.format(len(data), len(config['tickers']),
+                                                 config['cacheDir']))
+    for ticker, reason in failures.items():
+        print('Failed {}: {}'.format(ticker, reason))
+
+    return 0 if data else 1
+
+
+def backtest(config, args):
+    """
+    Backtest the strategy on the cached bars
+    """
+
+    import pandas as pd
+    import backtest as bt
+    import portfolio as pf
+    import sharedData as sd
+    import technicalIndicators as ti
+
+    ti.setBackend(config['backend'])
+    _, data = _cachedData(config)
+    tickers = list(data)
+
+    # Each bar's signal is worked out from the indicators at the previous
+    # close, and sets the position held over that bar. With several workers
+    # the bars go in shared memory, so the workers read them rather than each
+    # being sent a copy
+    parameters = (config['fastEMA'], config['slowEMA'], config['signalEMA'],
+                  config['adxPeriod'], config['adxThreshold'], config['holdPositions'])
+    if config['workers'] == 1:
+        panel = bt.panelBacktest(data, *parameters, workers=1)
+    else:
+        with sd.SharedOHLCV(data) as store:
+            panel = bt.panelBacktest(store, *parameters, workers=config['workers'])
+
+    # Where each ticker stands now: its latest indicator values, all the
+    # tickers at once as (time x ticker) arrays
+    arrays = ti.panelArrays(data)
+    signal, macd = ti.batchMACD(arrays.close, config['fastEMA'], config['slowEMA'],
+                                config['signalEMA'], present=arrays.present)
+    adx = ti.batchADX(arrays.high, arrays.low, arrays.close, config['adxPeriod'],
+                      present=arrays.present)
+    latest = {name: pd.DataFrame(values, index=arrays.index, columns=arrays.tickers)
+              .ffill().iloc[-1] for name, values in
+              [('ADX', adx), ('macd', macd), ('signal', signal)]}
+
+    summary = pd.DataFrame({'growth': (1 + panel.returns.fillna(0)).prod(),
+                            'trades': panel.positions.diff().abs().gt(0).sum(), **latest})
+    print(summary.round(3).to_string())
+    print('Portfolio growth: {:.3f}'.format(panel.portfolio['equity'].iloc[-1]))
+
+    # The same positions traded in shares, with cash, fees and mark to market equity
+    closes = pd.DataFrame({ticker: data[ticker]['close'] for ticker in tickers}) \
+        .reindex(panel.positions.index)
+    book = pf.Portfolio(tickers, cash=config['cash'],
+                        fees=pf.commission(perShare=0.005, minimum=1))
+    book.recordFills(*pf.fillsFromPositions(panel.positions, closes, qty=config['qty']))
+    curve = book.revalue(panel.positions.index, closes)
+    for name, value in pf.performance(curve, config['periodsPerYear']).items():
+        print('{}: {:.4f}'.format(name, value))
+
+    if args.output:
+        curve.to_csv(args.output)
+        print('Equity curve saved to {}'.format(args.output))
+    if args.plot:
+        plotIndicators(data[args.plot.upper()], config, args.plot_file)
+
+    return 0
+
+
+def optimize(config, args):
+    """
+    Rank strategy parameters on the cached bars, and walk forward test them
+    """
+
+    import optimizer
+    import technicalIndicators as ti
+
+    ti.setBackend(config['backend'])
+    cache, data = _cachedData(config)
+    # Only the parameters in --grid are swept, the rest stay at their config
+    # values (no --grid sweeps the whole of optimizer.DEFAULT_GRID)
+    grid = {**{name: [config[name]] for name in optimizer.PARAMETERS},
+            **_grid(args.grid)} if args.grid else None
+
+    # Rank the MACD spans, ADX period and ADX threshold by the Sharpe ratio of
+    # the portfolio (see optimizer.DEFAULT_GRID for the full grid)
+    ranking = optimizer.optimize(data, grid, nRandom=args.random,
+                                 holdPositions=config['holdPositions'],
+                                 periodsPerYear=config['periodsPerYear'], rankBy=args.rank_by,
+                                 workers=config['workers'])
+    print(ranking.head(args.top).to_string())
+    if args.output:
+        ranking.to_csv(args.output)
+        print('Ranking saved to {}'.format(args.output))
+
+    # Out of sample check: pick the parameters on trainBars, trade the next
+    # testBars with them and step forward
+    if args.walk_forward:
+        import walkForward as wf
+
+        trainBars, testBars = args.walk_forward
+        walk = wf.walkForward((cache, list(data)), trainBars, testBars, args.anchored,
+                              grid, config['timeframe'], config['holdPositions'],
+                              config['periodsPerYear'], args.rank_by, config['workers'])
+        print(walk.folds.to_string())
+        for name, value in walk.metrics.items():
+            print('{}: {:.4f}'.format(name, value))
+
+    return 0
+
+
+def _grid(text):
+    """
+    Grid from 'name=v1,v2 name=v3' (or ';' between parameters), values as
+    ints where they're whole numbers, otherwise floats (e.g. adxThreshold=22.5)
+    """
+
+    grid = {}
+    for item in text.replace(';', ' ').split():
+        name, values = item.split('=')
+        grid[name] = [int(float(v)) if float(v).is_integer() else float(v)
+                      for v in values.split(',')]
+
+    return grid
+
+
+def live(config, args):
+    """
+    Trade the strategy bar by bar, through Alpaca or simulated over the cache
+    """
+
+    import asyncio
+    import pandas as pd
+    from liveTrading import LiveTrader, PollingFeed
+    import technicalIndicators as ti
+
+    ti.setBackend(config['backend'])
+    parameters = {name: config[name] for name in
+                  ('qty', 'adxThreshold', 'fastEMA', 'slowEMA', 'signalEMA', 'adxPeriod')}
+
+    if args.simulate:
+        # Replay the cached bars, the first ones warming up the indicators
+        from simulatedMarket import SimulatedMarket
+
+        _, data = _cachedData(config)
+        tickers = list(data)
+        history = {ticker: df.iloc[:args.warmup] for ticker, df in data.items()}
+        market = SimulatedMarket(data, *_barSize(config['timeframe']), cash=config['cash'])
+        feed = broker = market
+    else:
+        import alpaca_trade_api as tradeapi
+        import dataLoader as dl
+        from ohlcvCache import OHLCVCache
+
+        _requireKeys(config)
+        broker = tradeapi.REST(config['apiKey'], config['secretKey'], config['endPoint'],
+                               api_version='v2')
+        client = dl.AggsClient(config['apiKey'], config['secretKey'], config['dataUrl'])
+
+        # Warm up on the bars up to today (through the cache) before trading
+        multiplier, timespan = _barSize(config['timeframe'])
+        today = pd.Timestamp.now(tz='UTC').strftime('%Y-%m-%d')
+        history, failures = dl.fetchOHLCV(config['tickers'], config['startDate'], today,
+                                          client, multiplier, timespan,
+                                          maxWorkers=config['maxWorkers'],
+                                          requestsPerMinute=config['requestsPerMinute'],
+                                          cache=OHLCVCache(config['cacheDir']), verbose=False)
+        for ticker, reason in failures.items():
+            print('No history for {}: {}'.format(ticker, reason))
+        tickers = config['tickers']
+        feed = PollingFeed(client, multiplier, timespan)
+
+    trader = LiveTrader(tickers, feed, broker, history, **parameters)
+    try:
+        asyncio.run(trader.run(args.max_bars))
+    except KeyboardInterrupt:
+        pass
+
+    print(trader.latencyStats())
+    if args.simulate:
+        print(market.get_account())
+
+    return 0
+
+
+def plotIndicators(df, config, path=None):
+    """
+    Plot close price against ADX, and against the macd and signal lines. Saved
+    to path if given (no display needed), otherwise shown
+    """
+
+    import matplotlib
+    if path:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import indicatorCache as ic  # Memoised versions of the indicators
+    plt.rcParams['font.size'] = 15
+
+    df = df.copy()
+    df['ADX'] = ic.ADX(df, n=config['adxPeriod'])
+    df[['signal', 'macd']] = ic.MACD(df, config['fastEMA'], config['slowEMA'],
+                                     config['signalEMA'])
+
+    fig, (ax1, ax3) = plt.subplots(2, 1, sharex=True, figsize=(12, 10))
+    ax1.plot(df['close'], linestyle='--', color='blue', label='close')
+    ax2 = ax1.twinx()
+    ax2.plot(df['ADX'], color='red', label='ADX')
+    ax1.set_ylabel('Close price ($)'), ax2.set_ylabel('ADX')
+    ax1.legend(loc='upper left'), ax2.legend(loc='upper right')
+
+    ax3.plot(df['close'], linestyle='--', color='blue', label='close')
+    ax4 = ax3.twinx()
+    ax4.plot(df['macd'], color='red', label='macd')
+    ax4.plot(df['signal'], color='black', label='signal')
+    ax3.set_xlabel('Date'), ax3.set_ylabel('Close price ($)'), ax4.set_ylabel('macd and signal')
+    ax3.legend(loc='upper left'), ax4.legend(loc='upper right')
+
+    if path:
+        fig.savefig(path, bbox_inches='tight')
+        plt.close(fig)
+        print('Plot saved to {}'.format(path))
+    else:
+        plt.show()
+
+
+# %% 4. Command line
+
+COMMANDS = {'fetch': fetch, 'backtest': backtest, 'optimize': optimize, 'live': live}
+
+
+def parseArguments(argv=None):
+    parser = argparse.ArgumentParser(description='ADX + MACD trading strategy: fetch data, '
+                                                 'backtest, optimize and trade live')
+    parser.add_argument('--config', default=None, help='json settings file')
+    parser.add_argument('--tickers', default=None, help='comma separated, e.g. AAPL,MSFT')
+    parser.add_argument('--start', default=None, help='start date, YYYY-MM-DD')
+    parser.add_argument('--end', default=None, help='end date, YYYY-MM-DD')
+    parser.add_argument('--timeframe', default=None, help="bar size, e.g. '1day', '1minute'")
+    parser.add_argument('--cache-dir', default=None)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes for backtests and sweeps')
+    parser.add_argument('--profile', action='store_true',
+                        help='print the time spent in each stage at the end (summed over '
+                             'the worker processes)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('fetch', help='pull the bars into the cache')
+
+    backtestParser = commands.add_parser('backtest', help='backtest on the cached bars')
+    backtestParser.add_argument('--plot', default=None, metavar='TICKER',
+                                help='plot the indicators of a ticker')
+    backtestParser.add_argument('--plot-file', default=None,
+                                help='save the plot here instead of showing it')
+    backtestParser.add_argument('--output', default=None, help='save the equity curve (csv)')
+
+    optimizeParser = commands.add_parser('optimize', help='rank the strategy parameters')
+    optimizeParser.add_argument('--grid', default=None,
+                                help="e.g. 'adxThreshold=20,25,30 adxPeriod=10,14' - only "
+                                     "these are swept, the other parameters stay at their "
+                                     "config values. Defaults to optimizer.DEFAULT_GRID")
+    optimizeParser.add_argument('--random', type=int, default=None,
+                                help='try this many random combinations of the grid')
+    optimizeParser.add_argument('--rank-by', default='sharpe',
+                                choices=['sharpe', 'totalReturn', 'maxDrawdown'])
+    optimizeParser.add_argument('--top', type=int, default=10)
+    optimizeParser.add_argument('--output', default=None, help='save the ranking (csv)')
+    optimizeParser.add_argument('--walk-forward', type=int, nargs=2, default=None,
+                                metavar=('TRAIN_BARS', 'TEST_BARS'))
+    optimizeParser.add_argument('--anchored', action='store_true',
+                                help='walk forward with an expanding training window')
+
+    liveParser = commands.add_parser('live', help='trade bar by bar')
+    liveParser.add_argument('--simulate', action='store_true',
+                            help='replay the cached bars through a simulated market')
+    liveParser.add_argument('--warmup', type=int, default=100,
+                            help='bars used to warm up the indicators when simulating')
+    liveParser.add_argument('--max-bars', type=int, default=None)
+
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parseArguments(argv)
+    config = loadConfig(args.config)
+    overrides = {'tickers': args.tickers and _tickerList(args.tickers),
+                 'startDate': args.start, 'endDate': args.end, 'timeframe': args.timeframe,
+                 'cacheDir': args.cache_dir, 'workers': args.workers}
+    config.update({key: value for key, value in overrides.items() if value is not None})
+
+    if args.profile:
+        import profiling
+        profiling.enable()
+    status = COMMANDS[args.command](config, args)
+    if args.profile:
+        profiling.printReport()
+
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
 
 # %% X.
 
@@ -208,4 +529,4 @@ api.submit_order(
         limit_price='295.5',
     )
 )
-'''
\ No newline at end of file
+'''
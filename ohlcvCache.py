@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+"""
+Created on %(date)s
+
+@author: Treacher
+
+Contains: on-disk cache of ohlcv bars, one set of column files per ticker and
+bar size
+"""
+
+# %%% 0. Notes
+
+'''
+Local store of the ohlcv bars already pulled, so each run only has to fetch the
+part of the date range it doesn't have yet (normally just the latest bars).
+
+Layout:
+    <cacheDir>/<timeframe>/<ticker>/timestamp.i8   epoch nanoseconds (UTC)
+                                   /open.f8 ... volume.f8
+                                   /meta.json     rows, dates covered, timezone
+
+Each column is a flat binary file that's read back with np.memmap, so loading
+is close to free and the arrays can be shared between processes without
+copying. New bars after the end of the file are appended in place, anything
+else (earlier bars, overlaps) rewrites the columns.
+
+The dates covered are stored separately from the bars themselves, since a
+range can legitimately contain no bars (weekends, holidays). Today is never
+marked as covered because today's bar may not be finished yet.
+'''
+
+
+# %% 1. Import libraries
+
+import json
+import os
+import numpy as np
+import pandas as pd
+
+import profiling
+
+
+# %% 2. Cache
+
+
+COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+ONE_DAY = pd.Timedelta(days=1)
+
+
+class OHLCVCache:
+    """
+    cacheDir : str
+        Folder holding the cache, created if it doesn't exist
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np
+    """
+
+    def __init__(self, cacheDir='ohlcvCache'):
+        self.cacheDir = cacheDir
+
+    def folder(self, ticker, timeframe):
+        return os.path.join(self.cacheDir, timeframe, ticker)
+
+    def meta(self, ticker, timeframe):
+        """
+        Contents of meta.json, or None if nothing is cached
+        """
+
+        path = os.path.join(self.folder(ticker, timeframe), 'meta.json')
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as file:
+            return json.load(file)
+
+    def missingRanges(self, ticker, timeframe, startDate, endDate):
+        """
+        Parameters
+        ----------
+        ticker, timeframe : str
+            e.g. 'AAPL', '1day'
+        startDate, endDate : str
+            Date range wanted as 'YYYY-MM-DD' (inclusive)
+
+        Returns
+        -------
+        ranges : list of (str, str)
+            Date ranges that still need fetching (at most one before and one
+            after the dates already covered). These always join on to the
+            covered dates, so the cache never has holes in it
+        """
+
+        meta = self.meta(ticker, timeframe)
+        if meta is None:
+            return [(startDate, endDate)]
+
+        start, end = pd.Timestamp(startDate), pd.Timestamp(endDate)
+        coveredFrom = pd.Timestamp(meta['coveredFrom'])
+        coveredTo = pd.Timestamp(meta['coveredTo'])
+        ranges = []
+        if start < coveredFrom:
+            ranges.append((_date(start), _date(coveredFrom - ONE_DAY)))
+        if end > coveredTo:
+            ranges.append((_date(coveredTo + ONE_DAY), _date(end)))
+
+        return ranges
+
+    def arrays(self, ticker, timeframe):
+        """
+        Memory mapped (read only) column arrays of everything cached for a
+        ticker, as a dict with a 'timestamp' entry (epoch ns) plus the ohlcv
+        columns. None if nothing is cached
+        """
+
+        meta = self.meta(ticker, timeframe)
+        if meta is None:
+            return None
+
+        folder = self.folder(ticker, timeframe)
+        arrays = {}
+        for column, dtype in [('timestamp', np.int64)] + [(c, np.float64) for c in COLUMNS]:
+            path = os.path.join(folder, column + _suffix(dtype))
+            if meta['rows'] == 0:
+                arrays[column] = np.empty(0, dtype=dtype)
+            else:
+                arrays[column] = np.memmap(path, dtype=dtype, mode='r', shape=(meta['rows'],))
+
+        return arrays
+
+    @profiling.timed('cache.read')
+    def read(self, ticker, timeframe, startDate=None, endDate=None):
+        """
+        Cached bars between two dates (inclusive) as an ohlcv dataframe, in
+        the same layout as the loader returns. None if nothing is cached
+        """
+
+        meta = self.meta(ticker, timeframe)
+        arrays = self.arrays(ticker, timeframe)
+        if arrays is None:
+            return None
+
+        # Binary search the sorted timestamps rather than filtering the frame
+        index = pd.to_datetime(arrays['timestamp'], utc=True).tz_convert(meta['tz'])
+        first = 0 if startDate is None else \
+            index.searchsorted(pd.Timestamp(startDate, tz=meta['tz']))
+        last = len(index) if endDate is None else \
+            index.searchsorted(pd.Timestamp(endDate, tz=meta['tz']) + ONE_DAY)
+
+        df = pd.DataFrame({c: np.asarray(arrays[c][first:last]) for c in COLUMNS},
+                          index=index[first:last])
+        df.index.name = 'timestamp'
+
+        return df
+
+    def update(self, ticker, timeframe, bars, startDate, endDate):
+        """
+        Parameters
+        ----------
+        ticker, timeframe : str
+            e.g. 'AAPL', '1day'
+        bars : Dataframe
+            Newly fetched ohlcv bars (may be empty)
+        startDate, endDate : str
+            Date range the bars were fetched for, which is now covered
+        """
+
+        meta = self.meta(ticker, timeframe)
+        folder = self.folder(ticker, timeframe)
+        os.makedirs(folder, exist_ok=True)
+
+        bars = bars[COLUMNS] if len(bars) else pd.DataFrame(columns=COLUMNS)
+        if len(bars):
+            tz = str(bars.index.tz) if bars.index.tz is not None else 'UTC'
+            newTimes = _epochNanoseconds(bars.index)
+        else:
+            tz = meta['tz'] if meta else 'America/New_York'
+            newTimes = np.empty(0, dtype=np.int64)
+        newColumns = {c: bars[c].to_numpy(dtype=np.float64) for c in COLUMNS}
+
+        # Today's bar might still change, so don't count today as covered
+        today = pd.Timestamp.now(tz=tz).tz_localize(None).normalize()
+        coveredTo = min(pd.Timestamp(endDate), today - ONE_DAY)
+        coveredFrom = pd.Timestamp(startDate)
+
+        rows = 0 if meta is None else meta['rows']
+        if meta is not None:
+            coveredFrom = min(coveredFrom, pd.Timestamp(meta['coveredFrom']))
+            coveredTo = max(coveredTo, pd.Timestamp(meta['coveredTo']))
+        old = self.arrays(ticker, timeframe)
+        append = rows == 0 or len(newTimes) == 0 or newTimes[0] > old['timestamp'][-1]
+
+        if append:
+            # New bars all come after the cached ones, so add them in place
+            del old  # release the memory maps before writing to the files
+            _writeColumns(folder, newTimes, newColumns, rows)
+            rows += len(newTimes)
+        else:
+            # Merge, letting the new bars replace any cached ones at the same time
+            times = np.concatenate((newTimes, old['timestamp']))
+            times, first = np.unique(times, return_index=True)
+            merged = {c: np.concatenate((newColumns[c], old[c]))[first] for c in COLUMNS}
+            del old
+            _writeColumns(folder, times, merged, 0)
+            rows = len(times)
+
+        meta = {'rows': int(rows), 'tz': tz, 'coveredFrom': _date(coveredFrom),
+                'coveredTo': _date(max(coveredTo, coveredFrom - ONE_DAY))}
+        temporary = os.path.join(folder, 'meta.json.tmp')
+        with open(temporary, 'w') as file:
+            json.dump(meta, file)
+        os.replace(temporary, os.path.join(folder, 'meta.json'))
+
+
+# %% 3. Helpers
+
+
+def _date(timestamp):
+    return pd.Timestamp(timestamp).strftime('%Y-%m-%d')
+
+
+def _suffix(dtype):
+    return '.i8' if np.dtype(dtype) == np.int64 else '.f8'
+
+
+def _epochNanoseconds(index):
+    """
+    Epoch nanoseconds (UTC) of a datetime index, whatever its resolution
+    """
+
+    if index.tz is not None:
+        index = index.tz_convert('UTC').tz_localize(None)
+
+    return np.asarray((index - pd.Timestamp('1970-01-01')) // pd.Timedelta('1ns'),
+                      dtype=np.int64)
+
+
+def _writeColumns(folder, times, columns, offset):
+    """
+    Write the arrays into the column files starting at row offset, cutting off
+    anything after them (e.g. left over from an interrupted write)
+    """
+
+    for column, values in [('timestamp', times)] + [(c, columns[c]) for c in COLUMNS]:
+        values = np.ascontiguousarray(values)
+        path = os.path.join(folder, column + _suffix(values.dtype))
+        with open(path, 'r+b' if os.path.exists(path) else 'wb') as file:
+            file.seek(offset*values.itemsize)
+            file.write(values.tobytes())
+            file.truncate()
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+"""
+Created on %(date)s
+
+@author: Treacher
+
+Contains: grid / random search over the parameters of the ADX + MACD strategy
+"""
+
+# %%% 0. Notes
+
+'''
+Sweeps the strategy parameters that are otherwise hard coded:
+    fastEMA, slowEMA, signalEMA : MACD periods (12, 26, 9)
+    adxPeriod : ADX smoothing period (14)
+    adxThreshold : ADX level for a significant trend (25)
+and ranks every combination by the Sharpe ratio, total return and maximum
+drawdown of the equally weighted portfolio over the whole ticker universe.
+
+With no grid the whole of DEFAULT_GRID is swept. A grid given replaces it:
+only the parameters in it are swept and the rest are fixed at their
+STRATEGY_DEFAULTS (the values above), so {'adxThreshold': [20, 25, 30]} is
+three combinations, not three times the default grid.
+
+To keep this fast, work is shared wherever the parameters allow:
+    1) Each EMA span of close is computed once per ticker and reused by every
+       MACD (fast, slow) pair that needs it
+    2) Each signal line is computed once per (fast, slow, signal) and each ADX
+       once per period
+    3) All the combinations that share a (fast, slow) pair are evaluated
+       together as the columns of one (time x combination) array, so the
+       strategy rules run once per pair rather than once per combination
+
+Combinations are grouped by (fast, slow) pair and the groups split across a
+pool of worker processes, which only send back the summary statistics.
+'''
+
+
+# %% 1. Import libraries
+
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import os
+import numpy as np
+import pandas as pd
+
+import backtest as bt
+import profiling
+import strategy
+import technicalIndicators as ti
+
+
+# %% 2. Parameter combinations
+
+PARAMETERS = ['fastEMA', 'slowEMA', 'signalEMA', 'adxPeriod', 'adxThreshold']
+
+DEFAULT_GRID = {'fastEMA': [8, 10, 12, 14, 16],
+                'slowEMA': [20, 23, 26, 29, 32],
+                'signalEMA': [6, 7, 8, 9, 10, 11, 12],
+                'adxPeriod': [10, 12, 14, 16, 18, 20],
+                'adxThreshold': list(range(15, 36))}
+
+# The hard coded values of the strategy, for any parameter a grid leaves out
+STRATEGY_DEFAULTS = {'fastEMA': 12, 'slowEMA': 26, 'signalEMA': 9, 'adxPeriod': 14,
+                     'adxThreshold': 25}
+
+
+def parameterCombinations(grid=None, nRandom=None, seed=0):
+    """
+    Parameters
+    ----------
+    grid : dict
+        Parameter name -> list of values to try. Parameters not in it are
+        fixed at STRATEGY_DEFAULTS. None sweeps the whole DEFAULT_GRID
+    nRandom : int
+        If given, a random sample of this many combinations from the grid
+        instead of all of them
+    seed : int
+        Seed for the random sample
+
+    Returns
+    -------
+    combinations : Dataframe
+        One row per combination, one column per parameter. Combinations with
+        fastEMA >= slowEMA are left out
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np
+    """
+
+    unknown = set(grid or {}) - set(PARAMETERS)
+    if unknown:
+        raise KeyError('Unknown parameters: {}'.format(sorted(unknown)))
+    grid = DEFAULT_GRID if grid is None else \
+        {**{p: [value] for p, value in STRATEGY_DEFAULTS.items()}, **grid}
+    combinations = pd.DataFrame(list(itertools.product(*[grid[p] for p in PARAMETERS])),
+                                columns=PARAMETERS)
+    combinations = combinations[combinations['fastEMA'] < combinations['slowEMA']]
+    if nRandom is not None and nRandom < len(combinations):
+        combinations = combinations.sample(nRandom, random_state=seed)
+
+    return combinations.reset_index(drop=True)
+
+
+# %% 3. Optimiser
+
+
+def optimize(data, grid=None, nRandom=None, seed=0, holdPositions=True,
+             periodsPerYear=252, rankBy='sharpe', workers=None, chunksPerWorker=4):
+    """
+    Parameters
+    ----------
+    data : dict
+        Ticker -> ohlcv dataframe
+    grid, nRandom, seed :
+        Combinations to try, see parameterCombinations
+    holdPositions : bool
+        See backtest.backtest
+    periodsPerYear : int
+        Bars per year used to annualise the Sharpe ratio (252 for daily bars)
+    rankBy : str
+        Column to sort the results by ('sharpe', 'totalReturn' or
+        'maxDrawdown', which is sorted smallest first)
+    workers : int
+        Number of worker processes, defaults to the number of cpus. 1 runs in
+        the current process (needed if the caller has no __main__ guard on
+        Windows)
+    chunksPerWorker : int
+        The (fast, slow) groups are split into workers*chunksPerWorker chunks
+
+    Returns
+    -------
+    results : Dataframe
+        The parameters of each combination with its 'sharpe', 'totalReturn',
+        'maxDrawdown' and number of 'trades', best first
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np\n
+    from concurrent.futures import ProcessPoolExecutor
+    """
+
+    combinations = parameterCombinations(grid, nRandom, seed)
+    panel = _panelArrays(data)
+    workers = workers or os.cpu_count() or 1
+
+    # Keep each (fast, slow) group in one chunk so its EMAs are only computed once
+    groups = [rows.index.to_numpy() for _, rows in
+              combinations.groupby(['fastEMA', 'slowEMA'], sort=False)]
+    nChunks = max(1, min(len(groups), workers*chunksPerWorker))
+    chunks = [np.concatenate([groups[i] for i in part])
+              for part in np.array_split(np.arange(len(groups)), nChunks) if len(part)]
+    settings = (holdPositions, periodsPerYear)
+
+    if workers == 1:
+        chunkResults = [_evaluateChunk(panel, combinations.loc[rows], settings)
+                        for rows in chunks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunkResults = profiling.poolMap(pool, _evaluateChunk, [panel]*len(chunks),
+                                             [combinations.loc[rows] for rows in chunks],
+                                             [settings]*len(chunks))
+
+    results = pd.concat(chunkResults)
+    ascending = rankBy == 'maxDrawdown'
+
+    return results.sort_values(rankBy, ascending=ascending, na_position='last') \
+        .reset_index(drop=True)
+
+
+# %% 4. Worker functions
+
+
+def _panelArrays(data):
+    """
+    Strip the ohlcv frames down to what the workers need: the high, low and
+    close arrays of each ticker and where its bars sit on the common time index
+    """
+
+    index = pd.DatetimeIndex(sorted(set().union(*[df.index for df in data.values()])))
+    tickers = []
+    for ticker, ohlcv in data.items():
+        df = ohlcv[[c for c in ohlcv.columns if c.lower() in ('high', 'low', 'close')]]
+        df.columns = map(str.lower, df.columns)
+        tickers.append((df['high'].to_numpy(dtype=float), df['low'].to_numpy(dtype=float),
+                        df['close'].to_numpy(dtype=float), index.get_indexer(df.index)))
+
+    return len(index), tickers
+
+
+def _evaluateChunk(panel, combinations, settings):
+    """
+    Portfolio statistics for a chunk of parameter combinations
+    """
+
+    nTimes, tickers = panel
+    holdPositions, periodsPerYear = settings
+    nCombinations = len(combinations)
+    params = {p: combinations[p].to_numpy() for p in PARAMETERS}
+
+    # Sum of the strategy returns over the tickers with a bar at each time
+    returnSums = np.zeros((nTimes, nCombinations))
+    tickerCounts = np.zeros(nTimes)
+    trades = np.zeros(nCombinations)
+
+    for high, low, close, rows in tickers:
+        tickerCounts[rows] += 1
+        closeSeries = pd.Series(close)
+        ohlc = pd.DataFrame({'high': high, 'low': low, 'close': close})
+
+        # Each indicator is computed once and shared by every combination using it
+        emas = {span: closeSeries.ewm(span=span, min_periods=span).mean().to_numpy()
+                for span in np.union1d(params['fastEMA'], params['slowEMA'])}
+        adxs = {period: ti.ADX(ohlc, period).to_numpy()
+                for period in np.unique(params['adxPeriod'])}
+
+        for (fast, slow), group in combinations.groupby(['fastEMA', 'slowEMA'], sort=False):
+            columns = combinations.index.get_indexer(group.index)
+            macd = emas[fast] - emas[slow]
+            macdSeries = pd.Series(macd)
+            signals = {span: macdSeries.ewm(span=span, min_periods=span).mean().to_numpy()
+                       for span in group['signalEMA'].unique()}
+
+            # All combinations for this pair as the columns of one array
+            adx = np.column_stack([adxs[p] for p in group['adxPeriod']])
+            signal = np.column_stack([signals[s] for s in group['signalEMA']])
+            positions = strategy.positionSeries(adx, macd[:, None], signal,
+                                                group['adxThreshold'].to_numpy(),
+                                                holdPositions)
+
+            held, returns = bt.strategyReturns(positions, close)
+            returnSums[np.ix_(rows, columns)] += returns
+            trades[columns] += (np.diff(held, axis=0) != 0).sum(axis=0)
+
+    with np.errstate(invalid='ignore'):
+        portfolioReturns = np.nan_to_num(returnSums/tickerCounts[:, None])
+    results = combinations.copy()
+    for name, values in performanceMetrics(portfolioReturns, periodsPerYear).items():
+        results[name] = values
+    results['trades'] = trades.astype(int)
+
+    return results
+
+
+# %% 5. Performance statistics
+
+
+def performanceMetrics(returns, periodsPerYear=252):
+    """
+    Parameters
+    ----------
+    returns : numpy array
+        Returns per bar, (time) or (time x strategy)
+    periodsPerYear : int
+        Bars per year used to annualise the Sharpe ratio
+
+    Returns
+    -------
+    metrics : dict
+        'sharpe' - annualised mean / standard deviation of the returns
+        'totalReturn' - compounded return over the whole period
+        'maxDrawdown' - largest fall from a peak of the equity curve (0 - 1)
+
+    Package requirements
+    -------
+    numpy as np
+    """
+
+    equity = np.cumprod(1 + returns, axis=0)
+    peaks = np.maximum.accumulate(np.maximum(equity, 1), axis=0)
+    deviation = returns.std(axis=0, ddof=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sharpe = np.where(deviation > 0, returns.mean(axis=0)/deviation, np.nan)
+
+    return {'sharpe': sharpe*np.sqrt(periodsPerYear),
+            'totalReturn': equity[-1] - 1,
+            'maxDrawdown': (1 - equity/peaks).max(axis=0)}
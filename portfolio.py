@@ -0,0 +1,478 @@
+# -*- coding: utf-8 -*-
+"""
+Created on %(date)s
+
+@author: Treacher
+
+Contains: portfolio accounting - positions, cash, fills, fees and mark to
+market equity for many tickers
+"""
+
+# %%% 0. Notes
+
+'''
+Keeps the books of a portfolio trading many tickers at share level, where
+backtest.py only works in returns.
+
+Everything is held as numpy arrays (struct of arrays) rather than a list of
+fill objects:
+    positions : quantity held, cash flow (what has been paid / received,
+        fees included) and fees paid, one element per ticker
+    fills : time (ns), ticker number, signed quantity (+ buy, - sell), price
+        and fee, one element per fill. The arrays are preallocated and double
+        in size when full, so recording a fill never allocates an object and
+        millions of fills cost ~40 bytes each
+    marks : time, cash, holdings value, gross exposure, traded notional and
+        fees of each mark to market (for recording equity as you go)
+
+Fills can be recorded one at a time (fill, e.g. from a live loop) or many at
+once (recordFills, e.g. the fillsFromPositions of a backtest), which is
+vectorised. The equity curve can then either be built up as you go (mark) or
+rebuilt from the fill ledger over a whole (time x ticker) price panel at once
+(revalue). Both give the same columns, from which performance works out the
+returns, Sharpe ratio, maximum drawdown, turnover and fees (see
+optimizer.performanceMetrics).
+
+Usage:
+    book = Portfolio(tickers, cash=100000, fees=commission(perShare=0.005))
+    book.recordFills(*fillsFromPositions(panel.positions, closes, qty=10))
+    curve = book.revalue(closes.index, closes)
+    performance(curve)
+'''
+
+
+# %% 1. Import libraries
+
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+
+from optimizer import performanceMetrics
+
+
+# %% 2. Fees
+
+
+def commission(rate=0.0, perShare=0.0, minimum=0.0):
+    """
+    Parameters
+    ----------
+    rate : float
+        Fraction of the traded notional paid on every fill, e.g. 0.001
+    perShare : float
+        Amount paid per share traded
+    minimum : float
+        Smallest fee charged on a fill
+
+    Returns
+    -------
+    fees : function
+        fees(quantity, price) -> fee of each fill, works on scalars and arrays
+    """
+
+    def fees(quantity, price):
+        quantity = np.abs(quantity)
+        return np.maximum(rate*quantity*np.abs(price) + perShare*quantity, minimum)
+
+    return fees
+
+
+# %% 3. Portfolio
+
+
+class Portfolio:
+    """
+    tickers : list
+        Tickers that can be traded
+    cash : float
+        Starting cash
+    fees : function
+        fees(quantity, price) -> fee of each fill (see commission), None for
+        no fees
+    capacity : int
+        Number of fills (and marks) to preallocate room for, the arrays grow
+        when it runs out
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np
+    """
+
+    def __init__(self, tickers, cash=100000.0, fees=None, capacity=2**16):
+        self.tickers = list(tickers)
+        self.columns = pd.Index(self.tickers)
+        self.startingCash = float(cash)
+        self.fees = fees
+        self.tz = None
+
+        # One element per ticker
+        nTickers = len(self.tickers)
+        self.quantity = np.zeros(nTickers)
+        self.cashFlow = np.zeros(nTickers)
+        self.feesPaid = np.zeros(nTickers)
+        self.cash = self.startingCash
+
+        # Fill ledger
+        self.nFills = 0
+        self.fillTime = np.empty(capacity, dtype=np.int64)
+        self.fillTicker = np.empty(capacity, dtype=np.int32)
+        self.fillQuantity = np.empty(capacity)
+        self.fillPrice = np.empty(capacity)
+        self.fillFee = np.empty(capacity)
+
+        # Mark to market ledger, plus what has been traded since the last mark
+        self.nMarks = 0
+        self.markTime = np.empty(capacity, dtype=np.int64)
+        self.markCash = np.empty(capacity)
+        self.markHoldings = np.empty(capacity)
+        self.markGross = np.empty(capacity)
+        self.markTraded = np.empty(capacity)
+        self.markFees = np.empty(capacity)
+        self.traded = 0.0
+        self.feesSinceMark = 0.0
+
+    # %%% Recording fills
+
+    def fill(self, time, ticker, quantity, price, fee=None):
+        """
+        Record a single fill. quantity is signed: positive buys, negative sells.
+        fee defaults to the portfolio's fee function
+        """
+
+        if self.nFills == len(self.fillTime):
+            self._growFills(self.nFills + 1)
+        j = ticker if isinstance(ticker, (int, np.integer)) else self.columns.get_loc(ticker)
+        if fee is None:
+            fee = float(self.fees(quantity, price)) if self.fees is not None else 0.0
+
+        k = self.nFills
+        self.fillTime[k] = self._nanoseconds(time)
+        self.fillTicker[k] = j
+        self.fillQuantity[k] = quantity
+        self.fillPrice[k] = price
+        self.fillFee[k] = fee
+        self.nFills += 1
+
+        notional = quantity*price
+        self.quantity[j] += quantity
+        self.cashFlow[j] -= notional + fee
+        self.feesPaid[j] += fee
+        self.cash -= notional + fee
+        self.traded += abs(notional)
+        self.feesSinceMark += fee
+
+    def recordFills(self, times, tickers, quantities, prices, fees=None):
+        """
+        Record many fills at once (arrays of the same length, see fill).
+        tickers can be names or ticker numbers
+        """
+
+        quantities = np.asarray(quantities, dtype=float)
+        prices = np.asarray(prices, dtype=float)
+        times = self._nanoseconds(times)
+        tickers = self._tickerNumbers(tickers)
+        if fees is None:
+            fees = self.fees(quantities, prices) if self.fees is not None else 0.0
+        fees = np.broadcast_to(np.asarray(fees, dtype=float), quantities.shape)
+        nNew = len(quantities)
+        if not nNew:
+            return
+
+        if self.nFills + nNew > len(self.fillTime):
+            self._growFills(self.nFills + nNew)
+        new = slice(self.nFills, self.nFills + nNew)
+        self.fillTime[new] = times
+        self.fillTicker[new] = tickers
+        self.fillQuantity[new] = quantities
+        self.fillPrice[new] = prices
+        self.fillFee[new] = fees
+        self.nFills += nNew
+
+        nTickers = len(self.tickers)
+        notional = quantities*prices
+        flows = np.bincount(tickers, notional + fees, minlength=nTickers)
+        self.quantity += np.bincount(tickers, quantities, minlength=nTickers)
+        self.cashFlow -= flows
+        self.feesPaid += np.bincount(tickers, fees, minlength=nTickers)
+        self.cash -= flows.sum()
+        self.traded += np.abs(notional).sum()
+        self.feesSinceMark += fees.sum()
+
+    def _growFills(self, needed):
+        capacity = max(needed, 2*len(self.fillTime))
+        for name in ('fillTime', 'fillTicker', 'fillQuantity', 'fillPrice', 'fillFee'):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self.nFills] = old[:self.nFills]
+            setattr(self, name, new)
+
+    # %%% Mark to market
+
+    def mark(self, time, prices):
+        """
+        Record the portfolio's value at the given prices (one per ticker, in
+        the order of self.tickers, or a Series / dict keyed by ticker)
+        """
+
+        if self.nMarks == len(self.markTime):
+            capacity = 2*len(self.markTime)
+            for name in ('markTime', 'markCash', 'markHoldings', 'markGross',
+                         'markTraded', 'markFees'):
+                old = getattr(self, name)
+                new = np.empty(capacity, dtype=old.dtype)
+                new[:self.nMarks] = old[:self.nMarks]
+                setattr(self, name, new)
+
+        values = self.quantity*self._prices(prices)
+        values[self.quantity == 0] = 0  # No price needed for tickers not held
+
+        k = self.nMarks
+        self.markTime[k] = self._nanoseconds(time)
+        self.markCash[k] = self.cash
+        self.markHoldings[k] = values.sum()
+        self.markGross[k] = np.abs(values).sum()
+        self.markTraded[k] = self.traded
+        self.markFees[k] = self.feesSinceMark
+        self.nMarks += 1
+        self.traded = 0.0
+        self.feesSinceMark = 0.0
+
+        return self.markCash[k] + self.markHoldings[k]
+
+    def marks(self):
+        """
+        Equity curve of everything recorded with mark (see revalue for the
+        columns)
+        """
+
+        n = self.nMarks
+        return self._curve(self.markTime[:n], self.markCash[:n], self.markHoldings[:n],
+                           self.markGross[:n], self.markTraded[:n], self.markFees[:n])
+
+    def revalue(self, times, prices):
+        """
+        Parameters
+        ----------
+        times : DatetimeIndex or array
+            Sorted times to value the portfolio at
+        prices : Dataframe or numpy array
+            (time x ticker) prices, columns in the order of self.tickers for
+            an array. Gaps are filled with the last price
+
+        Returns
+        -------
+        curve : Dataframe
+            Rebuilt from the fill ledger in one vectorised pass. Each fill is
+            counted from the first time at or after it (fills after the last
+            time are left out). Columns:
+            'cash', 'holdings' - market value of the positions,
+            'equity' - cash + holdings, 'grossExposure' - sum of the absolute
+            position values, 'traded' - notional traded, 'fees',
+            'turnover' - traded / equity at the previous time,
+            'return' - change in equity
+
+        Package requirements
+        -------
+        pandas as pd\n
+        numpy as np
+        """
+
+        times = self._nanoseconds(times)
+        if isinstance(prices, pd.DataFrame):
+            prices = prices.reindex(columns=self.tickers)
+        prices = pd.DataFrame(np.asarray(prices, dtype=float)).ffill().to_numpy()
+        nTimes, nTickers = prices.shape
+        n = self.nFills
+
+        # Row of the first time each fill counts at
+        rows = np.searchsorted(times, self.fillTime[:n], side='left')
+        keep = rows < nTimes
+        rows = rows[keep]
+        tickers = self.fillTicker[:n][keep]
+        quantities = self.fillQuantity[:n][keep]
+        notional = quantities*self.fillPrice[:n][keep]
+        fees = self.fillFee[:n][keep]
+
+        # Positions at each time are the running total of the fills so far
+        held = np.bincount(rows*nTickers + tickers, quantities, minlength=nTimes*nTickers)
+        held = np.cumsum(held.reshape(nTimes, nTickers), axis=0)
+        held[np.abs(held) < 1e-9] = 0  # Round off from buying and selling back
+        values = np.where(held != 0, held*prices, 0.0)
+        fees = np.bincount(rows, fees, minlength=nTimes)
+        cash = self.startingCash - np.cumsum(np.bincount(rows, notional, minlength=nTimes) + fees)
+
+        return self._curve(times, cash, values.sum(axis=1), np.abs(values).sum(axis=1),
+                           np.bincount(rows, np.abs(notional), minlength=nTimes), fees)
+
+    def _curve(self, times, cash, holdings, gross, traded, fees):
+        curve = pd.DataFrame({'cash': cash, 'holdings': holdings}, index=self._index(times))
+        curve['equity'] = cash + holdings
+        curve['grossExposure'] = gross
+        curve['traded'] = traded
+        curve['fees'] = fees
+
+        # Relative to the equity before the trades (the starting cash for the first)
+        previous = np.concatenate(([self.startingCash], curve['equity'].to_numpy()[:-1]))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            curve['turnover'] = traded/previous
+            curve['return'] = curve['equity'].to_numpy()/previous - 1
+
+        return curve
+
+    # %%% Current state
+
+    def positions(self, prices=None):
+        """
+        Dataframe of the quantity held, fees paid and cash flow of every
+        ticker, plus its market value and profit / loss if prices are given
+        """
+
+        positions = pd.DataFrame({'quantity': self.quantity, 'fees': self.feesPaid,
+                                  'cashFlow': self.cashFlow}, index=self.columns)
+        if prices is not None:
+            values = np.where(self.quantity != 0, self.quantity*self._prices(prices), 0.0)
+            positions['marketValue'] = values
+            positions['pnl'] = self.cashFlow + values
+
+        return positions
+
+    def fills(self):
+        """
+        Dataframe of the fill ledger
+        """
+
+        n = self.nFills
+        return pd.DataFrame({'time': self._index(self.fillTime[:n]),
+                             'ticker': self.columns.take(self.fillTicker[:n]),
+                             'quantity': self.fillQuantity[:n],
+                             'price': self.fillPrice[:n],
+                             'fee': self.fillFee[:n]})
+
+    # %%% Conversions
+
+    def _nanoseconds(self, times):
+        """
+        Times as int64 nanoseconds since the epoch (UTC for tz aware times)
+        """
+
+        if isinstance(times, (int, np.integer)):
+            return int(times)
+        if isinstance(times, (pd.Timestamp, str)) or np.ndim(times) == 0:
+            time = pd.Timestamp(times)
+            if self.tz is None and time.tz is not None:
+                self.tz = time.tz
+            return time.value
+
+        times = pd.DatetimeIndex(times)
+        if self.tz is None and times.tz is not None:
+            self.tz = times.tz
+
+        return times.as_unit('ns').asi8
+
+    def _index(self, nanoseconds):
+        index = pd.DatetimeIndex(nanoseconds.astype('datetime64[ns]'))
+        return index.tz_localize('UTC').tz_convert(self.tz) if self.tz is not None else index
+
+    def _tickerNumbers(self, tickers):
+        tickers = np.asarray(tickers)
+        if tickers.dtype.kind in 'iu':
+            return tickers.astype(np.intp)
+        numbers = self.columns.get_indexer(tickers)
+        if (numbers < 0).any():
+            raise KeyError('Unknown tickers: {}'.format(sorted(set(tickers[numbers < 0]))))
+
+        return numbers
+
+    def _prices(self, prices):
+        if isinstance(prices, dict):
+            prices = pd.Series(prices, dtype=float)
+        if isinstance(prices, pd.Series):
+            prices = prices.reindex(self.tickers)
+
+        return np.asarray(prices, dtype=float)
+
+
+# %% 4. Fills from a backtest
+
+Fills = namedtuple('Fills', ['times', 'tickers', 'quantities', 'prices'])
+
+
+def fillsFromPositions(held, prices, qty=1):
+    """
+    Parameters
+    ----------
+    held : Dataframe
+        Position held over each bar (time x ticker, 1 long, 0 flat, -1 short),
+        e.g. backtest.panelBacktest(...).positions
+    prices : Dataframe
+        Close prices on the same (time x ticker) grid. Where a ticker has no
+        bar its last price is used, so a position changing across a gap is
+        still filled at a price
+    qty : float
+        Shares per position
+
+    Returns
+    -------
+    Fills : namedtuple
+        The fills that move between the positions, ready for
+        Portfolio.recordFills(*fills). The position held over bar i is traded
+        at the close of bar i-1 (as in backtest.py), so the first bar should
+        be flat
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np
+    """
+
+    prices = prices.reindex(index=held.index, columns=held.columns).ffill() \
+        .to_numpy(dtype=float)
+    changes = np.diff(held.to_numpy(dtype=float), axis=0)
+    rows, columns = np.nonzero(changes)
+    unpriced = np.isnan(prices[rows, columns])
+    if unpriced.any():
+        raise ValueError('No price to fill at for {} before their first bar'
+                         .format(sorted(set(held.columns.take(columns[unpriced])))))
+
+    return Fills(held.index[rows], held.columns.take(columns),
+                 changes[rows, columns]*qty, prices[rows, columns])
+
+
+# %% 5. Performance
+
+
+def performance(curve, periodsPerYear=252):
+    """
+    Parameters
+    ----------
+    curve : Dataframe
+        Output of Portfolio.revalue or Portfolio.marks
+    periodsPerYear : int
+        Rows per year, used to annualise the Sharpe ratio and turnover
+
+    Returns
+    -------
+    metrics : dict
+        'sharpe', 'totalReturn', 'maxDrawdown' (see
+        optimizer.performanceMetrics), 'turnover' - annualised traded
+        notional / equity, 'fees' - total fees paid. Raises ValueError if the
+        equity is ever nan or 0 (e.g. a fill without a price), since the
+        returns after it are then meaningless
+
+    Package requirements
+    -------
+    numpy as np
+    """
+
+    returns = curve['return'].to_numpy(dtype=float)
+    invalid = ~np.isfinite(returns)
+    if invalid.any():
+        raise ValueError('Equity is nan or 0 from {}, the returns can\'t be measured'
+                         .format(curve.index[np.argmax(invalid)]))
+    metrics = {name: float(value) for name, value in
+               performanceMetrics(returns, periodsPerYear).items()}
+    metrics['turnover'] = float(np.nanmean(curve['turnover'].to_numpy())*periodsPerYear)
+    metrics['fees'] = float(curve['fees'].sum())
+
+    return metrics
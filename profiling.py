@@ -0,0 +1,502 @@
+# -*- coding: utf-8 -*-
+"""
+Created on %(date)s
+
+@author: Treacher
+
+Contains: per stage timing of the trading pipeline - timers, histograms,
+counters and their export
+"""
+
+# %%% 0. Notes
+
+'''
+Shows where the time goes when a backtest or a live bar runs long: data fetch,
+the indicators, the strategy or order submission.
+
+Stages are timed with
+    with profiling.stage('live.orders'):    # around a block of code
+        ...
+    @profiling.timed('indicator.MACD')      # around every call of a function
+and anything else can be counted with profiling.count('live.orders', n). The
+indicator functions, the strategy, the backtests, the data loader and the live
+trader are already instrumented.
+
+Profiling is off unless enable() is called (or the TRADING_PROFILE environment
+variable is set to 1), and when off a stage is a shared do nothing context
+manager and a timed function makes one extra call, so the instrumentation can
+stay in the code.
+
+Worker processes have a profile of their own, so the process pools (the panel
+backtest, optimizer, walk forward and sharedData) map through poolMap, which
+sends what each task recorded back to be merged into the parent's profile.
+Worker stages then show the time summed over all the processes, so with
+several workers their share of the wall time can be well over 100 %.
+
+Each stage keeps a histogram of its timings in log spaced buckets (20 per
+decade from 100 ns, so percentiles are good to about 12 %) plus the count,
+total, min and max, which is enough for the p50 / p99 without storing every
+timing. report() prints them as a table, save() writes them to json or to the
+Prometheus text format (.prom, for the node exporter's textfile collector).
+
+Command line:
+    python profiling.py backtest [--tickers 30 --bars 2000 | --cache-dir DIR]
+    python profiling.py live [--tickers 10 --bars 500]
+    python profiling.py show profile.json
+runs a backtest or a simulated live session (SimulatedMarket) with profiling
+on and prints the per stage breakdown (--output saves it).
+'''
+
+
+# %% 1. Import libraries
+
+import argparse
+import functools
+import inspect
+import itertools
+import json
+import math
+import os
+import threading
+import time
+
+# Everything else is imported by the command line functions, so this module can
+# be imported by the ones it instruments
+
+
+# %% 2. Recording
+
+BUCKETS_PER_DECADE = 20
+MIN_SECONDS = 1e-7
+N_BUCKETS = 10*BUCKETS_PER_DECADE + 1  # Up to 1000 s, the last bucket takes the rest
+
+_enabled = os.environ.get('TRADING_PROFILE', '') not in ('', '0')
+_histograms = {}
+_counters = {}
+_lock = threading.Lock()
+_started = time.perf_counter()
+
+
+class _Histogram:
+    __slots__ = ('counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.counts = [0]*N_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+
+def enable(on=True):
+    """
+    Turn profiling on (or off with enable(False))
+    """
+
+    global _enabled
+    _enabled = bool(on)
+
+
+def enabled():
+    return _enabled
+
+
+def reset():
+    """
+    Forget everything recorded so far
+    """
+
+    global _started
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
+        _started = time.perf_counter()
+
+
+def record(name, seconds):
+    """
+    Add a timing (s) to a stage's histogram
+    """
+
+    if not _enabled:
+        return
+    bucket = 0 if seconds <= MIN_SECONDS else \
+        min(int(math.log10(seconds/MIN_SECONDS)*BUCKETS_PER_DECADE) + 1, N_BUCKETS - 1)
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = _Histogram()
+        histogram.counts[bucket] += 1
+        histogram.count += 1
+        histogram.total += seconds
+        histogram.min = min(histogram.min, seconds)
+        histogram.max = max(histogram.max, seconds)
+
+
+def count(name, n=1):
+    """
+    Add n to a counter
+    """
+
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+class _Timer:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def stage(name):
+    """
+    Context manager timing the code inside it as the stage name
+    """
+
+    return _Timer(name) if _enabled else _NULL_TIMER
+
+
+def timed(name=None):
+    """
+    Decorator timing every call of a function (or coroutine function) as the
+    stage name, which defaults to the function's qualified name
+    """
+
+    def decorator(function):
+        label = name or function.__qualname__
+
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def wrapper(*args, **kwargs):
+                if not _enabled:
+                    return await function(*args, **kwargs)
+                tic = time.perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    record(label, time.perf_counter() - tic)
+        else:
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not _enabled:
+                    return function(*args, **kwargs)
+                tic = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    record(label, time.perf_counter() - tic)
+
+        return wrapper
+
+    return decorator
+
+
+def merge(data):
+    """
+    Add a snapshot() (e.g. from a worker process) to what's recorded here
+    """
+
+    with _lock:
+        for name, stats in data['stages'].items():
+            histogram = _histograms.get(name)
+            if histogram is None:
+                histogram = _histograms[name] = _Histogram()
+            histogram.counts = [a + b for a, b in zip(histogram.counts, stats['counts'])]
+            histogram.count += stats['count']
+            histogram.total += stats['total']
+            histogram.min = min(histogram.min, stats['min'])
+            histogram.max = max(histogram.max, stats['max'])
+        for name, n in data['counters'].items():
+            _counters[name] = _counters.get(name, 0) + n
+
+
+def poolMap(pool, function, *iterables):
+    """
+    list(pool.map(function, *iterables)) for a process pool. With profiling on,
+    each task records into a fresh profile in its worker and what it recorded
+    is merged into this process's profile
+    """
+
+    if not _enabled:
+        return list(pool.map(function, *iterables))
+
+    results = []
+    for result, data in pool.map(_profiledCall, itertools.repeat(function), *iterables):
+        merge(data)
+        results.append(result)
+
+    return results
+
+
+def _profiledCall(function, *args):
+    """
+    Worker side of poolMap: (function(*args), what it recorded)
+    """
+
+    enable()
+    reset()
+    result = function(*args)
+
+    return result, snapshot()
+
+
+# %% 3. Reporting
+
+
+def _upperEdge(bucket):
+    return MIN_SECONDS*10**(bucket/BUCKETS_PER_DECADE)
+
+
+def snapshot():
+    """
+    Everything recorded so far as a plain (json ready) dict
+    """
+
+    with _lock:
+        return {'elapsed': time.perf_counter() - _started,
+                'stages': {name: {'counts': list(h.counts), 'count': h.count,
+                                  'total': h.total, 'min': h.min, 'max': h.max}
+                           for name, h in _histograms.items()},
+                'counters': dict(_counters)}
+
+
+def percentile(stats, q):
+    """
+    Approximate q th percentile (0 - 100) of a stage from its histogram
+    """
+
+    if not stats['count']:
+        return math.nan
+    rank = q/100*stats['count']
+    cumulative = 0
+    for bucket, n in enumerate(stats['counts']):
+        cumulative += n
+        if cumulative >= rank and n:
+            return min(max(_upperEdge(bucket), stats['min']), stats['max'])
+
+    return stats['max']
+
+
+def report(data=None):
+    """
+    Parameters
+    ----------
+    data : dict
+        snapshot() (or load()) output, defaults to what's recorded now
+
+    Returns
+    -------
+    report : Dataframe
+        One row per stage, slowest total first: 'count', 'total', 'mean',
+        'p50', 'p99' and 'max' (s) and 'share' - total / wall time since
+        profiling was reset. Stages can be nested, so the shares can add up to
+        more than 1. Counters are in report.attrs['counters']
+
+    Package requirements
+    -------
+    pandas as pd
+    """
+
+    import pandas as pd
+
+    data = data or snapshot()
+    rows = {name: {'count': s['count'], 'total': s['total'],
+                   'mean': s['total']/s['count'] if s['count'] else math.nan,
+                   'p50': percentile(s, 50), 'p99': percentile(s, 99), 'max': s['max'],
+                   'share': s['total']/data['elapsed'] if data['elapsed'] else math.nan}
+            for name, s in data['stages'].items()}
+    table = pd.DataFrame.from_dict(rows, orient='index',
+                                   columns=['count', 'total', 'mean', 'p50', 'p99', 'max',
+                                            'share'])
+    table = table.sort_values('total', ascending=False)
+    table.index.name = 'stage'
+    table.attrs['counters'] = dict(data['counters'])
+
+    return table
+
+
+# Exported buckets: 4 per decade from 1 us to 100 s
+PROMETHEUS_BUCKETS = range(BUCKETS_PER_DECADE, 9*BUCKETS_PER_DECADE + 1, BUCKETS_PER_DECADE//4)
+
+
+def toPrometheus(data=None, prefix='trading'):
+    """
+    Stage histograms and counters in the Prometheus text exposition format
+    """
+
+    data = data or snapshot()
+    lines = ['# HELP {}_stage_seconds Time spent in each stage of the pipeline'.format(prefix),
+             '# TYPE {}_stage_seconds histogram'.format(prefix)]
+    for name, s in sorted(data['stages'].items()):
+        label = 'stage="{}"'.format(name)
+        cumulative = 0
+        for bucket, n in enumerate(s['counts']):
+            cumulative += n
+            if bucket in PROMETHEUS_BUCKETS:
+                lines.append('{}_stage_seconds_bucket{{{},le="{:.6g}"}} {}'.format(
+                    prefix, label, _upperEdge(bucket), cumulative))
+        lines.append('{}_stage_seconds_bucket{{{},le="+Inf"}} {}'.format(prefix, label, s['count']))
+        lines.append('{}_stage_seconds_sum{{{}}} {!r}'.format(prefix, label, s['total']))
+        lines.append('{}_stage_seconds_count{{{}}} {}'.format(prefix, label, s['count']))
+
+    lines += ['# HELP {}_events_total Events counted by the pipeline'.format(prefix),
+              '# TYPE {}_events_total counter'.format(prefix)]
+    for name, value in sorted(data['counters'].items()):
+        lines.append('{}_events_total{{name="{}"}} {}'.format(prefix, name, value))
+
+    return '\n'.join(lines) + '\n'
+
+
+def save(path, data=None):
+    """
+    Write the profile to a json file, or Prometheus text if path ends .prom
+    """
+
+    data = data or snapshot()
+    with open(path, 'w') as file:
+        if path.endswith('.prom'):
+            file.write(toPrometheus(data))
+        else:
+            json.dump(data, file, indent=1)
+
+
+def load(path):
+    """
+    Profile saved to json with save, for report
+    """
+
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def printReport(data=None):
+    table = report(data)
+    print(table.to_string(formatters={c: '{:.6f}'.format for c in
+                                      ['total', 'mean', 'p50', 'p99', 'max']} |
+                          {'share': '{:.1%}'.format}))
+    for name, value in sorted(table.attrs['counters'].items()):
+        print('{}: {}'.format(name, value))
+
+
+# %% 4. Profiled runs
+
+
+def _syntheticData(nTickers, nBars):
+    from benchmarkIndicators import syntheticOHLCV
+
+    return {'T{}'.format(i): syntheticOHLCV(nBars, seed=i) for i in range(nTickers)}
+
+
+def _cachedData(cacheDir, timeframe, tickers=None):
+    from ohlcvCache import OHLCVCache
+
+    cache = OHLCVCache(cacheDir)
+    tickers = tickers or sorted(os.listdir(os.path.join(cacheDir, timeframe)))
+    data = {ticker: cache.read(ticker, timeframe) for ticker in tickers}
+
+    return {ticker: df for ticker, df in data.items() if df is not None and len(df)}
+
+
+def profileBacktest(data, adxThreshold=25):
+    """
+    Indicators, per ticker backtests and the panel backtest of the data with
+    profiling on. Returns the report
+    """
+
+    import backtest as bt
+    import technicalIndicators as ti
+
+    enable()
+    reset()
+    with stage('pipeline.indicators'):
+        for ticker, df in data.items():
+            df = data[ticker] = df.copy()
+            df[['signal', 'macd']] = ti.MACD(df, 12, 26, 9)
+            df['ADX'] = ti.ADX(df, 14)
+    with stage('pipeline.backtest'):
+        bt.backtestUniverse(data, adxThreshold)
+    with stage('pipeline.panelBacktest'):
+        bt.panelBacktest(data, adxThreshold=adxThreshold, workers=1)
+
+    return report()
+
+
+def profileLive(data, warmupBars=100, qty=1):
+    """
+    A LiveTrader session over the data replayed by a SimulatedMarket (as fast
+    as possible) with profiling on, the first warmupBars of each ticker
+    warming up the indicators. Returns the report
+    """
+
+    import asyncio
+    from liveTrading import LiveTrader
+    from simulatedMarket import SimulatedMarket
+
+    history = {ticker: df.iloc[:warmupBars] for ticker, df in data.items()}
+    market = SimulatedMarket(data)
+    trader = LiveTrader(list(data), market, market, history, qty=qty, verbose=False)
+
+    enable()
+    reset()
+    asyncio.run(trader.run())
+
+    return report()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Per stage timings of a backtest or a '
+                                                 'simulated live session')
+    parser.add_argument('mode', choices=['backtest', 'live', 'show'])
+    parser.add_argument('path', nargs='?', default=None, help='profile to show')
+    parser.add_argument('--tickers', type=int, default=None,
+                        help='number of synthetic tickers (30 for backtest, 10 for live)')
+    parser.add_argument('--bars', type=int, default=None,
+                        help='bars per synthetic ticker (2000 for backtest, 500 for live)')
+    parser.add_argument('--cache-dir', default=None,
+                        help='use the tickers in this ohlcv cache instead of synthetic data')
+    parser.add_argument('--timeframe', default='1day')
+    parser.add_argument('--output', default=None,
+                        help='save the profile (.json, or .prom for Prometheus text)')
+    args = parser.parse_args()
+
+    # The instrumented modules record to the imported module, not this script
+    import profiling
+
+    if args.mode == 'show':
+        profiling.printReport(profiling.load(args.path))
+    else:
+        live = args.mode == 'live'
+        if args.cache_dir:
+            data = profiling._cachedData(args.cache_dir, args.timeframe)
+        else:
+            data = profiling._syntheticData(args.tickers or (10 if live else 30),
+                                            args.bars or (500 if live else 2000))
+        profiling.profileLive(data) if live else profiling.profileBacktest(data)
+        profiling.printReport()
+        if args.output:
+            profiling.save(args.output)
+            print('Saved to {}'.format(args.output))
@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+"""
+Created on %(date)s
+
+@author: Treacher
+
+Contains: resampling of minute bars to higher timeframes and the indicators
+of several timeframes lined up for the strategy
+"""
+
+# %%% 0. Notes
+
+'''
+Minute bars are pulled once and the 5 minute, 15 minute, hourly and daily bars
+are worked out from them locally.
+
+Bars are grouped by the wall clock time of the exchange (e.g. New York), so
+hours and days start where you'd expect whatever the time of year. Each
+timeframe is one vectorised pass over the minute bars: the bars of a group sit
+next to each other, so the open / close are the first / last of each run and
+the high, low and volume are np.maximum / np.minimum / np.add.reduceat over the
+runs. Higher timeframe bars are labelled with the time they start, like the
+api's.
+
+Resampler does the same thing incrementally for a live feed. It keeps the bars
+of every timeframe built so far, with the latest one still open, and each
+batch of new minute bars is only merged into the end - the history is never
+resampled again.
+
+Lining the timeframes up: a higher timeframe bar is complete once a minute bar
+closes at or after its end, and only complete bars are used, so there is no
+look ahead. The daily bar is therefore seen from the first bar of the next
+day, and the hourly bar of 9:00 - 10:00 from the 9:59 minute bar (which closes
+at 10:00). multiTimeframeIndicators does this for a whole history at once and
+MultiTimeframeState bar by bar, feeding each completed bar to the streaming
+indicator states of technicalIndicators.py.
+'''
+
+
+# %% 1. Import libraries
+
+import itertools
+import numpy as np
+import pandas as pd
+
+import technicalIndicators as ti
+
+
+# %% 2. Timeframes
+
+TIMESPANS = {'minute': pd.Timedelta(minutes=1), 'hour': pd.Timedelta(hours=1),
+             'day': pd.Timedelta(days=1)}
+
+TIMEFRAMES = ['5minute', '15minute', '1hour', '1day']
+
+COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+
+
+def barLength(timeframe):
+    """
+    Length of a bar in nanoseconds, e.g. barLength('15minute')
+    """
+
+    multiplier = int(''.join(itertools.takewhile(str.isdigit, timeframe)) or 1)
+    timespan = timeframe.lstrip('0123456789')
+
+    return multiplier*TIMESPANS[timespan].value
+
+
+def _wallClock(index):
+    """
+    (utc, wall clock) epoch nanoseconds of a datetime index
+    """
+
+    index = pd.DatetimeIndex(index).as_unit('ns')
+    if index.tz is None:
+        return index.asi8, index.asi8
+
+    return index.asi8, index.tz_localize(None).asi8
+
+
+def _index(utc, tz):
+    index = pd.DatetimeIndex(utc.view('datetime64[ns]'))
+
+    return index if tz is None else index.tz_localize('UTC').tz_convert(tz)
+
+
+def _columns(bars):
+    columns = {c.lower(): c for c in bars.columns}
+
+    return [bars[columns[c]].to_numpy(dtype=float) for c in COLUMNS]
+
+
+# %% 3. Vectorised resampling
+
+
+def _aggregate(keys, utc, wall, open, high, low, close, volume):
+    """
+    Aggregate sorted bars over runs of equal keys. Returns the key, utc label,
+    open, high, low, close and volume of each run
+    """
+
+    if len(keys) == 1:
+        return keys, utc - (wall - keys), open, high, low, close, volume  # Live, bar by bar
+
+    starts = np.flatnonzero(np.diff(keys, prepend=keys[0] - 1)) if len(keys) else \
+        np.empty(0, dtype=np.intp)
+    ends = np.append(starts[1:], len(keys)) - 1
+
+    # Label in utc: the first bar's time less how far it is into its bar
+    labels = utc[starts] - (wall[starts] - keys[starts])
+    if not len(starts):
+        empty = np.empty(0)
+        return keys[starts], labels, empty, empty, empty, empty, empty
+
+    return (keys[starts], labels, open[starts], np.maximum.reduceat(high, starts),
+            np.minimum.reduceat(low, starts), close[ends], np.add.reduceat(volume, starts))
+
+
+def resampleOHLCV(bars, timeframe):
+    """
+    Parameters
+    ----------
+    bars : Dataframe
+        ohlcv bars (e.g. 1 minute) in time order
+    timeframe : str
+        Bar size to make, e.g. '5minute', '1hour' or '1day'
+
+    Returns
+    -------
+    resampled : Dataframe
+        ohlcv bars of the new size, labelled with the time they start (in
+        the timezone of bars). Only bars with some data are returned
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np
+    """
+
+    length = barLength(timeframe)
+    utc, wall = _wallClock(bars.index)
+    keys, labels, *values = _aggregate(wall - wall % length, utc, wall, *_columns(bars))
+    resampled = pd.DataFrame(dict(zip(COLUMNS, values)), index=_index(labels, bars.index.tz))
+    resampled.index.name = bars.index.name
+
+    return resampled
+
+
+# %% 4. Incremental resampling
+
+
+class Resampler:
+    """
+    Builds the bars of several timeframes from a stream of minute bars
+
+    timeframes : list
+        Bar sizes to make, e.g. ['5minute', '1hour', '1day']
+    baseTimeframe : str
+        Size of the bars fed in, used to tell when a bar is complete
+
+    update(bars) merges new bars (after any already seen) and returns the
+    bars of each timeframe that they completed
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np
+    """
+
+    def __init__(self, timeframes=TIMEFRAMES, baseTimeframe='1minute', capacity=1024):
+        self.timeframes = list(timeframes)
+        self.lengths = {timeframe: barLength(timeframe) for timeframe in self.timeframes}
+        self.baseLength = barLength(baseTimeframe)
+        self.tz = None
+        self.lastWall = None
+
+        # Per timeframe: bars built so far (the last one may still be open)
+        # and how many of them are complete
+        self.n = dict.fromkeys(self.timeframes, 0)
+        self.nComplete = dict.fromkeys(self.timeframes, 0)
+        self.keys = {t: np.empty(capacity, dtype=np.int64) for t in self.timeframes}
+        self.labels = {t: np.empty(capacity, dtype=np.int64) for t in self.timeframes}
+        self.values = {t: np.empty((capacity, len(COLUMNS))) for t in self.timeframes}
+
+    def update(self, bars):
+        """
+        Parameters
+        ----------
+        bars : Dataframe
+            New ohlcv bars in time order, all after the ones already seen
+
+        Returns
+        -------
+        completed : dict
+            Timeframe -> dataframe of the bars that are now complete and
+            weren't before (often empty)
+        """
+
+        return {timeframe: self._frame(timeframe, first, last)
+                for timeframe, (first, last) in self.merge(bars).items()}
+
+    def merge(self, bars):
+        """
+        update without building the dataframes: returns timeframe -> (first,
+        last) rows of self.values[timeframe] that have just been completed
+        """
+
+        if not len(bars):
+            return {timeframe: (self.nComplete[timeframe],)*2 for timeframe in self.timeframes}
+        if self.tz is None:
+            self.tz = bars.index.tz
+        utc, wall = _wallClock(bars.index)
+        columns = _columns(bars)
+        self.lastWall = wall[-1]
+
+        completed = {}
+        for timeframe, length in self.lengths.items():
+            keys, labels, *values = _aggregate(wall - wall % length, utc, wall, *columns)
+            values = np.column_stack(values)
+            n = self.n[timeframe]
+
+            # The first new bar may carry on the open one
+            if n and keys[0] == self.keys[timeframe][n - 1]:
+                last = self.values[timeframe][n - 1]
+                last[1] = max(last[1], values[0, 1])
+                last[2] = min(last[2], values[0, 2])
+                last[3] = values[0, 3]
+                last[4] += values[0, 4]
+                keys, labels, values = keys[1:], labels[1:], values[1:]
+
+            self._append(timeframe, keys, labels, values)
+
+            # Complete once a bar has closed at or after the end of the bar (only
+            # the bars not already complete need checking)
+            first = self.nComplete[timeframe]
+            ends = self.keys[timeframe][first:self.n[timeframe]] + length
+            self.nComplete[timeframe] = first + int(np.searchsorted(
+                ends, self.lastWall + self.baseLength, side='right'))
+            completed[timeframe] = (first, self.nComplete[timeframe])
+
+        return completed
+
+    def _append(self, timeframe, keys, labels, values):
+        n = self.n[timeframe]
+        needed = n + len(keys)
+        if needed > len(self.keys[timeframe]):
+            capacity = max(needed, 2*len(self.keys[timeframe]))
+            for store in (self.keys, self.labels, self.values):
+                old = store[timeframe]
+                store[timeframe] = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+                store[timeframe][:n] = old[:n]
+        self.keys[timeframe][n:needed] = keys
+        self.labels[timeframe][n:needed] = labels
+        self.values[timeframe][n:needed] = values
+        self.n[timeframe] = needed
+
+    def _frame(self, timeframe, first, last):
+        df = pd.DataFrame(self.values[timeframe][first:last].copy(), columns=COLUMNS,
+                          index=_index(self.labels[timeframe][first:last], self.tz))
+        df.index.name = 'timestamp'
+
+        return df
+
+    def bars(self, timeframe, includeOpen=True):
+        """
+        All the bars of a timeframe so far, with or without the one still open
+        """
+
+        last = self.n[timeframe] if includeOpen else self.nComplete[timeframe]
+
+        return self._frame(timeframe, 0, last)
+
+
+# %% 5. Multi timeframe indicators
+
+
+def strategyIndicators(ohlcv):
+    """
+    The indicators trade_signal uses: 'signal', 'macd' and 'ADX'
+    """
+
+    indicators = pd.DataFrame(index=ohlcv.index)
+    indicators[['signal', 'macd']] = ti.MACD(ohlcv, 12, 26, 9)
+    indicators['ADX'] = ti.ADX(ohlcv, 14)
+
+    return indicators
+
+
+def multiTimeframeIndicators(bars, timeframes=TIMEFRAMES, indicators=strategyIndicators,
+                             baseTimeframe='1minute'):
+    """
+    Parameters
+    ----------
+    bars : Dataframe
+        ohlcv bars of the base timeframe (e.g. 1 minute)
+    timeframes : list
+        Bar sizes to compute the indicators on
+    indicators : function
+        indicators(ohlcv) -> dataframe of indicator columns, on any timeframe
+    baseTimeframe : str
+        Size of the bars
+
+    Returns
+    -------
+    aligned : Dataframe
+        On the index of bars, a '<column>_<timeframe>' column for each
+        indicator and timeframe holding its value on the latest complete bar
+        of that timeframe at the close of each base bar (nan before there is
+        one)
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np
+    """
+
+    utc, wall = _wallClock(bars.index)
+    closes = wall + barLength(baseTimeframe)
+    aligned = pd.DataFrame(index=bars.index)
+    for timeframe in timeframes:
+        length = barLength(timeframe)
+        higher = resampleOHLCV(bars, timeframe)
+        values = indicators(higher)
+
+        # Latest higher bar that has ended by the close of each base bar
+        _, higherWall = _wallClock(higher.index)
+        higherKeys = higherWall - higherWall % length
+        rows = np.searchsorted(higherKeys + length, closes, side='right') - 1
+        for column in values.columns:
+            columnValues = np.append(values[column].to_numpy(dtype=float), np.nan)
+            aligned['{}_{}'.format(column, timeframe)] = columnValues[rows]
+
+    return aligned
+
+
+class MultiTimeframeState:
+    """
+    Streaming version of multiTimeframeIndicators with the strategy
+    indicators (MACD 12, 26, 9 and ADX 14) on every timeframe
+
+    update(bars) takes new base bars and returns the latest values as a dict
+    '<column>_<timeframe>' -> value, the same as the last row of
+    multiTimeframeIndicators
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np
+    """
+
+    def __init__(self, timeframes=TIMEFRAMES, baseTimeframe='1minute'):
+        self.resampler = Resampler(timeframes, baseTimeframe)
+        self.macd = {timeframe: ti.MACDState(12, 26, 9) for timeframe in timeframes}
+        self.adx = {timeframe: ti.ADXState(14) for timeframe in timeframes}
+        self.latest = {}
+        for timeframe in timeframes:
+            for column in ('signal', 'macd', 'ADX'):
+                self.latest['{}_{}'.format(column, timeframe)] = np.nan
+
+    def update(self, bars):
+        for timeframe, (first, last) in self.resampler.merge(bars).items():
+            macdState, adxState = self.macd[timeframe], self.adx[timeframe]
+            for _, high, low, close, _ in self.resampler.values[timeframe][first:last].tolist():
+                signal, macd = macdState.update(close)
+                adx = adxState.update(high, low, close)
+            if last > first:
+                self.latest['signal_' + timeframe] = signal
+                self.latest['macd_' + timeframe] = macd
+                self.latest['ADX_' + timeframe] = adx
+
+        return self.latest
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+Created on %(date)s
+
+@author: Treacher
+
+Contains: ohlcv store in shared memory for handing the ticker universe to
+worker processes without copying it
+"""
+
+# %%% 0. Notes
+
+'''
+Sending data[ticker] dataframes to a pool of worker processes pickles them,
+so every task pays for copying its share of the dataset (and a worker that
+needs all of it pays for all of it).
+
+SharedOHLCV loads the universe once into a single multiprocessing.shared_memory
+block, laid out as columns:
+    timestamp (epoch ns, int64), open, high, low, close, volume (float64)
+with the bars of every ticker one after another in each column, and an
+offsets array giving where each ticker's bars start and end. A ticker's bars
+are therefore a contiguous slice of each column, handed out as read only numpy
+views of the shared block - nothing is copied.
+
+Pickling a SharedOHLCV (e.g. passing it to a ProcessPoolExecutor task) only
+sends the name of the block and the ticker offsets, and the worker attaches to
+the block when it's unpickled, so the cost of starting a task doesn't depend on
+how much data there is.
+
+It behaves as a read only dict of ticker -> ohlcv dataframe, so it can be used
+wherever data is (backtest.panelBacktest sends the store to its workers rather
+than the arrays).
+
+The process that creates the store owns the block and frees it when the store
+is closed (or at the end of a with block). Workers only detach.
+
+Usage:
+    with SharedOHLCV(data) as store:
+        results = mapTickers(myFunction, store, workers=8)
+'''
+
+
+# %% 1. Import libraries
+
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import os
+import numpy as np
+import pandas as pd
+
+import profiling
+
+
+# %% 2. Shared store
+
+COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+
+
+class SharedOHLCV(Mapping):
+    """
+    data : dict
+        Ticker -> ohlcv dataframe to copy into shared memory (once)
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np\n
+    from multiprocessing import shared_memory
+    """
+
+    def __init__(self, data):
+        tickers = list(data)
+        lengths = [len(data[ticker]) for ticker in tickers]
+        offsets = np.concatenate(([0], np.cumsum(lengths, dtype=np.int64)))
+        nBars = int(offsets[-1])
+        indexes = [pd.DatetimeIndex(data[ticker].index) for ticker in tickers]
+        tz = next((str(index.tz) for index in indexes if index.tz is not None), None)
+
+        block = shared_memory.SharedMemory(create=True, size=max(1, 8*nBars*(1 + len(COLUMNS))))
+        self._setup(block, tickers, offsets, tz, owner=True)
+
+        # The only copy: each ticker's columns into its slice of the block
+        try:
+            for ticker, index, first, last in zip(tickers, indexes, offsets[:-1], offsets[1:]):
+                columns = {c.lower(): c for c in data[ticker].columns}
+                self.timestamp.base[first:last] = index.as_unit('ns').asi8
+                for c in COLUMNS:
+                    self.columns[c].base[first:last] = data[ticker][columns[c]].to_numpy(dtype=float)
+        except BaseException:
+            self.close()  # Don't leave the block behind
+            raise
+
+    @classmethod
+    def fromCache(cls, cache, tickers, timeframe='1day', startDate=None, endDate=None):
+        """
+        Load the bars held in an ohlcvCache.OHLCVCache
+        """
+
+        data = {}
+        for ticker in tickers:
+            df = cache.read(ticker, timeframe, startDate, endDate)
+            if df is not None and len(df):
+                data[ticker] = df
+
+        return cls(data)
+
+    @classmethod
+    def _attach(cls, name, tickers, offsets, tz):
+        store = cls.__new__(cls)
+        store._setup(shared_memory.SharedMemory(name=name), tickers, offsets, tz, owner=False)
+
+        return store
+
+    def _setup(self, block, tickers, offsets, tz, owner):
+        self.block = block
+        self.owner = owner
+        self.tickers = tickers
+        self.offsets = offsets
+        self.rows = {ticker: j for j, ticker in enumerate(tickers)}
+        self.tz = tz
+
+        # Read only column views of the block (writable ones kept as .base for loading)
+        nBars = int(offsets[-1])
+        self.timestamp = _readOnly(np.ndarray(nBars, np.int64, block.buf, 0))
+        self.columns = {c: _readOnly(np.ndarray(nBars, np.float64, block.buf, 8*nBars*(k + 1)))
+                        for k, c in enumerate(COLUMNS)}
+
+    def __reduce__(self):
+        # Only the name and layout are pickled - the worker attaches to the block
+        return (SharedOHLCV._attach, (self.block.name, self.tickers, self.offsets, self.tz))
+
+    # %%% Access
+
+    def arrays(self, ticker):
+        """
+        Zero copy (read only) views of a ticker's bars, as a dict with a
+        'timestamp' entry (epoch ns) plus the ohlcv columns
+        """
+
+        j = self.rows[ticker]
+        bars = slice(self.offsets[j], self.offsets[j + 1])
+        arrays = {c: values[bars] for c, values in self.columns.items()}
+        arrays['timestamp'] = self.timestamp[bars]
+
+        return arrays
+
+    def index(self, ticker):
+        nanoseconds = self.arrays(ticker)['timestamp']
+        if self.tz is None:
+            return pd.DatetimeIndex(nanoseconds.view('datetime64[ns]'))
+
+        return pd.DatetimeIndex(nanoseconds.view('datetime64[ns]')).tz_localize('UTC') \
+            .tz_convert(self.tz)
+
+    def ohlcArrays(self, ticker):
+        """
+        (index, high, low, close) of a ticker, as backtest._ohlcArrays
+        """
+
+        arrays = self.arrays(ticker)
+
+        return self.index(ticker), arrays['high'], arrays['low'], arrays['close']
+
+    def __getitem__(self, ticker):
+        """
+        ohlcv dataframe of a ticker, built on the shared arrays
+        """
+
+        arrays = self.arrays(ticker)
+        df = pd.DataFrame({c: arrays[c] for c in COLUMNS}, index=self.index(ticker), copy=False)
+        df.index.name = 'timestamp'
+
+        return df
+
+    def __iter__(self):
+        return iter(self.tickers)
+
+    def __len__(self):
+        return len(self.tickers)
+
+    @property
+    def nbytes(self):
+        return self.block.size
+
+    # %%% Clean up
+
+    def close(self):
+        """
+        Detach from the shared block, and free it if this process created it.
+        Arrays and dataframes taken from the store must not be used afterwards
+        """
+
+        if self.block is None:
+            return
+        self.timestamp = self.columns = None
+        try:
+            self.block.close()
+        except BufferError:
+            pass  # Views still held elsewhere, the mapping goes when they do
+        if self.owner:
+            self.block.unlink()
+        self.block = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+
+def _readOnly(array):
+    view = array.view()
+    view.flags.writeable = False
+
+    return view
+
+
+# %% 3. Running a function over the tickers
+
+
+def mapTickers(function, store, tickers=None, workers=None, *args):
+    """
+    Parameters
+    ----------
+    function : function
+        function(ticker, arrays, *args) -> result, where arrays is
+        store.arrays(ticker). Must be defined at module level so it can be
+        sent to the workers
+    store : SharedOHLCV
+        Data for the tickers
+    tickers : list
+        Tickers to run, defaults to all of them
+    workers : int
+        Number of worker processes, defaults to the number of cpus. 1 runs in
+        the current process
+    *args :
+        Extra arguments passed to every call
+
+    Returns
+    -------
+    results : dict
+        Ticker -> result
+
+    Package requirements
+    -------
+    from concurrent.futures import ProcessPoolExecutor
+    """
+
+    tickers = list(store) if tickers is None else list(tickers)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        return {ticker: function(ticker, store.arrays(ticker), *args) for ticker in tickers}
+
+    # Each task sends the store's name and layout, not its data
+    chunks = [list(chunk) for chunk in np.array_split(np.array(tickers, dtype=object),
+                                                      min(len(tickers), 4*workers) or 1)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunkResults = profiling.poolMap(pool, _runChunk, [function]*len(chunks),
+                                         [store]*len(chunks), chunks, [args]*len(chunks))
+        return {ticker: result for chunkResult in chunkResults
+                for ticker, result in chunkResult}
+
+
+def _runChunk(function, store, tickers, args):
+    """
+    Worker function: function over a chunk of tickers, returns (ticker, result)
+    pairs
+    """
+
+    try:
+        return [(ticker, function(ticker, store.arrays(ticker), *args)) for ticker in tickers]
+    finally:
+        store.close()
@@ -0,0 +1,539 @@
+# -*- coding: utf-8 -*-
+"""
+Created on %(date)s
+
+@author: Treacher
+
+Contains: simulated broker and market data replay for running the strategy
+without Alpaca
+"""
+
+# %%% 0. Notes
+
+'''
+Local stand-in for both sides of the Alpaca api:
+    data : get_aggs(symbol, multiplier, timespan, _from, to) returns the bars
+        replayed so far (never anything after the current bar)
+    orders : submit_order(...) with the same arguments as alpaca_trade_api's
+        REST.submit_order, including bracket orders with take_profit and
+        stop_loss legs (see the example at the bottom of main.py), plus
+        get_order, list_orders, cancel_order, list_positions, get_position
+        and get_account
+
+Cached bars (e.g. from ohlcvCache.OHLCVCache) are replayed one time step at a
+time, either from python (replay) or as a LiveTrader feed (stream), at a
+configurable speed - real time, a multiple of it or as fast as possible.
+
+Fill rules, checked against each new bar of the order's ticker (never the bar
+the order was submitted on, so there's no look ahead):
+    market : fills at the open
+    limit : buy fills if low <= limit, at the lower of the open and the limit
+        (sells the other way round)
+    stop : sell triggers if low <= stop, buy if high >= stop, then fills as
+        a market order at the worse of the open and the stop. A stop_limit
+        then rests as a limit order at its limit price
+    bracket : the entry (market or limit) fills as above, then the take
+        profit (limit) and stop loss (stop / stop limit) legs become active
+        from the next bar. They are one cancels other - if both could fill on
+        the same bar, the stop loss is assumed to have hit first
+Market and stop fills pay slippage: a fraction of the price (e.g. 0.0005 for
+5 bps) against the order, or any function
+slippage(price, qty, side, volume) -> fill price (see volumeSlippage).
+
+'day' orders expire if they're still open at the end of the first trading day
+they were checked on, 'gtc' orders stay open until filled or cancelled.
+
+Everything is held as (time x ticker) arrays and only tickers with open orders
+are looked at each step, so replaying a year of minute bars for the Dow takes
+seconds (mostly spent in whatever the strategy does with them).
+'''
+
+
+# %% 1. Import libraries
+
+import asyncio
+import itertools
+import numpy as np
+import pandas as pd
+
+from dataLoader import FetchError
+
+
+# %% 2. Slippage
+
+
+def volumeSlippage(base=0.0005, impact=0.1):
+    """
+    Parameters
+    ----------
+    base : float
+        Fraction of the price paid on every fill
+    impact : float
+        Extra fraction paid per unit of the order's share of the bar volume,
+        e.g. 0.1 pays another 1 % for an order of 10 % of the volume
+
+    Returns
+    -------
+    slippage : function
+        slippage(price, qty, side, volume) -> fill price, for SimulatedMarket
+    """
+
+    def slippage(price, qty, side, volume):
+        fraction = base + (impact*qty/volume if volume > 0 else 0.0)
+        return price*(1 + fraction) if side == 'buy' else price*(1 - fraction)
+
+    return slippage
+
+
+def _fixedSlippage(fraction):
+    def slippage(price, qty, side, volume):
+        return price*(1 + fraction) if side == 'buy' else price*(1 - fraction)
+
+    return slippage
+
+
+# %% 3. Orders and positions
+
+
+class Order:
+    """
+    Order in the same shape as alpaca_trade_api's (the attributes used by
+    main.py and liveTrading.py at least). status is one of 'new', 'held' (a
+    bracket leg waiting for its entry to fill), 'filled', 'canceled' or
+    'expired'
+    """
+
+    __slots__ = ('id', 'client_order_id', 'symbol', 'qty', 'side', 'type',
+                 'time_in_force', 'limit_price', 'stop_price', 'order_class',
+                 'status', 'filled_qty', 'filled_avg_price', 'submitted_at',
+                 'filled_at', 'legs', 'parent', 'triggered', 'activeFrom', 'day')
+
+    def __init__(self, id, symbol, qty, side, type, time_in_force, limit_price=None,
+                 stop_price=None, order_class='simple', client_order_id=None):
+        self.id = id
+        self.client_order_id = client_order_id or id
+        self.symbol = symbol
+        self.qty = float(qty)
+        self.side = side
+        self.type = type
+        self.time_in_force = time_in_force
+        self.limit_price = None if limit_price is None else float(limit_price)
+        self.stop_price = None if stop_price is None else float(stop_price)
+        self.order_class = order_class
+        self.status = 'new'
+        self.filled_qty = 0.0
+        self.filled_avg_price = None
+        self.submitted_at = None
+        self.filled_at = None
+        self.legs = []
+        self.parent = None
+        self.triggered = False  # stop orders, once the stop has been hit
+        self.activeFrom = 0  # first time step the order can fill on
+        self.day = None  # trading day of the first bar it was checked on
+
+    def __repr__(self):
+        return 'Order({} {} {:g} {} {} {})'.format(self.id, self.side, self.qty, self.symbol,
+                                                   self.type, self.status)
+
+
+class Position:
+    """
+    Net holding in a ticker (qty negative when short) and its average entry
+    price
+    """
+
+    __slots__ = ('symbol', 'qty', 'avg_entry_price', 'current_price')
+
+    def __init__(self, symbol):
+        self.symbol = symbol
+        self.qty = 0.0
+        self.avg_entry_price = 0.0
+        self.current_price = np.nan
+
+    @property
+    def market_value(self):
+        return self.qty*self.current_price
+
+    @property
+    def side(self):
+        return 'long' if self.qty > 0 else 'short'
+
+    def __repr__(self):
+        return 'Position({} {:g} @ {:.4f})'.format(self.symbol, self.qty, self.avg_entry_price)
+
+
+# %% 4. Market
+
+
+class SimulatedMarket:
+    """
+    data : dict
+        Ticker -> ohlcv dataframe of the bars to replay
+    multiplier, timespan : int, str
+        Size of the bars in data, e.g. 1, 'minute'. Only this size can be
+        asked for with get_aggs
+    slippage : float or function
+        Fraction of the price paid on market and stop fills, or a function
+        slippage(price, qty, side, volume) -> fill price
+    cash : float
+        Starting cash of the account
+    speed : float
+        Replay speed for stream(): bars are spaced by their real spacing
+        divided by speed (1 = real time). None replays as fast as possible
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np\n
+    asyncio
+    """
+
+    blocking = False  # For LiveTrader - orders are cheap, no need for threads
+
+    def __init__(self, data, multiplier=1, timespan='day', slippage=0.0, cash=100000.0,
+                 speed=None):
+        self.multiplier = multiplier
+        self.timespan = timespan
+        self.slippage = slippage if callable(slippage) else _fixedSlippage(slippage)
+        self.speed = speed
+        self.startingCash = float(cash)
+
+        # All the tickers on one time index, nan where a ticker has no bar
+        self.tickers = list(data)
+        self.columns = {ticker: j for j, ticker in enumerate(self.tickers)}
+        frames = list(data.values())
+        self.index = pd.DatetimeIndex(frames[0].index if frames else [])
+        for df in frames[1:]:
+            self.index = self.index.union(df.index)
+        self.days = np.asarray(self.index.normalize().asi8)
+        shape = (len(self.index), len(self.tickers))
+        arrays = {c: np.full(shape, np.nan) for c in ('open', 'high', 'low', 'close', 'volume')}
+        for ticker, df in data.items():
+            columns = {c.lower(): c for c in df.columns}
+            rows = self.index.get_indexer(df.index)
+            for c, values in arrays.items():
+                values[rows, self.columns[ticker]] = df[columns[c]].to_numpy(dtype=float)
+        self.open, self.high, self.low = arrays['open'], arrays['high'], arrays['low']
+        self.close, self.volume = arrays['close'], arrays['volume']
+
+        self.reset()
+
+    @classmethod
+    def fromCache(cls, cache, tickers, timeframe='1day', startDate=None, endDate=None,
+                  **settings):
+        """
+        Replay the bars held in an ohlcvCache.OHLCVCache. timeframe is the
+        cache's bar size, e.g. '1day' or '1minute'
+        """
+
+        multiplier = int(''.join(itertools.takewhile(str.isdigit, timeframe)))
+        timespan = timeframe[len(str(multiplier)):]
+        data = {}
+        for ticker in tickers:
+            df = cache.read(ticker, timeframe, startDate, endDate)
+            if df is not None and len(df):
+                data[ticker] = df
+
+        return cls(data, multiplier, timespan, **settings)
+
+    def reset(self):
+        """
+        Back to before the first bar with the starting cash and no orders
+        """
+
+        self.i = -1
+        self.cash = self.startingCash
+        self.orders = {}
+        self.openOrders = []
+        self.positions = {}
+        self.orderIds = itertools.count(1)
+
+    # %%% Time
+
+    @property
+    def now(self):
+        return self.index[self.i] if self.i >= 0 else None
+
+    def step(self):
+        """
+        Move on to the next time step, filling any orders its bars trigger
+
+        Returns
+        -------
+        timestamp : Timestamp
+            Time of the new bars, None if the replay has finished
+        """
+
+        if self.i + 1 >= len(self.index):
+            return None
+        self.i += 1
+        if self.openOrders:
+            self._matchOrders()
+
+        return self.index[self.i]
+
+    def bars(self, tickers=None):
+        """
+        Current bar of each ticker (that has one) as
+        {ticker: (open, high, low, close, volume)}
+        """
+
+        i = self.i
+        columns = self.columns if tickers is None else \
+            {t: self.columns[t] for t in tickers if t in self.columns}
+        rows = zip(self.open[i].tolist(), self.high[i].tolist(), self.low[i].tolist(),
+                   self.close[i].tolist(), self.volume[i].tolist())
+        rows = list(rows)
+
+        return {ticker: rows[j] for ticker, j in columns.items() if rows[j][3] == rows[j][3]}
+
+    def replay(self, tickers=None):
+        """
+        Generator stepping through the whole replay as fast as possible,
+        yielding (timestamp, bars) at each step (see bars)
+        """
+
+        while self.step() is not None:
+            yield self.index[self.i], self.bars(tickers)
+
+    async def stream(self, tickers=None):
+        """
+        Async version of replay for liveTrading.LiveTrader, at self.speed
+        """
+
+        while self.step() is not None:
+            if self.speed and self.i > 0:
+                gap = (self.index[self.i] - self.index[self.i - 1]).total_seconds()
+                await asyncio.sleep(gap/self.speed)
+            else:
+                await asyncio.sleep(0)
+            yield self.index[self.i], self.bars(tickers)
+
+    # %%% Market data
+
+    def get_aggs(self, symbol, multiplier, timespan, _from, to):
+        """
+        Bars replayed so far between two dates (inclusive), in the layout of
+        dataLoader.barsToDataframe
+        """
+
+        if symbol not in self.columns:
+            raise FetchError('unknown ticker {}'.format(symbol), 404)
+        if (int(multiplier), timespan) != (self.multiplier, self.timespan):
+            raise FetchError('only {}{} bars are replayed'.format(self.multiplier,
+                                                                  self.timespan), 400)
+
+        tz = self.index.tz
+        first = self.index.searchsorted(pd.Timestamp(_from, tz=tz))
+        last = min(self.index.searchsorted(pd.Timestamp(to, tz=tz) + pd.Timedelta(days=1)),
+                   self.i + 1)
+        j = self.columns[symbol]
+        rows = slice(first, max(first, last))
+        df = pd.DataFrame({'open': self.open[rows, j], 'high': self.high[rows, j],
+                           'low': self.low[rows, j], 'close': self.close[rows, j],
+                           'volume': self.volume[rows, j]}, index=self.index[rows])
+        df.index.name = 'timestamp'
+
+        return df[df['close'].notna()]
+
+    # %%% Orders
+
+    def submit_order(self, symbol, qty, side, type='market', time_in_force='day',
+                     limit_price=None, stop_price=None, client_order_id=None,
+                     order_class=None, take_profit=None, stop_loss=None, **kwargs):
+        """
+        Same arguments as alpaca_trade_api.REST.submit_order. Returns the Order
+        """
+
+        if symbol not in self.columns:
+            raise FetchError('unknown ticker {}'.format(symbol), 404)
+        if side not in ('buy', 'sell'):
+            raise ValueError("side must be 'buy' or 'sell', not {!r}".format(side))
+        if type not in ('market', 'limit', 'stop', 'stop_limit'):
+            raise ValueError('unsupported order type {!r}'.format(type))
+        if type in ('limit', 'stop_limit') and limit_price is None:
+            raise ValueError('{} orders need a limit_price'.format(type))
+        if type in ('stop', 'stop_limit') and stop_price is None:
+            raise ValueError('{} orders need a stop_price'.format(type))
+
+        order = self._newOrder(symbol, qty, side, type, time_in_force, limit_price,
+                               stop_price, order_class or 'simple', client_order_id)
+
+        if order_class == 'bracket':
+            if take_profit is None or stop_loss is None:
+                raise ValueError('bracket orders need take_profit and stop_loss')
+            # Stop loss first, so it's the one that fills if both legs could
+            exitSide = 'sell' if side == 'buy' else 'buy'
+            legs = [self._newOrder(symbol, qty, exitSide,
+                                   'stop_limit' if 'limit_price' in stop_loss else 'stop',
+                                   time_in_force, stop_loss.get('limit_price'),
+                                   stop_loss['stop_price'], 'bracket'),
+                    self._newOrder(symbol, qty, exitSide, 'limit', time_in_force,
+                                   take_profit['limit_price'], None, 'bracket')]
+            for leg in legs:
+                leg.parent = order
+                leg.status = 'held'
+            order.legs = legs
+
+        self.openOrders.append(order)
+
+        return order
+
+    def _newOrder(self, symbol, qty, side, type, time_in_force, limit_price, stop_price,
+                  order_class, client_order_id=None):
+        order = Order(str(next(self.orderIds)), symbol, qty, side, type, time_in_force,
+                      limit_price, stop_price, order_class, client_order_id)
+        order.submitted_at = self.now
+        order.activeFrom = self.i + 1
+        self.orders[order.id] = order
+
+        return order
+
+    def get_order(self, order_id):
+        return self.orders[order_id]
+
+    def list_orders(self, status='open', symbols=None):
+        if status == 'open':
+            orders = [o for o in self.orders.values() if o.status in ('new', 'held')]
+        elif status == 'closed':
+            orders = [o for o in self.orders.values() if o.status not in ('new', 'held')]
+        else:
+            orders = list(self.orders.values())
+
+        return [o for o in orders if symbols is None or o.symbol in symbols]
+
+    def cancel_order(self, order_id):
+        order = self.orders[order_id]
+        if order.status in ('new', 'held'):
+            order.status = 'canceled'
+            for leg in order.legs:
+                if leg.status in ('new', 'held'):
+                    leg.status = 'canceled'
+            self.openOrders = [o for o in self.openOrders if o.status == 'new']
+
+    def cancel_all_orders(self):
+        for order in list(self.openOrders):
+            self.cancel_order(order.id)
+
+    # %%% Positions and account
+
+    def list_positions(self):
+        return [p for p in self.positions.values() if p.qty != 0]
+
+    def get_position(self, symbol):
+        position = self.positions.get(symbol)
+        if position is None or position.qty == 0:
+            raise FetchError('position does not exist', 404)
+
+        return position
+
+    def get_account(self):
+        """
+        cash, equity (cash plus the positions at the latest close) and the
+        market value of the longs and shorts
+        """
+
+        long = short = 0.0
+        for position in self.positions.values():
+            j = self.columns[position.symbol]
+            closes = self.close[:self.i + 1, j]
+            valid = closes[~np.isnan(closes)]
+            position.current_price = float(valid[-1]) if len(valid) else np.nan
+            if position.qty > 0:
+                long += position.market_value
+            elif position.qty < 0:
+                short += position.market_value
+
+        return {'cash': self.cash, 'equity': self.cash + long + short,
+                'long_market_value': long, 'short_market_value': short}
+
+    # %%% Matching
+
+    def _matchOrders(self):
+        i = self.i
+        stillOpen = []
+        for order in self.openOrders:
+            if order.status != 'new':
+                continue  # Filled or cancelled as the other leg of a bracket
+            j = self.columns[order.symbol]
+            if i < order.activeFrom or self.close[i, j] != self.close[i, j]:
+                stillOpen.append(order)
+                continue
+
+            price = self._fillPrice(order, i, j)
+            if price is not None:
+                self._fill(order, price, i)
+                for leg in order.legs:
+                    leg.status = 'new'
+                    leg.activeFrom = i + 1
+                    stillOpen.append(leg)
+                if order.parent is not None:
+                    for leg in order.parent.legs:
+                        if leg is not order and leg.status in ('new', 'held'):
+                            leg.status = 'canceled'
+                continue
+
+            # Day orders expire at the end of the first day they were live on
+            if order.day is None:
+                order.day = self.days[i]
+            if order.time_in_force == 'day' and (i + 1 >= len(self.index) or
+                                                 self.days[i + 1] != order.day):
+                order.status = 'expired'
+                for leg in order.legs:
+                    leg.status = 'canceled'
+                continue
+            stillOpen.append(order)
+
+        self.openOrders = stillOpen
+
+    def _fillPrice(self, order, i, j):
+        """
+        Price the order fills at on bar i of ticker j, None if it doesn't
+        """
+
+        barOpen, high, low = self.open[i, j], self.high[i, j], self.low[i, j]
+        buy = order.side == 'buy'
+
+        if order.type in ('stop', 'stop_limit') and not order.triggered:
+            stop = order.stop_price
+            if (buy and high < stop) or (not buy and low > stop):
+                return None
+            order.triggered = True
+            if order.type == 'stop':
+                price = max(barOpen, stop) if buy else min(barOpen, stop)
+                return self.slippage(price, order.qty, order.side, self.volume[i, j])
+
+        if order.type == 'market':
+            return self.slippage(barOpen, order.qty, order.side, self.volume[i, j])
+
+        # Limit orders (including triggered stop limits)
+        limit = order.limit_price
+        if buy and low <= limit:
+            return min(barOpen, limit)
+        if not buy and high >= limit:
+            return max(barOpen, limit)
+
+        return None
+
+    def _fill(self, order, price, i):
+        price = float(price)
+        order.status = 'filled'
+        order.filled_qty = order.qty
+        order.filled_avg_price = price
+        order.filled_at = self.index[i]
+
+        position = self.positions.setdefault(order.symbol, Position(order.symbol))
+        change = order.qty if order.side == 'buy' else -order.qty
+        self.cash -= change*price
+
+        # Average entry price moves only when adding to (or flipping) a position
+        newQty = position.qty + change
+        if newQty == 0:
+            position.avg_entry_price = 0.0
+        elif position.qty == 0 or (position.qty > 0) != (newQty > 0):
+            position.avg_entry_price = price
+        elif abs(newQty) > abs(position.qty):
+            position.avg_entry_price = (position.avg_entry_price*position.qty +
+                                        price*change)/newQty
+        position.qty = newQty
+        position.current_price = float(self.close[i, self.columns[order.symbol]])
@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+"""
+Created on %(date)s
+
+@author: Treacher
+
+Contains: trade_signal (and evaluateSignal, working on just the latest
+indicator values) and its vectorised counterparts for the ADX + MACD trend
+following strategy
+"""
+
+# %%% 0. Notes
+
+'''
+Trading strategy built on the ADX (trend strength) and MACD (trend direction)
+
+With no position:
+    ADX > 25 and macd above signal -> Buy (go long)
+    ADX > 25 and macd below signal -> Sell (go short)
+With a long position:
+    ADX > 25 and macd below signal -> Close_Sell (close the long, go short)
+    macd below signal (weak trend) -> Close
+With a short position:
+    ADX > 25 and macd above signal -> Buy (close the short, go long)
+    macd above signal (weak trend) -> Close
+'''
+
+
+# %% 1. Import libraries
+
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+
+import profiling
+
+
+# %% 2. Single bar trading signal
+
+
+'''
+The rules only ever look at the latest value of each indicator, so a signal
+is worked out from a small snapshot (IndicatorSnapshot) of those values and
+the current position. Each call costs the same however long the history is -
+no copying of the indicator dataframe.
+'''
+
+IndicatorSnapshot = namedtuple('IndicatorSnapshot', ['adx', 'macd', 'signal'])
+
+
+def evaluateSignal(latest, longOrShort, adxThreshold=25):
+    """
+    Parameters
+    ----------
+    latest : IndicatorSnapshot or tuple
+        Latest (adx, macd, signal) values
+    longOrShort : str
+        Current position: '' for none, 'long' or 'Short'
+    adxThreshold : float
+        ADX level above which the trend is considered significant
+
+    Returns
+    -------
+    signal : str
+        'Buy', 'Sell', 'Close_Sell', 'Close' or '' for no trade (see the rules
+        at the top)
+    """
+
+    adx, macd, signal = latest
+    trending = adx > adxThreshold  # False while ADX is nan (warm up)
+
+    # With no existing position for the current asset
+    if longOrShort == '':
+        if trending and macd > signal:
+            return 'Buy'
+        if trending and macd < signal:
+            return 'Sell'
+
+    # If you have an existing long position, close it if the macd falls below
+    # the signal (and go short if the trend is still significant)
+    elif longOrShort == 'long':
+        if macd < signal:
+            return 'Close_Sell' if trending else 'Close'
+
+    # If you have an existing short position
+    elif longOrShort == 'Short':
+        if macd > signal:
+            return 'Buy' if trending else 'Close'
+
+    return ''
+
+
+def latestIndicators(dfWithIndicators):
+    """
+    IndicatorSnapshot of the last row of a dataframe with 'ADX', 'macd' and
+    'signal' columns (or a dict of lists / arrays with those keys)
+    """
+
+    values = []
+    for column in ('ADX', 'macd', 'signal'):
+        series = dfWithIndicators[column]
+        values.append(series.iloc[-1] if hasattr(series, 'iloc') else series[-1])
+
+    return IndicatorSnapshot(*values)
+
+
+@profiling.timed('strategy.trade_signal')
+def trade_signal(dfWithIndicators, longOrShort, adxThreshold=25):
+
+    "function to generate signal"
+    return evaluateSignal(latestIndicators(dfWithIndicators), longOrShort, adxThreshold)
+
+
+# %% 3. Vectorised trading signal
+
+
+'''
+The same rules as trade_signal evaluated over a whole series at once.
+
+Positions are coded 1 = long, 0 = flat, -1 = short. A trending bar (ADX above
+the threshold) always leaves you long if macd > signal and short if
+macd < signal, whatever the previous position. A non-trending bar can only
+close a position: macd < signal closes a long and macd > signal closes a
+short. So the position after any bar is the direction of the last trending
+crossover, unless a closing bar has happened since, in which case it's flat.
+That can be worked out with cumulative sums rather than stepping bar by bar.
+'''
+
+
+@profiling.timed('strategy.positionSeries')
+def positionSeries(adx, macd, signal, adxThreshold=25, holdPositions=True):
+    """
+    Parameters
+    ----------
+    adx, macd, signal : array like
+        Indicator values, either 1D (time) or 2D (time x ticker)
+    adxThreshold : float
+        ADX level above which the trend is considered significant
+    holdPositions : bool
+        If True, each bar's signal is evaluated against the position left by
+        the previous signals. If False, every bar is evaluated as though there
+        is no existing position (so only Buy and Sell signals are produced)
+
+    Returns
+    -------
+    positions : numpy array of int8
+        Position held after the signal on each bar (1 long, 0 flat, -1 short)
+
+    Package requirements
+    -------
+    numpy as np
+    """
+
+    adx, macd, signal = (np.asarray(x, dtype=float) for x in (adx, macd, signal))
+
+    # Comparisons against nan are False, so warm up bars never trigger anything
+    trending = adx > adxThreshold
+    up = macd > signal
+    down = macd < signal
+    crossover = np.where(trending & up, 1, np.where(trending & down, -1, 0)).astype(np.int8)
+    if holdPositions is False:
+        return crossover
+
+    # Row of the latest trending crossover on or before each bar (-1 if none)
+    rows = np.arange(len(crossover), dtype=np.int32).reshape((-1,) + (1,)*(crossover.ndim - 1))
+    lastCrossover = np.maximum.accumulate(np.where(crossover != 0, rows, -1), axis=0)
+    seen = lastCrossover >= 0
+    lastCrossover = np.maximum(lastCrossover, 0)
+    direction = np.where(seen, np.take_along_axis(crossover, lastCrossover, axis=0), 0)
+
+    # The direction can't change between crossovers, so count the bars since
+    # the crossover that would close it (macd below signal for a long, above
+    # for a short, without a trend)
+    closing = ~trending & (((direction == 1) & down) | ((direction == -1) & up))
+    closes = np.cumsum(closing, axis=0, dtype=np.int32)
+    closed = closes > np.take_along_axis(closes, lastCrossover, axis=0)
+
+    positions = np.where(closed, 0, direction).astype(np.int8)
+
+    return positions
+
+
+def signalSeries(positions):
+    """
+    Parameters
+    ----------
+    positions : array like
+        Output of positionSeries (1D)
+
+    Returns
+    -------
+    signals : numpy array of str
+        The trade_signal string ('', 'Buy', 'Sell', 'Close', 'Close_Sell')
+        that moves the position from the previous bar to the current one
+
+    Package requirements
+    -------
+    numpy as np
+    """
+
+    current = np.asarray(positions, dtype=np.int8)
+    previous = np.concatenate(([0], current[:-1]))
+
+    signals = np.full(len(current), '', dtype=object)
+    signals[(current == 1) & (previous != 1)] = 'Buy'
+    signals[(current == -1) & (previous == 0)] = 'Sell'
+    signals[(current == -1) & (previous == 1)] = 'Close_Sell'
+    signals[(current == 0) & (previous != 0)] = 'Close'
+
+    return signals
+
+
+@profiling.timed('strategy.tradeSignalSeries')
+def tradeSignalSeries(dfWithIndicators, adxThreshold=25, holdPositions=True):
+    """
+    Parameters
+    ----------
+    dfWithIndicators : Dataframe
+        Data with the 'ADX', 'macd' and 'signal' columns added
+    adxThreshold : float
+        ADX level above which the trend is considered significant
+    holdPositions : bool
+        If True, each bar is evaluated against the position left by the
+        signals before it. If False, every bar is evaluated with no position
+
+    Returns
+    -------
+    signals : Series
+        What trade_signal would return on each bar if called bar by bar on the
+        history up to that bar, all worked out in one vectorised pass
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np
+    """
+
+    positions = positionSeries(dfWithIndicators['ADX'], dfWithIndicators['macd'],
+                               dfWithIndicators['signal'], adxThreshold, holdPositions)
+    if holdPositions is False:
+        signals = np.where(positions == 1, 'Buy', np.where(positions == -1, 'Sell', ''))
+        signals = signals.astype(object)
+    else:
+        signals = signalSeries(positions)
+
+    return pd.Series(signals, index=dfWithIndicators.index, name='signal')
@@ -4,14 +4,19 @@ Created on %(date)s
 
 @author: Treacher
 
-Contains: MACD, ATR, Slope
+Contains: MACD, ATR, Slope, Stochastic, ADX, streaming (bar by bar) versions
+of MACD, ATR, ADX and Stochastic, batch (multi ticker) versions of MACD,
+ATR, ADX and Stochastic, and an optional numba backend (setBackend)
 """
 
 # %% 0. Import libraries required by functions
 
+from collections import deque, namedtuple
+
 import numpy as np
 import pandas as pd
-from sklearn.linear_model import LinearRegression
+
+import profiling
 
 
 # %% 1. Average True Range (ATR)
@@ -30,6 +35,7 @@ sell (short) the security when the MACD crosses below the signal line
 '''
 
 
+@profiling.timed('indicator.ATR')
 def ATR(ohlcv, simpleMovingAverage=14, returnAllRanges=False):
     """
     ohlcv : Dataframe
@@ -44,27 +50,32 @@ def ATR(ohlcv, simpleMovingAverage=14, returnAllRanges=False):
     Returns
     -------
     atr : Dataframe
-        Average true range of the asset
+        Copy of ohlcv with the average true range of the asset in 'ATR' (plus
+        'H-L', 'H-PC', 'L-PC' and 'TR' if returnAllRanges)
 
     Package requirements
     -------
-    pandas as pd
+    pandas as pd\n
+    numpy as np
     """
 
+    # The output is the input plus the new columns, so this copy is the result
     df = ohlcv.copy()
     df.columns = map(str.lower, df.columns)  # Force columns names lowercase
-
-    df['H-L'] = abs(df['high'] - df['low'])
-    df['H-PC'] = abs(df['high'] - df['close'].shift(1))
-    df['L-PC'] = abs(df['low'] - df['close'].shift(1))
-    df['TR'] = df[['H-L', 'H-PC', 'L-PC']].max(axis=1, skipna=False)
-    df['ATR'] = df['TR'].rolling(window=simpleMovingAverage).mean()
-
-    if returnAllRanges is False:
-        df = df.drop(['H-L', 'H-PC', 'L-PC', 'TR'], axis=1, inplace=True)
-        return df
+    high, low, close = _highLowCloseArrays(df)
+
+    tr = trueRange(high, low, close)
+    if returnAllRanges is not False:
+        previousClose = np.concatenate(([np.nan], close[:-1]))
+        df['H-L'] = np.abs(high - low)
+        df['H-PC'] = np.abs(high - previousClose)
+        df['L-PC'] = np.abs(low - previousClose)
+        df['TR'] = tr
+        df['ATR'] = rollingMean(tr, simpleMovingAverage)
     else:
-        return df
+        df['ATR'] = rollingMean(tr, simpleMovingAverage, out=tr)
+
+    return df
 
 # %% 2. Moving Average Convergence Divergence (MACD)
 
@@ -85,6 +96,7 @@ sell (short) the security when the MACD crosses below the signal line
 '''
 
 
+@profiling.timed('indicator.MACD')
 def MACD(ohlcv, fastEMA=12, slowEMA=26, signalEMA=9, returnEMAs=False):
     """
     Parameters
@@ -116,24 +128,22 @@ def MACD(ohlcv, fastEMA=12, slowEMA=26, signalEMA=9, returnEMAs=False):
     pandas as pd
     """
 
-    # Don't want to make any actual changes to the original data
-    df = ohlcv.copy()
-    df.columns = map(str.lower, df.columns)  # Force columns names lowercase
-
-    # Need to pick out the correct column - there might not be an 'Adj Close'
+    # Need to pick out the correct column - there might not be an 'Adj Close'.
+    # Take the first matching column as this will be adjusted close if available
     alternatives = ['adj close', 'close']
-    close = [s for s in df.columns.tolist() if any(xs in s for xs in alternatives)]
+    close = [s for s in ohlcv.columns if any(xs in s.lower() for xs in alternatives)]
 
-    # Take the first matching string as this will be adjusted close if available
-    df['fastMA'] = df[close[0]].ewm(span=fastEMA, min_periods=fastEMA).mean()
-    df['slowMA'] = df[close[0]].ewm(span=slowEMA, min_periods=slowEMA).mean()
-    df['macd'] = df['fastMA'] - df['slowMA']
-    df['signal'] = df['macd'].ewm(span=signalEMA, min_periods=signalEMA).mean()
+    # Work on the column's values directly, no copy of the dataframe needed
+    fastMA = ema(ohlcv[close[0]].to_numpy(), fastEMA, fastEMA)
+    slowMA = ema(ohlcv[close[0]].to_numpy(), slowEMA, slowEMA)
+    macdLine = fastMA - slowMA
+    signal = ema(macdLine, signalEMA, signalEMA)
 
     if returnEMAs is False:
-        return df[['signal', 'macd']]
+        return pd.DataFrame({'signal': signal, 'macd': macdLine}, index=ohlcv.index)
     else:
-        return df[['slowMA', 'fastMA', 'signal', 'macd']]
+        return pd.DataFrame({'slowMA': slowMA, 'fastMA': fastMA, 'signal': signal,
+                             'macd': macdLine}, index=ohlcv.index)
 
 # %% 3. Slope of data
 
@@ -143,11 +153,24 @@ Function to calculate the slope of a series of n datapoints
 
 Basic idea:
     Give the function n datapoints of e.g. price, MACD or whatever
-    Use SciKit Learn linear regression to work out a straight line fit
+    Work out the least squares straight line fit after scaling both axes to 0-1
     Use trigonometry to calculate what the angle is from the straight line
+
+The least squares slope of a window is a dot product of the window with the
+centred x values, so the windows are taken as strided views of the data (no
+copying) and each block of them is one matrix product rather than a regression
+fitted per window. The range used to scale each window comes from
+rollingMax / rollingMin. Each window is fitted on its own, so a nan only spoils
+the windows it is in (e.g. an indicator's warm up) and long series lose no
+precision. A flat window has no range to scale by, so its angle is nan as in
+scalarSlope
 '''
 
 
+SLOPE_BLOCK = 2**14  # Windows per matrix product, bounds the memory used
+
+
+@profiling.timed('indicator.vectorSlope')
 def vectorSlope(dataPoints, n=40):
     """
     Parameters
@@ -161,38 +184,44 @@ def vectorSlope(dataPoints, n=40):
 
     Returns
     -------
-    intercept : float
-        y - axis value of the intercept at x = 0
-    angle : float
-        Slope of the line incoporating n points
+    angle : numpy array
+        Slope (degrees) of the line fitted to each window dataPoints[i-n:i]
+        for i in range(n, len(dataPoints)-1). Note the final complete window,
+        dataPoints[-n:], is not included so results line up with earlier runs.
+        Use scalarSlope(dataPoints[-n:]) if it's needed
 
     Package requirements
     -------
     pandas as pd\n
-    numpy as np\n
-    from sklearn.linear_model import LinearRegression
+    numpy as np
     """
 
-    #if 'LinearRegression' not in dir():
-    #    from sklearn.linear_model import LinearRegression
-
-    lr = LinearRegression()  # Instantiate a linear regression object
-    angles = []  # Each time you add a datapoint, you'll need new slope
-
-    # Loop over the data
-    for i in range(n, len(dataPoints)-1):
-        # x and y data
-        x = np.arange(n)
-        y = dataPoints[i-n:i]
-
-        # Scale the axes so they're not all squished up at x=0
-        y_scaled = (y - y.min())/(y.max() - y.min())
-        x_scaled = (x - x.min())/(x.max() - x.min())
-
-        lr.fit(x_scaled[:, None], y_scaled[:, None])
-        angles.append(lr.coef_[0][0])
-        
-    slope_angle = (np.rad2deg(np.arctan(np.array(angles))))
+    y = np.asarray(dataPoints, dtype=float).ravel()
+    nWindows = len(y) - n - 1
+    if nWindows <= 0:
+        return np.array([])
+
+    # Window i covers y[i-n:i], so they start at 0 to nWindows - 1. The last
+    # point isn't part of any window (see the docstring)
+    y = y[:nWindows + n - 1]
+    windows = np.lib.stride_tricks.sliding_window_view(y, n)
+    yRange = (rollingMax(y, n) - rollingMin(y, n))[n-1:]
+
+    # Least squares slope against x = 0, 1, ..., n-1. Scaling x to 0-1
+    # multiplies it by n-1, scaling y to 0-1 divides it by the window's range
+    xCentred = np.arange(n) - (n - 1)/2
+    xCentred *= (n - 1)/(xCentred**2).sum()
+    slope_angle = np.empty(nWindows)
+    for first in range(0, nWindows, SLOPE_BLOCK):
+        block = windows[first:first + SLOPE_BLOCK]
+        blockRange = yRange[first:first + SLOPE_BLOCK]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slope = block @ xCentred
+            slope /= blockRange
+        # A flat window can't be scaled to 0-1 (nan, as scalarSlope), rather
+        # than whatever round off the product left divided by 0
+        slope[blockRange == 0] = np.nan
+        slope_angle[first:first + len(block)] = np.rad2deg(np.arctan(slope))
 
     return slope_angle
 
@@ -204,7 +233,7 @@ Function to calculate the scalar slope of a rolling window of n datapoints
 
 Basic idea:
     Give the function a window of n datapoints of e.g. price, MACD or whatever
-    Use SciKit Learn linear regression to work out a straight line fit
+    Work out the least squares straight line fit after scaling both axes to 0-1
     Use trigonometry to calculate what the angle is from the straight line
 '''
 
@@ -224,25 +253,24 @@ def scalarSlope(dataPoints):
     Package requirements
     -------
     pandas as pd\n
-    numpy as np\n
-    from sklearn.linear_model import LinearRegression
+    numpy as np
     """
 
-    lr = LinearRegression()  # Instantiate a linear regression object
-
     # x and y data
-    x = np.arange(len(dataPoints))
-    y = dataPoints
+    y = np.asarray(dataPoints, dtype=float).ravel()
+    x = np.arange(len(y))
 
     # Scale the axes so they're not all squished up at x=0
     y_scaled = (y - y.min())/(y.max() - y.min())
     x_scaled = (x - x.min())/(x.max() - x.min())
 
-    lr.fit(x_scaled[:, None], y_scaled[:, None])
-    angle = np.rad2deg(np.arctan(np.array(lr.coef_[0][0])))
-    
+    # Least squares slope of the scaled data
+    x_centred = x_scaled - x_scaled.mean()
+    slope = (x_centred*y_scaled).sum() / (x_centred**2).sum()
+    angle = np.rad2deg(np.arctan(slope))
+
     return angle
-        
+
 # %% 4. Stochastic Oscillator
 
 
@@ -255,6 +283,7 @@ as these conditions may persist for a long period of time.
 '''
 
 
+@profiling.timed('indicator.Stochastic')
 def Stochastic(ohlcv, n=14):
     """
     ohlcv : Dataframe
@@ -274,12 +303,10 @@ def Stochastic(ohlcv, n=14):
     pandas as pd
     """
 
+    # The output is the input plus the new column, so this copy is the result
     df = ohlcv.copy()
     df.columns = map(str.lower, df.columns)  # Force columns names lowercase
-
-    K = (df['close'] - df['low'].rolling(window=n).min()) / \
-    (df['high'].rolling(window=n).max() - df['low'].rolling(window=n).min())
-    df['stochastic'] = K*100
+    df['stochastic'] = stochastic(*_highLowCloseArrays(df), n)
 
     return df
 
@@ -300,6 +327,48 @@ by a support from below and the resistance level above.
 '''
 
 
+def _wilderSmooth(values, n, first, seed, gain=1.0):
+    """
+    values : numpy array
+        Series to be smoothed (e.g. true range or directional movement), 1D
+        (time) or 2D (time x ticker)
+    n : int
+        Number of periods of the smoothing window
+    first : int
+        Index of the first valid output, everything before it is nan
+    seed : float or numpy array
+        Value of the output at index first (e.g. the simple n period sum), one
+        per column for 2D values
+    gain : float
+        Weight applied to each new value (1 for Wilder sums, 1/n for averages)
+
+    Returns
+    -------
+    smoothed : numpy array
+        y[i] = (1 - 1/n)*y[i-1] + gain*values[i] for i > first
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np
+    """
+
+    smoothed = np.full(values.shape, np.nan)
+    if first >= len(values):
+        return smoothed
+
+    # The recursion is a first order IIR filter, so let pandas' ewm (or the
+    # compiled backend) run it in one pass down each column rather than
+    # looping in python. The initial condition carries the seed
+    decay = 1 - 1/n
+    smoothed[first] = seed
+    if first + 1 < len(values):
+        smoothed[first+1:] = _firstOrderFilter(values[first+1:], gain, decay, seed)
+
+    return smoothed
+
+
+@profiling.timed('indicator.ADX')
 def ADX(ohlcv, n=14):
     """
     ohlcv : Dataframe
@@ -316,71 +385,1277 @@ def ADX(ohlcv, n=14):
 
     Package requirements
     -------
-    pandas as pd
+    pandas as pd\n
+    numpy as np
     """
 
-    df = ohlcv.copy()
-    
-    # Need arg3 = True In line below, so the true range is returned as well as ATR
-    df['TR'] = ATR(df, 14, True)['TR']
-
-    # Define the directional movement of the prices based on the differences in high and low
-    df['DMplus'] = np.where((df['high']-df['high'].shift(1)) > (df['low'].shift(1)-df['low']), df['high']-df['high'].shift(1), 0)
-    df['DMplus'] = np.where(df['DMplus'] < 0, 0, df['DMplus'])
-    df['DMminus'] = np.where((df['low'].shift(1)-df['low']) > (df['high']-df['high'].shift(1)), df['low'].shift(1)-df['low'], 0)
-    df['DMminus'] = np.where(df['DMminus'] < 0, 0, df['DMminus'])
-    
-    # Define lists that will contain the n period sums of the true range and directional movements up and down
-    TRn = []
-    DMplusN = []
-    DMminusN = []
-    TR = df['TR'].tolist()
-    DMplus = df['DMplus'].tolist()
-    DMminus = df['DMminus'].tolist()
-    
-    for i in range(len(df)):
-        # No data until n periods have elapsed
+    # Everything is worked out on the column arrays, no copy of the dataframe
+    return pd.Series(adx(*_highLowCloseArrays(ohlcv), n), index=ohlcv.index, name='ADX')
+
+# %% 6. Streaming (incremental) indicators
+
+
+'''
+Stateful versions of the indicators above for use in a live (or bar by bar)
+loop. Each object holds just enough state to take one new bar at a time with
+constant cost, rather than recomputing the indicator over the full history.
+
+Basic idea:
+    1) Seed the state from the history with e.g. ADXState.fromHistory(ohlcv)
+    2) Call update(...) with each new bar, which returns the latest value(s)
+
+The updates follow the same recursions as the batch functions (including the
+pandas ewm and rolling conventions for the warm up period), so the latest
+value agrees with the last row of the batch function on the same data.
+'''
+
+
+class EMAState:
+    """
+    Exponential moving average of a stream of values, matching
+    pandas.Series.ewm(span=span, min_periods=minPeriods).mean()
+
+    Package requirements
+    -------
+    numpy as np
+    """
+
+    __slots__ = ('decay', 'minPeriods', 'weighted', 'oldWeight', 'nObs')
+
+    def __init__(self, span, minPeriods=0):
+        self.decay = 1 - 2/(span + 1)
+        self.minPeriods = minPeriods
+        self.weighted = np.nan
+        self.oldWeight = 1.0
+        self.nObs = 0
+
+    def update(self, value):
+        isObservation = value == value  # False for nan
+        self.nObs += isObservation
+
+        # Nothing to average until the first real observation
+        if self.weighted != self.weighted:
+            if isObservation:
+                self.weighted = value
+        else:
+            # Weights decay with every bar, even missing ones
+            self.oldWeight *= self.decay
+            if isObservation:
+                if self.weighted != value:
+                    self.weighted = (self.oldWeight*self.weighted + value) / \
+                        (self.oldWeight + 1)
+                self.oldWeight += 1
+
+        return self.weighted if self.nObs >= self.minPeriods else np.nan
+
+
+class MACDState:
+    """
+    Streaming version of MACD
+
+    fastEMA : int
+        Number of periods for fast exponential moving average of close price
+    slowEMA : int
+        Number of periods for slow exponential moving average of close price
+    signalEMA : int
+        Number of periods for exponential moving average of the MACD line
+
+    update(close) returns (signal, macd) in the same order as the columns
+    returned by MACD
+
+    Package requirements
+    -------
+    numpy as np
+    """
+
+    __slots__ = ('fastMA', 'slowMA', 'signalMA', 'macd', 'signal')
+
+    def __init__(self, fastEMA=12, slowEMA=26, signalEMA=9):
+        self.fastMA = EMAState(fastEMA, fastEMA)
+        self.slowMA = EMAState(slowEMA, slowEMA)
+        self.signalMA = EMAState(signalEMA, signalEMA)
+        self.macd = np.nan
+        self.signal = np.nan
+
+    def update(self, close):
+        self.macd = self.fastMA.update(close) - self.slowMA.update(close)
+        self.signal = self.signalMA.update(self.macd)
+
+        return self.signal, self.macd
+
+    @classmethod
+    def fromHistory(cls, ohlcv, fastEMA=12, slowEMA=26, signalEMA=9):
+        state = cls(fastEMA, slowEMA, signalEMA)
+
+        # Same column choice as MACD - first column containing 'close'
+        columns = [c.lower() for c in ohlcv.columns]
+        alternatives = ['adj close', 'close']
+        close = [i for i, s in enumerate(columns) if any(xs in s for xs in alternatives)]
+        for value in ohlcv.iloc[:, close[0]].to_numpy(dtype=float):
+            state.update(value)
+
+        return state
+
+
+class ATRState:
+    """
+    Streaming version of ATR
+
+    simpleMovingAverage : int
+        Number of periods in the moving average of the true range
+
+    update(high, low, close) returns the latest average true range
+
+    Package requirements
+    -------
+    numpy as np\n
+    from collections import deque
+    """
+
+    __slots__ = ('n', 'prevClose', 'window', 'total', 'nanCount', 'tr', 'atr')
+
+    def __init__(self, simpleMovingAverage=14):
+        self.n = simpleMovingAverage
+        self.prevClose = np.nan
+        self.window = deque()
+        self.total = 0.0
+        self.nanCount = 0
+        self.tr = np.nan
+        self.atr = np.nan
+
+    def update(self, high, low, close):
+        # True range is nan on the first bar as there is no previous close
+        self.tr = _trueRange(high, low, self.prevClose)
+        self.prevClose = close
+
+        # Rolling window sum, keeping track of any nan values inside it
+        self.window.append(self.tr)
+        if self.tr != self.tr:
+            self.nanCount += 1
+        else:
+            self.total += self.tr
+        if len(self.window) > self.n:
+            old = self.window.popleft()
+            if old != old:
+                self.nanCount -= 1
+            else:
+                self.total -= old
+
+        if len(self.window) == self.n and self.nanCount == 0:
+            self.atr = self.total/self.n
+        else:
+            self.atr = np.nan
+
+        return self.atr
+
+    @classmethod
+    def fromHistory(cls, ohlcv, simpleMovingAverage=14):
+        state = cls(simpleMovingAverage)
+        for high, low, close in _highLowClose(ohlcv):
+            state.update(high, low, close)
+
+        return state
+
+
+class ADXState:
+    """
+    Streaming version of ADX
+
+    n : int
+        Number of periods for the smoothed average windows
+
+    update(high, low, close) returns the latest average directional index
+
+    Package requirements
+    -------
+    numpy as np
+    """
+
+    __slots__ = ('n', 'decay', 'nBars', 'prevHigh', 'prevLow', 'prevClose',
+                 'TRn', 'DMplusN', 'DMminusN', 'DXsum', 'DXcount', 'DX', 'adx')
+
+    def __init__(self, n=14):
+        self.n = n
+        self.decay = 1 - 1/n
+        self.nBars = 0
+        self.prevHigh = np.nan
+        self.prevLow = np.nan
+        self.prevClose = np.nan
+        self.TRn = 0.0
+        self.DMplusN = 0.0
+        self.DMminusN = 0.0
+        self.DXsum = 0.0
+        self.DXcount = 0
+        self.DX = np.nan
+        self.adx = np.nan
+
+    def update(self, high, low, close):
+        n = self.n
+        i = self.nBars
+        self.nBars += 1
+
+        # Directional movement is zero on the first bar (nan comparisons)
+        upMove = high - self.prevHigh
+        downMove = self.prevLow - low
+        DMplus = upMove if (upMove > downMove and upMove > 0) else 0.0
+        DMminus = downMove if (downMove > upMove and downMove > 0) else 0.0
+        TR = _trueRange(high, low, self.prevClose)
+        self.prevHigh, self.prevLow, self.prevClose = high, low, close
+        if i == 0:
+            return self.adx
+
+        # Simple n period sums first, then the Wilder smoothing recursion
+        if i <= n:
+            self.TRn += TR
+            self.DMplusN += DMplus
+            self.DMminusN += DMminus
+        else:
+            self.TRn = TR + self.decay*self.TRn
+            self.DMplusN = DMplus + self.decay*self.DMplusN
+            self.DMminusN = DMminus + self.decay*self.DMminusN
         if i < n:
-            TRn.append(np.NaN)
-            DMplusN.append(np.NaN)
-            DMminusN.append(np.NaN)
-        # First entry is the simple rolling sum
-        elif i == n:
-            TRn.append(df['TR'].rolling(n).sum().tolist()[n])
-            DMplusN.append(df['DMplus'].rolling(n).sum().tolist()[n])
-            DMminusN.append(df['DMminus'].rolling(n).sum().tolist()[n])
-        # Subsequent values require the smoothing sum function
-        elif i > n:
-            TRn.append(TRn[i-1] - (TRn[i-1]/n) + TR[i])
-            DMplusN.append(DMplusN[i-1] - (DMplusN[i-1]/n) + DMplus[i])
-            DMminusN.append(DMminusN[i-1] - (DMminusN[i-1]/n) + DMminus[i])
-    
-    # Include the adjusted sums into the dataframe
-    df['TRn'] = np.array(TRn)
-    df['DMplusN'] = np.array(DMplusN)
-    df['DMminusN'] = np.array(DMminusN)
-    
-    # Remaining calculations have 'consistent' formula, so no looped treatment necessary
-    df['DIplusN'] = 100*(df['DMplusN'] / df['TRn'])
-    df['DIminusN'] = 100*(df['DMminusN'] / df['TRn'])
-    df['DIdiff'] = abs(df['DIplusN'] - df['DIminusN'])
-    df['DIsum'] = df['DIplusN'] + df['DIminusN']
-    df['DX'] = 100*(df['DIdiff'] / df['DIsum'])
-    
-    # ADX has inconsistent foruma, so need to the smoothing thing as seen earlier
-    ADX = []
-    DX = df['DX'].tolist()
-    for j in range(len(df)):
-        # 2n nan values because you're looking at a rolled n window of a rolled n window hence doubling up on nan entries
-        if j < 2*n-1:
-            ADX.append(np.NaN)
-        # Just the regular mean for the first valid entry
-        elif j == 2*n-1:
-            ADX.append(df['DX'][j-n+1:j+1].mean())
-        # Smoothing for the remaining entries
-        elif j > 2*n-1:
-            ADX.append(((n-1)*ADX[j-1] + DX[j])/n)
-
-    df['ADX'] = np.array(ADX)
-    
-    return df['ADX']
\ No newline at end of file
+            return self.adx
+
+        DIplusN = 100*(self.DMplusN / self.TRn) if self.TRn else np.nan
+        DIminusN = 100*(self.DMminusN / self.TRn) if self.TRn else np.nan
+        DIsum = DIplusN + DIminusN
+        self.DX = 100*(abs(DIplusN - DIminusN) / DIsum) if DIsum else np.nan
+
+        # Regular mean of the first n DX values, then the smoothing recursion
+        if i < 2*n - 1:
+            if self.DX == self.DX:
+                self.DXsum += self.DX
+                self.DXcount += 1
+        elif i == 2*n - 1:
+            if self.DX == self.DX:
+                self.DXsum += self.DX
+                self.DXcount += 1
+            self.adx = self.DXsum/self.DXcount if self.DXcount else np.nan
+        else:
+            self.adx = (1/n)*self.DX + self.decay*self.adx
+
+        return self.adx
+
+    @classmethod
+    def fromHistory(cls, ohlcv, n=14):
+        state = cls(n)
+        for high, low, close in _highLowClose(ohlcv):
+            state.update(high, low, close)
+
+        return state
+
+
+class RollingExtremum:
+    """
+    Streaming rolling maximum (sign=1) or minimum (sign=-1) of the last n
+    values, matching rollingMax / rollingMin (nan until n values have been
+    seen or while a nan is inside the window)
+
+    The deque holds (index, value) of only the values that could still be
+    the extremum of a later window, best first. A new value knocks out every
+    value behind it that it beats, so each value is added and removed at most
+    once - O(1) amortised per update whatever n is
+
+    Package requirements
+    -------
+    numpy as np\n
+    from collections import deque
+    """
+
+    __slots__ = ('n', 'sign', 'count', 'lastNan', 'window', 'value')
+
+    def __init__(self, n, sign=1):
+        self.n = n
+        self.sign = sign
+        self.count = 0
+        self.lastNan = -n
+        self.window = deque()
+        self.value = np.nan
+
+    def update(self, value):
+        i = self.count
+        self.count += 1
+        window = self.window
+        if value != value:
+            self.lastNan = i
+        else:
+            if self.sign > 0:
+                while window and window[-1][1] <= value:
+                    window.pop()
+            else:
+                while window and window[-1][1] >= value:
+                    window.pop()
+            window.append((i, value))
+
+        # Drop the best value once it falls out of the window
+        while window and window[0][0] <= i - self.n:
+            window.popleft()
+
+        if self.count < self.n or self.lastNan > i - self.n:
+            self.value = np.nan
+        else:
+            self.value = window[0][1]
+
+        return self.value
+
+
+class StochasticState:
+    """
+    Streaming version of Stochastic
+
+    n : int
+        Number of periods for the low and high minimum and maximums
+
+    update(high, low, close) returns the latest stochastic oscillator value.
+    The rolling low minimum and high maximum are kept by RollingExtremum so
+    each update is O(1) amortised
+
+    Package requirements
+    -------
+    numpy as np\n
+    from collections import deque
+    """
+
+    __slots__ = ('n', 'lows', 'highs', 'stochastic')
+
+    def __init__(self, n=14):
+        self.n = n
+        self.lows = RollingExtremum(n, -1)
+        self.highs = RollingExtremum(n, 1)
+        self.stochastic = np.nan
+
+    def update(self, high, low, close):
+        lowest = self.lows.update(low)
+        highest = self.highs.update(high)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.stochastic = float(np.float64(close - lowest) / (highest - lowest))*100
+
+        return self.stochastic
+
+    @classmethod
+    def fromHistory(cls, ohlcv, n=14):
+        state = cls(n)
+        for high, low, close in _highLowClose(ohlcv):
+            state.update(high, low, close)
+
+        return state
+
+
+def _trueRange(high, low, prevClose):
+    """
+    True range of a single bar, nan if any of the inputs are missing
+    """
+
+    if high != high or low != low or prevClose != prevClose:
+        return np.nan
+
+    return max(abs(high - low), abs(high - prevClose), abs(low - prevClose))
+
+
+def _highLowCloseArrays(ohlcv):
+    """
+    (high, low, close) columns of an ohlcv dataframe as float64 arrays,
+    whatever the case of the column names
+    """
+
+    columns = {c.lower(): c for c in ohlcv.columns}
+
+    return tuple(ohlcv[columns[name]].to_numpy(dtype=np.float64)
+                 for name in ('high', 'low', 'close'))
+
+
+def _highLowClose(ohlcv):
+    """
+    Iterate over (high, low, close) rows of an ohlcv dataframe as floats
+    """
+
+    return zip(*(values.tolist() for values in _highLowCloseArrays(ohlcv)))
+
+
+# %% 7. Array functions
+
+
+'''
+Lower level versions of the indicators working directly on numpy arrays of
+float64 (e.g. df['close'].to_numpy()), which the dataframe functions above are
+thin wrappers around.
+
+Nothing is copied or added to the input - each function allocates only its
+output (or writes into the out= array(s) if given) and a few working arrays of
+the same length. Results follow the same conventions as the dataframe
+functions (pandas ewm / rolling warm up periods and nan handling).
+
+Every function also takes 2D (time x ticker) arrays and works down each
+column, which the batch functions in section 8 build on.
+'''
+
+
+def _asArray(values):
+    """
+    float64 numpy view of the values (only copies if they aren't float64)
+    """
+
+    return np.asarray(values, dtype=np.float64)
+
+
+def _output(out, shape):
+    if out is None:
+        return np.empty(shape)
+    if out.shape != shape:
+        raise ValueError('out has shape {} but {} is needed'.format(out.shape, shape))
+
+    return out
+
+
+@profiling.timed('indicator.trueRange')
+def trueRange(high, low, close, out=None):
+    """
+    high, low, close : numpy array
+        Prices of each bar
+    out : numpy array
+        Optional array to write the result into
+
+    Returns
+    -------
+    tr : numpy array
+        Max of |high - low|, |high - previous close| and |low - previous
+        close|, nan on the first bar or if any of the inputs are nan
+
+    Package requirements
+    -------
+    numpy as np
+    """
+
+    high, low, close = _asArray(high), _asArray(low), _asArray(close)
+    tr = _output(out, high.shape)
+    if len(tr) == 0:
+        return tr
+
+    # Work in place in the output: |H-L|, then the max with |H-PC| and |L-PC|.
+    # np.maximum propagates nan, like max(skipna=False)
+    np.subtract(high, low, out=tr)
+    np.abs(tr, out=tr)
+    gap = np.subtract(high[1:], close[:-1])
+    np.abs(gap, out=gap)
+    np.maximum(tr[1:], gap, out=tr[1:])
+    np.subtract(low[1:], close[:-1], out=gap)
+    np.abs(gap, out=gap)
+    np.maximum(tr[1:], gap, out=tr[1:])
+    tr[0] = np.nan
+
+    return tr
+
+
+@profiling.timed('indicator.rollingMean')
+def rollingMean(values, n, out=None):
+    """
+    values : numpy array
+        Series to average
+    n : int
+        Window length
+    out : numpy array
+        Optional array to write the result into
+
+    Returns
+    -------
+    mean : numpy array
+        Mean of the last n values, nan until n values are available or if any
+        value in the window is nan (as pandas rolling(n).mean())
+
+    Package requirements
+    -------
+    numpy as np
+    """
+
+    values = _asArray(values)
+    mean = _output(out, values.shape)
+    if len(values) < n:
+        mean[:] = np.nan
+        return mean
+
+    # Window sums from a cumulative sum, with a separate count of nan values.
+    # These are taken before writing to mean, which may be values itself
+    missing = np.isnan(values)
+    sums = np.cumsum(np.where(missing, 0.0, values), axis=0)
+    counts = np.cumsum(missing, axis=0)
+    mean[:n-1] = np.nan
+    windowSums = sums[n-1:].copy()
+    windowSums[1:] -= sums[:-n]
+    windowMissing = counts[n-1:].copy()
+    windowMissing[1:] -= counts[:-n]
+    np.divide(windowSums, n, out=mean[n-1:])
+    mean[n-1:][windowMissing > 0] = np.nan
+
+    return mean
+
+
+@profiling.timed('indicator.rollingMax')
+def rollingMax(values, n, out=None):
+    """
+    values : numpy array
+        Series (or (time x ticker) array) to take the rolling maximum of
+    n : int
+        Window length
+    out : numpy array
+        Optional array to write the result into
+
+    Returns
+    -------
+    maximum : numpy array
+        Maximum of the last n values, nan until n values are available or if
+        any value in the window is nan (as pandas rolling(n).max()). The cost
+        per value doesn't depend on n
+
+    Package requirements
+    -------
+    numpy as np
+    """
+
+    maximum = _rollingExtremum(_asArray(values), n, 1)
+    if out is None:
+        return maximum
+    _output(out, maximum.shape)[:] = maximum
+
+    return out
+
+
+@profiling.timed('indicator.rollingMin')
+def rollingMin(values, n, out=None):
+    """
+    Rolling minimum, see rollingMax
+
+    Package requirements
+    -------
+    numpy as np
+    """
+
+    minimum = _rollingExtremum(_asArray(values), n, -1)
+    if out is None:
+        return minimum
+    _output(out, minimum.shape)[:] = minimum
+
+    return out
+
+
+@profiling.timed('indicator.atr')
+def atr(high, low, close, n=14, out=None):
+    """
+    Average true range, see ATR. Returns a numpy array
+
+    Package requirements
+    -------
+    numpy as np
+    """
+
+    tr = trueRange(high, low, close, out=out)
+
+    return rollingMean(tr, n, out=tr)
+
+
+@profiling.timed('indicator.ema')
+def ema(values, span, minPeriods=0, out=None):
+    """
+    values : numpy array
+        Series to average
+    span : int
+        Span of the exponential moving average
+    minPeriods : int
+        Number of (non nan) values needed before there is an output
+    out : numpy array
+        Optional array to write the result into
+
+    Returns
+    -------
+    ema : numpy array
+        Same as pandas Series.ewm(span=span, min_periods=minPeriods).mean():
+        the weighted average of all the values so far with weights decaying by
+        (1 - alpha) per bar. Missing values still decay the weights but add
+        nothing
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np
+    """
+
+    values = _asArray(values)
+    average = _output(out, values.shape)
+    if len(values) == 0:
+        return average
+
+    # Numerator and denominator of the weighted average are both first order
+    # recursions (x[i] + decay*y[i-1]), so each is one filter pass
+    decay = 1 - 2/(span + 1)
+    observed = ~np.isnan(values)
+    numerator = _firstOrderFilter(np.where(observed, values, 0.0), 1.0, decay)
+    denominator = _firstOrderFilter(observed.astype(np.float64), 1.0, decay)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        np.divide(numerator, denominator, out=average)
+    average[np.cumsum(observed, axis=0) < max(minPeriods, 1)] = np.nan
+
+    return average
+
+
+@profiling.timed('indicator.macd')
+def macd(close, fastEMA=12, slowEMA=26, signalEMA=9, out=None):
+    """
+    close : numpy array
+        Close prices
+    fastEMA, slowEMA, signalEMA : int
+        Periods of the fast, slow and signal exponential moving averages
+    out : tuple of two numpy arrays
+        Optional (signal, macd) arrays to write the results into
+
+    Returns
+    -------
+    signal, macd : numpy arrays
+        See MACD
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np
+    """
+
+    close = _asArray(close)
+    signal, macdLine = out if out is not None else (None, None)
+    macdLine = ema(close, fastEMA, fastEMA, out=macdLine)
+    macdLine -= ema(close, slowEMA, slowEMA)
+    signal = ema(macdLine, signalEMA, signalEMA, out=signal)
+
+    return signal, macdLine
+
+
+@profiling.timed('indicator.stochastic')
+def stochastic(high, low, close, n=14, out=None):
+    """
+    high, low, close : numpy array
+        Prices of each bar
+    n : int
+        Number of periods for the low minimum and high maximum
+    out : numpy array
+        Optional array to write the result into
+
+    Returns
+    -------
+    stochastic : numpy array
+        See Stochastic
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np
+    """
+
+    high, low, close = _asArray(high), _asArray(low), _asArray(close)
+    k = _output(out, close.shape)
+
+    lowest = rollingMin(low, n)
+    highest = rollingMax(high, n)
+    np.subtract(close, lowest, out=k)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        k /= highest - lowest
+    k *= 100
+
+    return k
+
+
+@profiling.timed('indicator.adx')
+def adx(high, low, close, n=14, out=None):
+    """
+    high, low, close : numpy array
+        Prices of each bar
+    n : int
+        Number of periods for the smoothed average windows
+    out : numpy array
+        Optional array to write the result into
+
+    Returns
+    -------
+    adx : numpy array
+        See ADX
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np
+    """
+
+    high, low, close = _asArray(high), _asArray(low), _asArray(close)
+    DMplus, DMminus = directionalMovement(high, low)
+
+    # n period Wilder sums, starting from the simple sum of bars 1 to n
+    TRn = wilderSum(trueRange(high, low, close), n)
+    DMplusN = wilderSum(DMplus, n)
+    DMminusN = wilderSum(DMminus, n)
+    del DMplus, DMminus
+
+    return directionalIndex(TRn, DMplusN, DMminusN, n, out=out)
+
+
+def directionalMovement(high, low):
+    """
+    high, low : numpy array
+        Prices of each bar
+
+    Returns
+    -------
+    DMplus, DMminus : numpy arrays
+        Directional movement up and down, zero where it isn't the larger move
+        or is negative (and on the first bar)
+
+    Package requirements
+    -------
+    numpy as np
+    """
+
+    high, low = _asArray(high), _asArray(low)
+    upMove = np.full(high.shape, np.nan)
+    downMove = np.full(high.shape, np.nan)
+    np.subtract(high[1:], high[:-1], out=upMove[1:])
+    np.subtract(low[:-1], low[1:], out=downMove[1:])
+
+    # nan comparisons are False, so the first bar comes out as zero
+    with np.errstate(invalid='ignore'):
+        DMplus = np.where((upMove > downMove) & (upMove > 0), upMove, 0.0)
+        DMminus = np.where((downMove > upMove) & (downMove > 0), downMove, 0.0)
+
+    return DMplus, DMminus
+
+
+@profiling.timed('indicator.wilderSum')
+def wilderSum(values, n):
+    """
+    n period Wilder sum of the values (true range, directional movement),
+    seeded with the simple sum of bars 1 to n and nan before bar n
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np
+    """
+
+    values = _asArray(values)
+    seed = values[1:n+1].sum(axis=0) if len(values) > n else np.nan
+
+    return _wilderSmooth(values, n, n, seed)
+
+
+@profiling.timed('indicator.directionalIndex')
+def directionalIndex(TRn, DMplusN, DMminusN, n, out=None):
+    """
+    TRn, DMplusN, DMminusN : numpy array
+        n period Wilder sums of the true range and directional movement (see
+        wilderSum). They are used as working space and overwritten
+    n : int
+        Number of periods for the smoothed average windows
+    out : numpy array
+        Optional array to write the result into
+
+    Returns
+    -------
+    adx : numpy array
+        Wilder average of DX = 100 |DI+ - DI-| / (DI+ + DI-), seeded with the
+        mean of the first n valid DX values
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np
+    """
+
+    length = len(TRn)
+    result = _output(out, TRn.shape)
+
+    # DX worked out in place
+    with np.errstate(divide='ignore', invalid='ignore'):
+        DIplusN = np.divide(DMplusN, TRn, out=DMplusN)
+        DIplusN *= 100
+        DIminusN = np.divide(DMminusN, TRn, out=DMminusN)
+        DIminusN *= 100
+        DIsum = np.add(DIplusN, DIminusN, out=TRn)
+        DX = np.subtract(DIplusN, DIminusN, out=DIplusN)
+        np.abs(DX, out=DX)
+        DX /= DIsum
+        DX *= 100
+
+    # Mean of the first n valid DX values, then the Wilder average
+    first = 2*n - 1
+    if length > first:
+        window = DX[first-n+1:first+1]
+        valid = ~np.isnan(window)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            seed = np.where(valid, window, 0.0).sum(axis=0) / valid.sum(axis=0)
+    else:
+        seed = np.nan
+    result[:] = _wilderSmooth(DX, n, first, seed, 1/n)
+
+    return result
+
+# %% 8. Batch (multi ticker) indicators
+
+
+'''
+The indicators for a whole universe of tickers at once, on (time x ticker)
+arrays lined up on the union of all the tickers' bar times (see panelArrays).
+
+Tickers don't all have a bar at every time (different listing dates, halts,
+missing data), so before computing anything each column is compacted: its
+bars are moved to the top of the column in time order with a stable argsort
+of the missing mask, and the gaps pushed to the bottom. Every ticker then
+starts its warm up on its own first bar and skips its own missing bars, just
+as though it had been run on its own dataframe. The array functions above run
+down all the columns in one vectorised pass and the results are put back in
+their original rows (nan where the ticker has no bar).
+'''
+
+Panel = namedtuple('Panel', ['index', 'tickers', 'open', 'high', 'low', 'close',
+                             'volume', 'present'])
+
+
+def panelArrays(data):
+    """
+    Parameters
+    ----------
+    data : dict or Dataframe
+        Ticker -> ohlcv dataframe, or a wide dataframe with (field, ticker) or
+        (ticker, field) MultiIndex columns
+
+    Returns
+    -------
+    Panel : namedtuple
+        index : DatetimeIndex
+            Union of the bar times of all the tickers
+        tickers : list of str
+        open, high, low, close, volume : numpy arrays
+            (time x ticker), nan where a ticker has no bar
+        present : numpy array of bool
+            (time x ticker), True where a ticker has a bar
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np
+    """
+
+    fields = ('open', 'high', 'low', 'close', 'volume')
+    if isinstance(data, pd.DataFrame):
+        # Split into one frame per ticker. Rows where a ticker has nothing at
+        # all are bars it doesn't have
+        levels = [str(v).lower() for v in data.columns.get_level_values(0)]
+        tickerLevel = 1 if 'close' in levels else 0
+        data = {ticker: data.xs(ticker, axis=1, level=tickerLevel).dropna(how='all')
+                for ticker in data.columns.get_level_values(tickerLevel).unique()}
+
+    tickers = list(data)
+    frames = [data[ticker] for ticker in tickers]
+    index = pd.DatetimeIndex(frames[0].index if frames else [])
+    for df in frames[1:]:
+        index = index.union(df.index)
+
+    arrays = {field: np.full((len(index), len(tickers)), np.nan) for field in fields}
+    present = np.zeros((len(index), len(tickers)), dtype=bool)
+    for j, df in enumerate(frames):
+        rows = index.get_indexer(df.index)
+        present[rows, j] = True
+        columns = {str(c).lower(): c for c in df.columns}
+        for field in fields:
+            if field in columns:
+                arrays[field][rows, j] = df[columns[field]].to_numpy(dtype=np.float64)
+
+    return Panel(index, tickers, present=present, **arrays)
+
+
+def _compacted(present, arrays):
+    """
+    Move each column's present rows to the top (in time order), nan below.
+    Returns the flat positions the compacted values came from (to put the
+    results back) and the compacted arrays
+    """
+
+    order = np.argsort(~present, axis=0, kind='stable')
+    order *= present.shape[1]
+    order += np.arange(present.shape[1])
+    missing = present.ravel().take(order)
+    np.logical_not(missing, out=missing)
+    compacted = []
+    for values in arrays:
+        values = _asArray(values).ravel().take(order)
+        values[missing] = np.nan
+        compacted.append(values)
+
+    return order, compacted
+
+
+def _scattered(positions, present, result):
+    """
+    Put a result computed on compacted arrays back on the (time x ticker) grid,
+    nan where a ticker has no bar
+    """
+
+    values = np.empty(result.shape)
+    values.ravel()[positions.ravel()] = result.ravel()
+    values[~present] = np.nan
+
+    return values
+
+
+def _batch(function, arrays, present, nOutputs=1, **parameters):
+    """
+    Run an array function down every column of (time x ticker) arrays, each
+    column only over the rows where its ticker has a bar
+    """
+
+    frame = arrays[0] if isinstance(arrays[0], pd.DataFrame) else None
+    arrays = [_asArray(values) for values in arrays]
+    if present is None:
+        # A ticker has a bar wherever any of its inputs is a number
+        present = np.zeros(arrays[0].shape, dtype=bool)
+        for values in arrays:
+            present |= ~np.isnan(values)
+    present = np.asarray(present, dtype=bool)
+
+    if present.all():
+        results = function(*arrays, **parameters)
+    else:
+        positions, compacted = _compacted(present, arrays)
+        results = function(*compacted, **parameters)
+        results = results if nOutputs > 1 else (results,)
+        scattered = [_scattered(positions, present, result) for result in results]
+        results = tuple(scattered) if nOutputs > 1 else scattered[0]
+
+    if frame is not None:
+        wrap = lambda values: pd.DataFrame(values, index=frame.index, columns=frame.columns)
+        results = tuple(map(wrap, results)) if nOutputs > 1 else wrap(results)
+
+    return results
+
+
+@profiling.timed('indicator.batchATR')
+def batchATR(high, low, close, n=14, present=None):
+    """
+    Parameters
+    ----------
+    high, low, close : numpy arrays or Dataframes
+        (time x ticker) prices, e.g. from panelArrays
+    n : int
+        Number of periods in the moving average of the true range
+    present : numpy array of bool
+        (time x ticker), True where a ticker has a bar. If not given, a ticker
+        has a bar wherever any of the prices is a number
+
+    Returns
+    -------
+    atr : numpy array or Dataframe
+        (time x ticker) average true range, each column the same as ATR on the
+        ticker on its own
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np
+    """
+
+    return _batch(atr, [high, low, close], present, n=n)
+
+
+@profiling.timed('indicator.batchMACD')
+def batchMACD(close, fastEMA=12, slowEMA=26, signalEMA=9, present=None):
+    """
+    Parameters
+    ----------
+    close : numpy array or Dataframe
+        (time x ticker) close prices, e.g. from panelArrays
+    fastEMA, slowEMA, signalEMA : int
+        Periods of the fast, slow and signal exponential moving averages
+    present : numpy array of bool
+        (time x ticker), True where a ticker has a bar. If not given, wherever
+        close is a number
+
+    Returns
+    -------
+    signal, macd : numpy arrays or Dataframes
+        (time x ticker), each column the same as MACD on the ticker on its own
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np
+    """
+
+    return _batch(macd, [close], present, nOutputs=2, fastEMA=fastEMA, slowEMA=slowEMA,
+                  signalEMA=signalEMA)
+
+
+@profiling.timed('indicator.batchStochastic')
+def batchStochastic(high, low, close, n=14, present=None):
+    """
+    Parameters
+    ----------
+    high, low, close : numpy arrays or Dataframes
+        (time x ticker) prices, e.g. from panelArrays
+    n : int
+        Number of periods for the low minimum and high maximum
+    present : numpy array of bool
+        See batchATR
+
+    Returns
+    -------
+    stochastic : numpy array or Dataframe
+        (time x ticker), each column the same as Stochastic on the ticker on
+        its own
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np
+    """
+
+    return _batch(stochastic, [high, low, close], present, n=n)
+
+
+@profiling.timed('indicator.batchADX')
+def batchADX(high, low, close, n=14, present=None):
+    """
+    Parameters
+    ----------
+    high, low, close : numpy arrays or Dataframes
+        (time x ticker) prices, e.g. from panelArrays
+    n : int
+        Number of periods for the smoothed average windows
+    present : numpy array of bool
+        See batchATR
+
+    Returns
+    -------
+    adx : numpy array or Dataframe
+        (time x ticker), each column the same as ADX on the ticker on its own
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np
+    """
+
+    return _batch(adx, [high, low, close], present, n=n)
+
+# %% 9. Backends
+
+
+'''
+The recursions the indicators are built on are sequential - the EMAs behind
+MACD and the Wilder smoothing in ADX are first order filters
+(y[i] = gain*x[i] + decay*y[i-1]) and Stochastic needs rolling minimums and
+maximums. They all go through the two functions below, which run them with
+one of two backends:
+    'numpy' : pandas' ewm (a first order filter with gain 1 - decay, so x is
+        scaled to match) and the van Herk / Gil-Werman rolling min / max (the
+        default)
+    'numba' : simple loops compiled by numba's JIT, if numba is installed
+
+Switch with setBackend('numba') (or 'auto' to use numba only if it's there).
+Compiled functions are cached on disk by numba, and warmup() compiles (or
+loads) them up front, so e.g. a live loop doesn't pay for it on its first bar.
+Everything is passed to the kernels as C contiguous 2D float64 arrays so only
+one version of each is ever compiled.
+'''
+
+BACKEND = 'numpy'
+_KERNELS = {}
+
+
+def setBackend(backend='auto'):
+    """
+    Parameters
+    ----------
+    backend : str
+        'numpy', 'numba', or 'auto' for numba if it is installed and numpy
+        otherwise
+
+    Returns
+    -------
+    backend : str
+        The backend now in use
+
+    Package requirements
+    -------
+    numba (optional)
+    """
+
+    global BACKEND
+
+    if backend not in ('numpy', 'numba', 'auto'):
+        raise ValueError("backend must be 'numpy', 'numba' or 'auto', not {!r}".format(backend))
+    if backend == 'numpy':
+        BACKEND = 'numpy'
+        return BACKEND
+
+    try:
+        import numba
+    except ImportError:
+        if backend == 'numba':
+            raise ImportError("the 'numba' backend needs numba installed (pip install numba)")
+        BACKEND = 'numpy'
+        return BACKEND
+
+    if not _KERNELS:
+        jit = numba.njit(cache=True, nogil=True)
+        _KERNELS['firstOrderFilter'] = jit(_firstOrderFilterLoop)
+        _KERNELS['rollingExtremum'] = jit(_rollingExtremumLoop)
+    BACKEND = 'numba'
+
+    return BACKEND
+
+
+def warmup():
+    """
+    Compile (or load from numba's cache) everything the current backend
+    needs by running each indicator once on a few bars of made up data
+    """
+
+    x = np.linspace(1.0, 2.0, 40)
+    for values in (x, np.column_stack((x, x))):
+        atr(values + 0.1, values - 0.1, values)
+        macd(values)
+        stochastic(values + 0.1, values - 0.1, values)
+        adx(values + 0.1, values - 0.1, values)
+
+
+def _asColumns(values):
+    """
+    1D or 2D values as a C contiguous 2D float64 array (time x column)
+    """
+
+    return np.ascontiguousarray(np.asarray(values, dtype=np.float64).reshape(len(values), -1))
+
+
+def _firstOrderFilter(x, gain, decay, initial=0.0):
+    """
+    y[i] = gain*x[i] + decay*y[i-1] down axis 0 of x (1D or 2D), starting
+    from y[-1] = initial (a scalar or one value per column)
+    """
+
+    if BACKEND == 'numba':
+        columns = _asColumns(x)
+        initial = np.ascontiguousarray(np.broadcast_to(initial, columns.shape[1]),
+                                       dtype=np.float64)
+        y = _KERNELS['firstOrderFilter'](columns, float(gain), float(decay), initial,
+                                         np.empty_like(columns))
+        return y.reshape(np.shape(x))
+
+    # ewm(adjust=False) is y[i] = alpha*z[i] + (1 - alpha)*y[i-1] starting from
+    # y[0] = z[0], so scale x by gain/alpha and put the initial value in front.
+    # (Unlike scipy's lfilter this doesn't add a second to the import time)
+    columns = _asColumns(x)
+    alpha = 1 - decay
+    z = np.empty((len(columns) + 1, columns.shape[1]))
+    z[0] = initial
+    np.multiply(columns, gain/alpha, out=z[1:])
+    y = pd.DataFrame(z, copy=False).ewm(alpha=alpha, adjust=False).mean() \
+        .to_numpy(copy=True)
+
+    # ewm skips over nan, the recursion carries a nan (in x or the initial
+    # value) on to every later value
+    missing = np.isnan(z)
+    if missing.any():
+        y[np.logical_or.accumulate(missing, axis=0)] = np.nan
+    y = y[1:]
+
+    return y.reshape(np.shape(x))
+
+
+def _rollingExtremum(x, n, sign):
+    """
+    Rolling maximum (sign 1) or minimum (sign -1) of the last n values down
+    axis 0 of x (1D or 2D). nan until n values are available or if any value
+    in the window is nan, as pandas rolling(n).max() / .min()
+    """
+
+    if BACKEND == 'numba':
+        columns = _asColumns(x)
+        y = _KERNELS['rollingExtremum'](columns, int(n), float(sign),
+                                        np.empty_like(columns))
+        return y.reshape(np.shape(x))
+
+    return _vanHerkGilWerman(x, n, sign)
+
+
+def _vanHerkGilWerman(x, n, sign):
+    """
+    Numpy version of _rollingExtremum. The rows are cut into blocks of n and
+    the running maximum taken forwards and backwards within each block. Any
+    window of n rows spans at most two blocks, so its maximum is the larger
+    of the backward maximum at its start and the forward maximum at its end -
+    three passes over the data whatever the window length
+    """
+
+    columns = _asColumns(x)
+    length, nColumns = columns.shape
+    extremum = np.full(columns.shape, np.nan)
+    if length < n:
+        return extremum.reshape(np.shape(x))
+
+    # Minimums are maximums of -x. nan is left out here (as -inf) and put back
+    # at the end for any window containing one
+    missing = np.isnan(columns)
+    padded = np.full((-(-length//n)*n, nColumns), -np.inf)
+    np.multiply(columns, sign, out=padded[:length])
+    padded[:length][missing] = -np.inf
+    blocks = padded.reshape(-1, n, nColumns)
+    forward = np.maximum.accumulate(blocks, axis=1).reshape(padded.shape)
+    backward = np.maximum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].reshape(padded.shape)
+    np.maximum(backward[:length-n+1], forward[n-1:length], out=extremum[n-1:])
+    extremum[n-1:] *= sign
+
+    counts = np.cumsum(missing, axis=0)
+    windowMissing = counts[n-1:].copy()
+    windowMissing[1:] -= counts[:-n]
+    extremum[n-1:][windowMissing > 0] = np.nan
+
+    return extremum.reshape(np.shape(x))
+
+
+def _firstOrderFilterLoop(x, gain, decay, initial, out):
+    """
+    Loop version of _firstOrderFilter for numba, one row at a time so the
+    inner loop runs along the (contiguous) columns
+    """
+
+    y = initial.copy()
+    for i in range(x.shape[0]):
+        for j in range(x.shape[1]):
+            y[j] = gain*x[i, j] + decay*y[j]
+            out[i, j] = y[j]
+
+    return out
+
+
+def _rollingExtremumLoop(x, n, sign, out):
+    """
+    Loop version of _rollingExtremum for numba. Each column keeps a
+    monotonic queue of the rows that could still be the extremum of a later
+    window, so each value is added and removed once - O(1) per value
+    """
+
+    queue = np.empty(x.shape[0], dtype=np.int64)
+    for j in range(x.shape[1]):
+        head = 0
+        tail = 0
+        lastNan = -n
+        for i in range(x.shape[0]):
+            value = x[i, j]
+            if value != value:
+                lastNan = i
+            else:
+                while tail > head and sign*x[queue[tail-1], j] <= sign*value:
+                    tail -= 1
+                queue[tail] = i
+                tail += 1
+            while tail > head and queue[head] <= i - n:
+                head += 1
+            if i < n - 1 or lastNan > i - n:
+                out[i, j] = np.nan
+            else:
+                out[i, j] = x[queue[head], j]
+
+    return out
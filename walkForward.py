@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+Created on %(date)s
+
+@author: Treacher
+
+Contains: walk forward (out of sample) testing of the ADX + MACD strategy
+"""
+
+# %%% 0. Notes
+
+'''
+Tuning the strategy on one date range and judging it on the same range says
+little about how it will do on data it hasn't seen. Walk forward testing
+splits the history into folds of a training window followed by a test window:
+    1) The parameters (by default just the ADX threshold of trade_signal) are
+       picked on the training window with optimizer.optimize
+    2) The strategy is run with them over the test window that follows, which
+       played no part in choosing them
+    3) The folds step forward by the length of a test window, so the test
+       windows join up into one out of sample return series
+Rolling folds keep the training window a fixed length, anchored folds start
+every training window at the beginning of the history (expanding window).
+
+The indicators in a test window are computed over the training window before
+it as well, so they are warmed up, but only the test bars are scored.
+
+Folds run concurrently in a pool of worker processes. The price data is not
+sent to the workers - each one opens the ohlcvCache.OHLCVCache column files
+as read only memory maps and takes just the rows of its fold, so the dataset
+is shared through the operating system's page cache rather than copied into
+every worker. Data passed in as dataframes is written to a temporary cache
+first.
+
+Note: on Windows (spawn start method) the pool re-imports the calling script,
+so only use workers > 1 from code behind an if __name__ == '__main__' guard.
+'''
+
+
+# %% 1. Import libraries
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+
+import backtest as bt
+import optimizer
+import profiling
+from ohlcvCache import OHLCVCache, COLUMNS
+
+
+# %% 2. Folds
+
+Fold = namedtuple('Fold', ['trainStart', 'testStart', 'testEnd'])
+
+
+def walkForwardFolds(nBars, trainBars, testBars, anchored=False):
+    """
+    Parameters
+    ----------
+    nBars : int
+        Number of bars in the history
+    trainBars, testBars : int
+        Bars in each training and test window
+    anchored : bool
+        If True, every training window starts at the first bar (and grows
+        with each fold), otherwise it is the trainBars before the test window
+
+    Returns
+    -------
+    folds : list of Fold
+        Bar numbers of each fold: training on trainStart:testStart, testing
+        on testStart:testEnd. Test windows follow on from each other, the last
+        one may be shorter
+
+    Package requirements
+    -------
+    numpy as np
+    """
+
+    testStarts = np.arange(trainBars, nBars, testBars)
+
+    return [Fold(0 if anchored else start - trainBars, start, min(start + testBars, nBars))
+            for start in testStarts.tolist()]
+
+
+# %% 3. Walk forward test
+
+THRESHOLD_GRID = {'fastEMA': [12], 'slowEMA': [26], 'signalEMA': [9], 'adxPeriod': [14],
+                  'adxThreshold': list(range(15, 36))}
+
+WalkForwardResult = namedtuple('WalkForwardResult', ['folds', 'returns', 'metrics'])
+
+
+def walkForward(data, trainBars, testBars, anchored=False, grid=None, timeframe='1day',
+                holdPositions=True, periodsPerYear=252, rankBy='sharpe', workers=None):
+    """
+    Parameters
+    ----------
+    data : OHLCVCache or dict
+        Cache holding the bars of the tickers (all of them are used, or pass
+        (cache, tickers) to pick some), or ticker -> ohlcv dataframe
+    trainBars, testBars : int
+        Bars in each training and test window, counted on the union of all
+        the tickers' bar times
+    anchored : bool
+        See walkForwardFolds
+    grid : dict
+        Parameter name -> values to pick from on each training window,
+        defaults to THRESHOLD_GRID (the ADX threshold with the other
+        parameters fixed). See optimizer.parameterCombinations
+    timeframe : str
+        Bar size in the cache, e.g. '1day'
+    holdPositions, periodsPerYear, rankBy :
+        See optimizer.optimize
+    workers : int
+        Number of worker processes (folds run in parallel), defaults to the
+        number of cpus. 1 runs in the current process
+
+    Returns
+    -------
+    WalkForwardResult : namedtuple
+        folds : Dataframe
+            One row per fold with its dates, the chosen parameters, their
+            Sharpe ratio on the training window ('trainSharpe') and the
+            'sharpe', 'totalReturn' and 'maxDrawdown' on the test window
+        returns : Series
+            Out of sample portfolio return of every test bar
+        metrics : dict
+            optimizer.performanceMetrics of the out of sample returns
+
+    Package requirements
+    -------
+    pandas as pd\n
+    numpy as np\n
+    from concurrent.futures import ProcessPoolExecutor
+    """
+
+    if isinstance(data, dict):
+        with tempfile.TemporaryDirectory() as cacheDir:
+            cache = OHLCVCache(cacheDir)
+            for ticker, df in data.items():
+                bars = df.rename(columns=str.lower)
+                cache.update(ticker, timeframe, bars, bars.index[0].strftime('%Y-%m-%d'),
+                             bars.index[-1].strftime('%Y-%m-%d'))
+            return walkForward(cache, trainBars, testBars, anchored, grid, timeframe,
+                               holdPositions, periodsPerYear, rankBy, workers)
+
+    cache, tickers = data if isinstance(data, tuple) else (data, None)
+    if tickers is None:
+        folder = os.path.join(cache.cacheDir, timeframe)
+        tickers = sorted(os.listdir(folder)) if os.path.isdir(folder) else []
+    tickers = [t for t in tickers if cache.meta(t, timeframe) is not None]
+
+    # Folds are counted on the union of the bar times (read from the memory maps)
+    times = np.unique(np.concatenate([cache.arrays(t, timeframe)['timestamp']
+                                      for t in tickers] or [np.empty(0, dtype=np.int64)]))
+    folds = walkForwardFolds(len(times), trainBars, testBars, anchored)
+    if not folds:
+        raise ValueError('{} bars is not enough for a {} bar training window'.format(
+            len(times), trainBars))
+
+    # Each worker gets the fold's times, not its data
+    end = np.append(times, np.iinfo(np.int64).max)
+    tasks = [(times[fold.trainStart], times[fold.testStart], end[fold.testEnd])
+             for fold in folds]
+    tz = cache.meta(tickers[0], timeframe)['tz']
+    settings = (cache.cacheDir, timeframe, tz, tickers, grid or THRESHOLD_GRID,
+                holdPositions, periodsPerYear, rankBy)
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+
+    if workers == 1:
+        foldResults = [_runFold(task, settings) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            foldResults = profiling.poolMap(pool, _runFold, tasks, [settings]*len(tasks))
+
+    rows, returns = zip(*foldResults)
+    returns = pd.concat(returns)
+
+    metrics = optimizer.performanceMetrics(returns.to_numpy(), periodsPerYear)
+
+    return WalkForwardResult(pd.DataFrame(list(rows)), returns,
+                             {name: float(value) for name, value in metrics.items()})
+
+
+# %% 4. Worker functions
+
+
+def _runFold(task, settings):
+    """
+    Worker function: pick the parameters on the training window and score them
+    on the test window. Returns (summary row, out of sample returns)
+    """
+
+    trainStart, testStart, testEnd = task
+    cacheDir, timeframe, tz, tickers, grid, holdPositions, periodsPerYear, rankBy = settings
+    cache = OHLCVCache(cacheDir)
+
+    window = {}
+    for ticker in tickers:
+        df = _readWindow(cache, ticker, timeframe, trainStart, testEnd, tz)
+        if len(df):
+            window[ticker] = df
+    testFrom = pd.Timestamp(testStart, tz='UTC').tz_convert(tz)
+    train = {t: df[df.index < testFrom] for t, df in window.items()}
+    train = {t: df for t, df in train.items() if len(df)}
+
+    ranking = optimizer.optimize(train, grid, holdPositions=holdPositions,
+                                 periodsPerYear=periodsPerYear, rankBy=rankBy, workers=1)
+    params = {p: ranking[p].iloc[0].item() for p in optimizer.PARAMETERS}
+
+    # Indicators over the whole window so they're warmed up, scored on the test bars
+    panel = bt.panelBacktest(window, holdPositions=holdPositions, workers=1, **params)
+    returns = panel.portfolio['return']
+    returns = returns[returns.index >= testFrom]
+    metrics = optimizer.performanceMetrics(returns.to_numpy(), periodsPerYear)
+
+    row = {'trainStart': pd.Timestamp(trainStart, tz='UTC').tz_convert(tz), 'testStart': testFrom,
+           'testEnd': returns.index[-1] if len(returns) else testFrom}
+    row.update(params)
+    row['trainSharpe'] = ranking['sharpe'].iloc[0]
+    row.update({name: float(value) for name, value in metrics.items()})
+
+    return row, returns
+
+
+def _readWindow(cache, ticker, timeframe, start, end, tz):
+    """
+    Bars of a ticker with start <= time < end (epoch ns), taken from the
+    memory mapped columns so only the rows of the window are read
+    """
+
+    arrays = cache.arrays(ticker, timeframe)
+    first, last = np.searchsorted(arrays['timestamp'], [start, end])
+    index = pd.to_datetime(np.asarray(arrays['timestamp'][first:last]), utc=True).tz_convert(tz)
+
+    return pd.DataFrame({c: np.asarray(arrays[c][first:last]) for c in COLUMNS},
+                        index=index)